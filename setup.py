@@ -86,6 +86,7 @@ setup(
     scripts=[
         'bin2sna.py',
         'bin2tap.py',
+        'skool2all.py',
         'skool2asm.py',
         'skool2bin.py',
         'skool2ctl.py',
@@ -15,6 +15,9 @@
 # SkoolKit. If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import operator
+import re
+import string
 import sys
 import os
 import posixpath
@@ -137,6 +140,84 @@ def format_template(template__, name__, **fields):
     except KeyError as e:
         raise SkoolKitError("Unknown field '{}' in {} template".format(e.args[0], name__))
 
+_CONVERSIONS = {'r': repr, 's': str, 'a': ascii}
+
+# The name of a replacement field: an argument name followed by any number of
+# '.attribute' or '[index]' parts
+_FIELD_NAME_RE = re.compile(r'([^.[]+)((?:\.[^.[]+|\[[^\]]+\])*)\Z')
+_FIELD_PART_RE = re.compile(r'\.([^.[]+)|\[([^\]]+)\]')
+
+def _chain(get, get_next):
+    return lambda fields: get_next(get(fields))
+
+def _get_field_getter(field_name, subs):
+    # Return a function that looks up the replacement field 'field_name' in a
+    # dictionary of fields, or in 'subs' if the field's argument name is there
+    match = _FIELD_NAME_RE.match(field_name)
+    if not match or match.group(1).isdigit():
+        raise ValueError
+    arg_name = match.group(1)
+    if arg_name in subs:
+        get = lambda fields: subs[arg_name]
+    else:
+        get = operator.itemgetter(arg_name)
+    for attr, index in _FIELD_PART_RE.findall(match.group(2)):
+        if attr:
+            get = _chain(get, operator.attrgetter(attr))
+        elif index.isdigit():
+            get = _chain(get, operator.itemgetter(int(index)))
+        else:
+            get = _chain(get, operator.itemgetter(index))
+    return get
+
+def _formatter(spec, convert):
+    if convert:
+        return lambda value: format(convert(value), spec)
+    return lambda value: format(value, spec)
+
+def _compile_fields(template, subs):
+    # Return a printf-style version of 'template' (with one '%s' for each
+    # replacement field) and a list of getters for the values of the
+    # replacement fields; raise ValueError if the template is malformed or uses
+    # positional or nested replacement fields
+    literals = []
+    getters = []
+    for literal, field_name, spec, conversion in string.Formatter().parse(template):
+        literals.append(literal.replace('%', '%%'))
+        if field_name is not None:
+            if '{' in spec or (conversion and conversion not in _CONVERSIONS):
+                raise ValueError
+            get = _get_field_getter(field_name, subs)
+            if spec or conversion:
+                # An empty format spec with no conversion is left to '%s', which
+                # gives the same result as format(value, '')
+                get = _chain(get, _formatter(spec, _CONVERSIONS.get(conversion)))
+            getters.append(get)
+            literals.append('%s')
+    return ''.join(literals), getters
+
+def compile_template(template, name, subs=None):
+    # Return a function that takes a dictionary of replacement fields and
+    # returns the template formatted as by format_template(), with the values
+    # in 'subs' taking precedence over the replacement fields
+    subs = subs or {}
+    try:
+        text, getters = _compile_fields(template, subs)
+    except ValueError:
+        # Leave any error to be reported when the template is formatted
+        def render(fields):
+            fields.update(subs)
+            return format_template(template, name, **fields)
+        return render
+    def render(fields):
+        try:
+            return text % tuple([get(fields) for get in getters])
+        except ValueError as e:
+            raise SkoolKitError('Failed to format {} template: {}'.format(name, e.args[0]))
+        except KeyError as e:
+            raise SkoolKitError("Unknown field '{}' in {} template".format(e.args[0], name))
+    return render
+
 def normpath(*paths):
     return posixpath.normpath(posixpath.join(*[p.replace('\\', '/') for p in paths]))
 
@@ -49,8 +49,10 @@ COMMANDS = {
         'AsmLabels': (0, 'asm_labels'),
         'AsmOnePage': (0, 'asm_one_page'),
         'Base': (0, 'base'),
+        'CacheDir': ('', 'cache_dir'),
         'Case': (0, 'case'),
         'CreateLabels': (0, 'create_labels'),
+        'ImageCacheSize': (100, 'image_cache_size'),
         'JoinCss': ('', 'single_css'),
         'OutputDir': ('.', 'output_dir'),
         'Quiet': (0, 'quiet'),
@@ -61,6 +63,7 @@ COMMANDS = {
     },
     'skool2asm': {
         'Base': (0, 'base'),
+        'CacheDir': ('', 'cache_dir'),
         'Case': (0, 'case'),
         'CreateLabels': (0, 'create_labels'),
         'Quiet': (0, 'quiet'),
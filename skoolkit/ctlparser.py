@@ -145,7 +145,7 @@ class CtlParser:
                         loop_end = start + count * (end - start)
                         if loop_end > 65536:
                             warn('Loop crosses 64K boundary:\n{}'.format(s_line))
-                        self._loops.append((start, end, count, repeat_entries))
+                        self._loops.append((start, end, count, repeat_entries, max_address))
                         self._subctls[loop_end] = None
                 else:
                     self._subctls[start] = ctl.lower()
@@ -168,7 +168,6 @@ class CtlParser:
                 self._asm_directives.setdefault(address, []).append(directive)
 
         self._terminate_multiline_comments()
-        self._unroll_loops(max_address)
         self._ctls[max_address] = 'i'
 
     def _parse_ctl_line(self, line, entry_addresses):
@@ -243,85 +242,131 @@ class CtlParser:
             if end is None or end > max_end:
                 self._multiline_comments[address] = (max_end, text)
 
-    def _unroll_loops(self, max_address):
-        for start, end, count, repeat_entries in self._loops:
-            for directives in (self._subctls, self._mid_block_comments, self._instruction_comments, self._lengths):
-                self._repeat_directives(directives, start, end, count, max_address)
-            self._repeat_multiline_comments(start, end, count, max_address)
-            if repeat_entries:
-                for directives in (self._ctls, self._titles, self._descriptions, self._registers, self._end_comments):
-                    self._repeat_directives(directives, start, end, count, max_address)
-
-    def _repeat_directives(self, directives, start, end, count, max_address):
-        interval = end - start
-        repeated = {k: v for k, v in directives.items() if start <= k < end}
-        for addr, value in repeated.items():
-            for i in range(1, count):
-                address = addr + i * interval
-                if address < max_address:
-                    directives[address] = value
-                else:
-                    break
-
-    def _repeat_multiline_comments(self, start, end, count, max_address):
-        interval = end - start
-        repeated = {k: v for k, v in self._multiline_comments.items() if start <= k < end}
-        for addr, (mlc_end, comment) in repeated.items():
-            for i in range(1, count):
-                offset = i * interval
-                address = addr + offset
-                if address < max_address:
-                    self._multiline_comments[address] = (mlc_end + offset, comment)
-                else:
-                    break
-
     def get_blocks(self):
+        # Unroll the loops defined by L directives
+        loops = [loop[:3] + loop[4:] for loop in self._loops]
+        entry_loops = [loop[:3] + loop[4:] for loop in self._loops if loop[3]]
+        ctls = _unroll(self._ctls, entry_loops, 0, 65537)
+
         # Create top-level blocks
         blocks = []
-        block_addresses = sorted(self._ctls)
-        for i, address in enumerate(block_addresses[:-1]):
-            block = Block(self._ctls[address], address)
-            block.end = block_addresses[i + 1]
-            block.asm_directives = extract_entry_asm_directives(self._asm_directives.get(address, ()))
-            if self._asm_directives.get(address) == []:
-                del self._asm_directives[address]
+        block_addresses = sorted(ctls)
+        asm_directives = {}
+        for k in range(len(block_addresses) - 1):
+            address = block_addresses[k]
+            block = Block(ctls[address], address)
+            block.end = block_addresses[k + 1]
+            if address in self._asm_directives:
+                # Split off the entry-level directives without modifying the
+                # parser's own lists, so that get_blocks() may be called again
+                directives = self._asm_directives[address][:]
+                block.asm_directives = extract_entry_asm_directives(directives)
+                asm_directives[address] = directives
+            else:
+                block.asm_directives = []
             block.ignoreua_directives = tuple(self._ignoreua_directives.get(address, set()).intersection(ENTRY_COMMENT_TYPES))
-            block.title = self._titles.get(address)
-            block.description = self._descriptions.get(address, ())
-            block.registers = self._registers.get(address, ())
-            block.end_comment = self._end_comments.get(address, ())
             blocks.append(block)
 
+        if not blocks:
+            return blocks
+
+        start, end = blocks[0].start, blocks[-1].end
+        titles = _unroll(self._titles, entry_loops, start, end)
+        descriptions = _unroll(self._descriptions, entry_loops, start, end)
+        registers = _unroll(self._registers, entry_loops, start, end)
+        end_comments = _unroll(self._end_comments, entry_loops, start, end)
+        for block in blocks:
+            block.title = titles.get(block.start)
+            block.description = descriptions.get(block.start, ())
+            block.registers = registers.get(block.start, ())
+            block.end_comment = end_comments.get(block.start, ())
+
         # Create sub-blocks
-        for sub_address in sorted(self._subctls):
-            for block in blocks:
-                if block.start <= sub_address < block.end:
-                    block.add_block(self._subctls[sub_address], sub_address)
-                    break
+        subctls = _unroll(self._subctls, loops, start, end)
+        block_starts = [block.start for block in blocks]
+        for sub_address in _sorted_keys(subctls, start, end):
+            block = blocks[bisect.bisect_right(block_starts, sub_address) - 1]
+            block.add_block(subctls[sub_address], sub_address)
 
         # Set sub-block end addresses
         for block in blocks:
-            for i, sub_block in enumerate(block.blocks[1:]):
-                block.blocks[i].end = sub_block.start
+            for k, sub_block in enumerate(block.blocks[1:]):
+                block.blocks[k].end = sub_block.start
             block.blocks[-1].end = block.end
 
         # Set sub-block attributes
-        asm_directives = tuple(self._asm_directives.items())
+        lengths = _unroll(self._lengths, loops, start, end)
+        mid_block_comments = _unroll(self._mid_block_comments, loops, start, end)
+        instruction_comments = _unroll(self._instruction_comments, loops, start, end)
+        multiline_comments = _unroll(self._multiline_comments, loops, start, end, True)
+        asm_dir_addresses = _sorted_keys(self._asm_directives, start, end)
+        ignoreua_addresses = _sorted_keys(self._ignoreua_directives, start, end)
         for block in blocks:
             for sub_block in block.blocks:
                 sub_address = sub_block.start
-                sub_block.sublengths = self._lengths.get(sub_address, ((None, None),))
-                sub_block.header = self._mid_block_comments.get(sub_address, ())
-                sub_block.comment = self._instruction_comments.get(sub_address) or ''
-                sub_block.multiline_comment = self._multiline_comments.get(sub_address)
-                sub_block.asm_directives = dict([d for d in asm_directives if sub_address <= d[0] < sub_block.end])
+                sub_block.sublengths = lengths.get(sub_address, ((None, None),))
+                sub_block.header = mid_block_comments.get(sub_address, ())
+                sub_block.comment = instruction_comments.get(sub_address) or ''
+                sub_block.multiline_comment = multiline_comments.get(sub_address)
+                sub_block.asm_directives = {}
+                for addr in _addresses_in_range(asm_dir_addresses, sub_address, sub_block.end):
+                    directives = asm_directives.get(addr, self._asm_directives[addr])
+                    if directives:
+                        sub_block.asm_directives[addr] = directives
                 sub_block.ignoreua_directives = {}
-                for addr, dirs in self._ignoreua_directives.items():
-                    if sub_address <= addr < sub_block.end:
-                        sub_block.ignoreua_directives[addr] = tuple(dirs.difference(ENTRY_COMMENT_TYPES))
+                for addr in _addresses_in_range(ignoreua_addresses, sub_address, sub_block.end):
+                    sub_block.ignoreua_directives[addr] = tuple(self._ignoreua_directives[addr].difference(ENTRY_COMMENT_TYPES))
 
         return blocks
 
+def _sorted_keys(directives, start, end):
+    return sorted(k for k in directives if start <= k < end)
+
+def _addresses_in_range(addresses, start, end):
+    return addresses[bisect.bisect_left(addresses, start):bisect.bisect_left(addresses, end)]
+
+def _unroll(directives, loops, min_address, max_address, shift=False):
+    # Return the directives in the given address range as they would be after
+    # unrolling each loop, in turn, over the whole address space. Only the
+    # repetitions that land in the range (and the loop bodies they are copied
+    # from) are computed. If 'shift' is True, each directive value is a tuple
+    # whose first element is an address that moves with the repetition.
+    if not loops:
+        return directives
+    addresses = sorted(directives)
+    cache = {}
+
+    # Index the loops by the 256-byte pages that their repetitions land in
+    pages = {}
+    for k, (start, end, count, max_addr) in enumerate(loops):
+        for page in range(end // 256, (min(start + count * (end - start), max_addr) - 1) // 256 + 1):
+            pages.setdefault(page, []).append(k)
+
+    def expand(num_loops, lo, hi):
+        key = (num_loops, lo, hi)
+        if key in cache:
+            return cache[key]
+        result = {a: directives[a] for a in _addresses_in_range(addresses, lo, hi)}
+        indexes = set()
+        for page in range(lo // 256, (hi - 1) // 256 + 1):
+            indexes.update(k for k in pages.get(page, ()) if k < num_loops)
+        for k in sorted(indexes):
+            start, end, count, max_addr = loops[k]
+            interval = end - start
+            r_lo, r_hi = max(lo, end), min(hi, start + count * interval, max_addr)
+            if r_lo < r_hi:
+                for addr, value in expand(k, start, end).items():
+                    for i in range(max(1, (r_lo - addr - 1) // interval + 1), min(count - 1, (r_hi - 1 - addr) // interval) + 1):
+                        offset = i * interval
+                        if shift:
+                            result[addr + offset] = (value[0] + offset, value[1])
+                        else:
+                            result[addr + offset] = value
+        cache[key] = result
+        return result
+
+    return expand(len(loops), min_address, max_address)
+
 class Block:
     def __init__(self, ctl, start, top=True):
         self.ctl = ctl
@@ -16,6 +16,15 @@
 
 from skoolkit.z80 import convert_case
 
+# Control flow types of an instruction
+FLOW_NONE = 0         # Continues to the next instruction
+FLOW_JUMP = 1         # JP nn, JR d
+FLOW_BRANCH = 2       # JP cc,nn, JR cc,d, DJNZ d
+FLOW_CALL = 3         # CALL nn, CALL cc,nn, RST n
+FLOW_RETURN = 4       # RET, RETI, RETN
+FLOW_COND_RETURN = 5  # RET cc
+FLOW_INDIRECT = 6     # JP (HL), JP (IX), JP (IY)
+
 class Instruction:
     def __init__(self, address, operation, data):
         self.address = address
@@ -64,6 +73,18 @@ class Disassembler:
             'd': '{}'
         }
 
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @snapshot.setter
+    def snapshot(self, snapshot):
+        self._snapshot = snapshot
+        self._decode_cache = {}
+
+    def flow(self, address):
+        return decode_flow(self.snapshot[address:address + 4], address)
+
     def num_str(self, value, num_bytes=0, base=None):
         if base:
             base = base[0]
@@ -86,21 +107,37 @@ class Disassembler:
         instructions = []
         address = start
         while address < end:
-            byte = self.snapshot[address]
-            decoder, template = self.ops[byte]
-            if template is None:
-                operation, length = decoder(self, address, base)
-            else:
-                operation, length = decoder(self, template, address, base)
-            if address + length <= 65536:
-                if self.asm_lower:
-                    operation = convert_case(operation)
-                instructions.append(Instruction(address, operation, self.snapshot[address:address + length]))
-            else:
-                instructions.append(self.defb_line(address, self.snapshot[address:65536]))
+            operation, data, length = self._decode(address, base)
+            instructions.append(Instruction(address, operation, data))
             address += length
         return instructions
 
+    def _decode(self, address, base):
+        # Decoded instructions are cached by address and operand base, and
+        # a cached instruction is reused only if its bytes are unchanged
+        key = (address, base)
+        cached = self._decode_cache.get(key)
+        if cached:
+            operation, data, length = cached
+            current = self.snapshot[address:address + len(data)]
+            if current == data:
+                return operation, current, length
+
+        decoder, template = self.ops[self.snapshot[address]]
+        if template is None:
+            operation, length = decoder(self, address, base)
+        else:
+            operation, length = decoder(self, template, address, base)
+        if address + length <= 65536:
+            if self.asm_lower:
+                operation = convert_case(operation)
+            data = self.snapshot[address:address + length]
+        else:
+            data = self.snapshot[address:65536]
+            operation = self.defb_dir(data)
+        self._decode_cache[key] = (operation, data, length)
+        return operation, self.snapshot[address:address + len(data)], length
+
     def defb_range(self, start, end, sublengths):
         if sublengths[0][0] or end - start <= self.defb_size:
             return [self.defb_line(start, self.snapshot[start:end], sublengths)]
@@ -1015,3 +1052,95 @@ class Disassembler:
     after_DDCB[238] = index, 'SET 5,(IX{0})'
     after_DDCB[246] = index, 'SET 6,(IX{0})'
     after_DDCB[254] = index, 'SET 7,(IX{0})'
+
+def _build_length_table(ops, prefix_length, default):
+    lengths = bytearray([default] * 256)
+    for opcode, (decoder, template) in ops.items():
+        if template is None:
+            lengths[opcode] = _PREFIX_LENGTHS[decoder]
+        else:
+            lengths[opcode] = _LENGTHS[decoder] + prefix_length
+    return lengths
+
+_LENGTHS = {
+    Disassembler.no_arg: 1,
+    Disassembler.byte_arg: 2,
+    Disassembler.word_arg: 3,
+    Disassembler.jr_arg: 2,
+    Disassembler.rst_arg: 1,
+    Disassembler.index: 2,
+    Disassembler.index_arg: 3
+}
+
+# Instruction lengths for decoders that do not use a template (0 means that
+# the length depends on the next byte)
+_PREFIX_LENGTHS = {
+    Disassembler.cb_arg: 2,
+    Disassembler.dd_arg: 0,
+    Disassembler.ed_arg: 0,
+    Disassembler.fd_arg: 0,
+    Disassembler.defb4: 4,
+    Disassembler.ddcb_arg: 4
+}
+
+# Flow types and target address types ('n': absolute, 'e': relative, 'r':
+# restart) of control flow instructions
+_FLOWS = {
+    16: (FLOW_BRANCH, 'e'),
+    24: (FLOW_JUMP, 'e'),
+    195: (FLOW_JUMP, 'n'),
+    201: (FLOW_RETURN, None),
+    205: (FLOW_CALL, 'n'),
+    233: (FLOW_INDIRECT, None)
+}
+for _opcode in (32, 40, 48, 56):
+    _FLOWS[_opcode] = (FLOW_BRANCH, 'e')
+for _opcode in range(192, 256, 8):
+    _FLOWS[_opcode] = (FLOW_COND_RETURN, None)
+    _FLOWS[_opcode + 2] = (FLOW_BRANCH, 'n')
+    _FLOWS[_opcode + 4] = (FLOW_CALL, 'n')
+    _FLOWS[_opcode + 7] = (FLOW_CALL, 'r')
+
+_ED_FLOWS = {_opcode: (FLOW_RETURN, None) for _opcode in range(69, 128, 8)}
+
+_DD_FLOWS = {233: (FLOW_INDIRECT, None)}
+
+_PREFIXES = {
+    221: (_build_length_table(Disassembler.after_DD, 1, 1), _DD_FLOWS),
+    237: (_build_length_table(Disassembler.after_ED, 1, 2), _ED_FLOWS),
+    253: (_build_length_table(Disassembler.after_DD, 1, 1), _DD_FLOWS)
+}
+
+_BASE_LENGTHS = _build_length_table(Disassembler.ops, 0, 1)
+
+_NO_FLOW = (FLOW_NONE, None)
+
+def decode_flow(data, address):
+    opcode = data[0]
+    if opcode in _PREFIXES:
+        lengths, flows = _PREFIXES[opcode]
+        if len(data) > 1:
+            opcode = data[1]
+        else:
+            opcode = 0
+    else:
+        lengths, flows = _BASE_LENGTHS, _FLOWS
+    length = lengths[opcode]
+    kind, target_type = flows.get(opcode, _NO_FLOW)
+    if length > len(data):
+        return len(data), kind, None
+    if target_type == 'n':
+        target = data[1] + 256 * data[2]
+    elif target_type == 'e':
+        offset = data[1]
+        if offset < 128:
+            target = address + 2 + offset
+        else:
+            target = address + offset - 254
+        if not 0 <= target < 65536:
+            target = None
+    elif target_type == 'r':
+        target = opcode - 199
+    else:
+        target = None
+    return length, kind, target
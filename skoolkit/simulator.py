@@ -0,0 +1,1211 @@
+# Copyright 2017 Richard Dymond (rjdymond@gmail.com)
+#
+# This file is part of SkoolKit.
+#
+# SkoolKit is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# SkoolKit is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# SkoolKit. If not, see <http://www.gnu.org/licenses/>.
+
+from functools import partial
+
+# Indexes of the registers and other CPU state in Simulator.registers
+A, F, B, C, D, E, H, L, IXh, IXl, IYh, IYl, SP, I, R = range(15)
+R7 = 15    # Bit 7 of R
+PC = 16
+T = 17     # T-states elapsed
+IFF = 18   # IFF1
+IFF2 = 19
+IM = 20
+HALT = 21  # 1 if a HALT instruction is being executed
+EI_T = 22  # Value of T just after the last EI instruction
+INT_T = 23 # Value of T at which the next interrupt is due
+xA, xF, xB, xC, xD, xE, xH, xL = range(24, 32) # Shadow registers
+
+# The number of T-states per frame (48K Spectrum)
+FRAME_DURATION = 69888
+
+# The number of T-states for which the interrupt line is active in each frame
+INT_ACTIVE = 32
+
+REGISTERS = {
+    'a': (A,), 'f': (F,), 'b': (B,), 'c': (C,), 'd': (D,), 'e': (E,), 'h': (H,), 'l': (L,),
+    'bc': (B, C), 'de': (D, E), 'hl': (H, L), 'ix': (IXh, IXl), 'iy': (IYh, IYl),
+    '^a': (xA,), '^f': (xF,), '^b': (xB,), '^c': (xC,), '^d': (xD,), '^e': (xE,), '^h': (xH,), '^l': (xL,),
+    '^bc': (xB, xC), '^de': (xD, xE), '^hl': (xH, xL), 'i': (I,), 'im': (IM,), 'iff': (IFF, IFF2)
+}
+
+PARITY = [4 * (1 - bin(v).count('1') % 2) for v in range(256)]
+SZ53 = [(v & 0xA8) | (0x40 if v == 0 else 0) for v in range(256)]
+SZ53P = [SZ53[v] | PARITY[v] for v in range(256)]
+
+# (mask, value) for the conditions NZ, Z, NC, C, PO, PE, P and M
+CONDITIONS = ((64, 0), (64, 64), (1, 0), (1, 1), (4, 0), (4, 4), (128, 0), (128, 128))
+
+class Simulator:
+    def __init__(self, memory, registers=None):
+        self.memory = memory
+        self.registers = [0] * 32
+        self.registers[SP] = 65535
+        self.registers[EI_T] = -1
+        self.registers[INT_T] = FRAME_DURATION
+        if registers:
+            self.set_registers(registers)
+        self.opcodes = _get_opcodes()
+
+    def set_registers(self, registers):
+        r = self.registers
+        for reg, value in registers.items():
+            reg = reg.lower()
+            if reg == 'sp':
+                r[SP] = value & 65535
+            elif reg == 'pc':
+                r[PC] = value & 65535
+            elif reg == 'r':
+                r[R] = value & 127
+                r[R7] = value & 128
+            elif reg in REGISTERS:
+                indexes = REGISTERS[reg]
+                if len(indexes) == 1:
+                    r[indexes[0]] = value & 255
+                elif reg == 'iff':
+                    r[IFF] = r[IFF2] = value & 1
+                else:
+                    r[indexes[0]] = (value // 256) & 255
+                    r[indexes[1]] = value & 255
+            else:
+                raise ValueError('Unknown register: {}'.format(reg))
+
+    def get_register(self, reg):
+        r = self.registers
+        reg = reg.lower()
+        if reg == 'sp':
+            return r[SP]
+        if reg == 'pc':
+            return r[PC]
+        if reg == 'r':
+            return r[R7] | (r[R] & 127)
+        if reg == 't':
+            return r[T]
+        indexes = REGISTERS[reg]
+        if len(indexes) == 1 or reg == 'iff':
+            return r[indexes[0]]
+        return r[indexes[0]] * 256 + r[indexes[1]]
+
+    def run(self, start=None, stop=None, max_tstates=None, until=None, executed=None):
+        # Execute instructions until the PC equals 'stop', 'max_tstates'
+        # T-states have elapsed, the 'until' function returns True, or a HALT
+        # instruction is executed with interrupts disabled. If 'executed' is
+        # given, it must be a bytearray of length 65536, and the address of
+        # each instruction executed is marked in it with a 1.
+        r = self.registers
+        memory = self.memory
+        opcodes = self.opcodes
+        if start is not None:
+            r[PC] = start
+            r[HALT] = 0
+        if executed is None:
+            executed = bytearray(65536)
+        if stop is None:
+            stop = -1
+        if max_tstates is None:
+            t_max = float('inf')
+        else:
+            t_max = r[T] + max_tstates
+        if until is None:
+            # Fast path
+            while r[T] < t_max:
+                pc = r[PC]
+                if pc == stop:
+                    break
+                executed[pc] = 1
+                r[R] += 1
+                opcodes[memory[pc]](r, memory)
+                if r[T] >= r[INT_T]:
+                    if self._interrupt(r, memory):
+                        break
+        else:
+            while r[T] < t_max:
+                pc = r[PC]
+                if pc == stop or until(self):
+                    break
+                executed[pc] = 1
+                r[R] += 1
+                opcodes[memory[pc]](r, memory)
+                if r[T] >= r[INT_T]:
+                    if self._interrupt(r, memory):
+                        break
+        return executed
+
+    def _interrupt(self, r, memory):
+        # Return True if the CPU is halted with interrupts disabled
+        t = r[T]
+        if t - r[INT_T] < INT_ACTIVE and r[IFF] and r[EI_T] != t:
+            r[IFF] = r[IFF2] = 0
+            pc = r[PC]
+            if r[HALT]:
+                pc = (pc + 1) & 65535
+                r[HALT] = 0
+            if r[IM] == 2:
+                sp = (r[SP] - 2) & 65535
+                memory[sp] = pc & 255
+                memory[(sp + 1) & 65535] = pc // 256
+                r[SP] = sp
+                vector = r[I] * 256 + 255
+                r[PC] = memory[vector] + 256 * memory[(vector + 1) & 65535]
+                r[T] += 19
+            else:
+                # There is no ROM to jump into, so act as if the interrupt
+                # routine at 0x0038 has run and returned (with EI; RET)
+                r[PC] = pc
+                r[IFF] = r[IFF2] = 1
+                r[T] += 13
+            r[INT_T] += FRAME_DURATION
+        while r[INT_T] + INT_ACTIVE <= r[T]:
+            r[INT_T] += FRAME_DURATION
+        return r[HALT] and not r[IFF]
+
+def _signed(d):
+    return (d ^ 128) - 128
+
+def _get_word(memory, address):
+    return memory[address] + 256 * memory[(address + 1) & 65535]
+
+def _poke_word(memory, address, value):
+    memory[address] = value & 255
+    memory[(address + 1) & 65535] = value // 256
+
+def _index_address(r, memory, xh, xl):
+    return (r[xl] + 256 * r[xh] + _signed(memory[(r[PC] + 2) & 65535])) & 65535
+
+###############################################################################
+# ALU operations on A
+###############################################################################
+
+def _add(r, v):
+    a = r[A]
+    s = a + v
+    r[A] = s & 255
+    r[F] = SZ53[s & 255] | (s >> 8) | ((a ^ v ^ s) & 16) | (((a ^ s) & (v ^ s) & 128) >> 5)
+
+def _adc(r, v):
+    a = r[A]
+    s = a + v + (r[F] & 1)
+    r[A] = s & 255
+    r[F] = SZ53[s & 255] | (s >> 8) | ((a ^ v ^ s) & 16) | (((a ^ s) & (v ^ s) & 128) >> 5)
+
+def _sub(r, v):
+    a = r[A]
+    s = a - v
+    r[A] = s & 255
+    r[F] = SZ53[s & 255] | (s < 0) | ((a ^ v ^ s) & 16) | (((a ^ v) & (a ^ s) & 128) >> 5) | 2
+
+def _sbc(r, v):
+    a = r[A]
+    s = a - v - (r[F] & 1)
+    r[A] = s & 255
+    r[F] = SZ53[s & 255] | (s < 0) | ((a ^ v ^ s) & 16) | (((a ^ v) & (a ^ s) & 128) >> 5) | 2
+
+def _and(r, v):
+    r[A] &= v
+    r[F] = SZ53P[r[A]] | 16
+
+def _xor(r, v):
+    r[A] ^= v
+    r[F] = SZ53P[r[A]]
+
+def _or(r, v):
+    r[A] |= v
+    r[F] = SZ53P[r[A]]
+
+def _cp(r, v):
+    a = r[A]
+    s = a - v
+    r[F] = (SZ53[s & 255] & 0xD7) | (v & 0x28) | (s < 0) | ((a ^ v ^ s) & 16) | (((a ^ v) & (a ^ s) & 128) >> 5) | 2
+
+ALU = (_add, _adc, _sub, _sbc, _and, _xor, _or, _cp)
+
+def alu_r(op, reg, size, t, r, memory):
+    op(r, r[reg])
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def alu_n(op, r, memory):
+    op(r, memory[(r[PC] + 1) & 65535])
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 7
+
+def alu_hl(op, r, memory):
+    op(r, memory[r[L] + 256 * r[H]])
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 7
+
+def alu_xd(op, xh, xl, r, memory):
+    op(r, memory[_index_address(r, memory, xh, xl)])
+    r[PC] = (r[PC] + 3) & 65535
+    r[T] += 19
+
+###############################################################################
+# 8-bit loads
+###############################################################################
+
+def nop(size, t, r, memory):
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def ld_r_r(dst, src, size, t, r, memory):
+    r[dst] = r[src]
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def ld_r_n(reg, size, t, r, memory):
+    r[reg] = memory[(r[PC] + size - 1) & 65535]
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def ld_r_rr(reg, hi, lo, r, memory):
+    r[reg] = memory[r[lo] + 256 * r[hi]]
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 7
+
+def ld_rr_r(hi, lo, reg, r, memory):
+    memory[r[lo] + 256 * r[hi]] = r[reg]
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 7
+
+def ld_r_xd(reg, xh, xl, r, memory):
+    r[reg] = memory[_index_address(r, memory, xh, xl)]
+    r[PC] = (r[PC] + 3) & 65535
+    r[T] += 19
+
+def ld_xd_r(xh, xl, reg, r, memory):
+    memory[_index_address(r, memory, xh, xl)] = r[reg]
+    r[PC] = (r[PC] + 3) & 65535
+    r[T] += 19
+
+def ld_hl_n(r, memory):
+    pc = r[PC]
+    memory[r[L] + 256 * r[H]] = memory[(pc + 1) & 65535]
+    r[PC] = (pc + 2) & 65535
+    r[T] += 10
+
+def ld_xd_n(xh, xl, r, memory):
+    pc = r[PC]
+    memory[_index_address(r, memory, xh, xl)] = memory[(pc + 3) & 65535]
+    r[PC] = (pc + 4) & 65535
+    r[T] += 19
+
+def ld_a_nn(r, memory):
+    pc = r[PC]
+    r[A] = memory[_get_word(memory, (pc + 1) & 65535)]
+    r[PC] = (pc + 3) & 65535
+    r[T] += 13
+
+def ld_nn_a(r, memory):
+    pc = r[PC]
+    memory[_get_word(memory, (pc + 1) & 65535)] = r[A]
+    r[PC] = (pc + 3) & 65535
+    r[T] += 13
+
+def ld_a_ir(reg, r, memory):
+    if reg == R:
+        a = r[R7] | (r[R] & 127)
+    else:
+        a = r[reg]
+    r[A] = a
+    r[F] = (r[F] & 1) | SZ53[a] | (r[IFF2] * 4)
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 9
+
+def ld_ir_a(reg, r, memory):
+    if reg == R:
+        r[R] = r[A] & 127
+        r[R7] = r[A] & 128
+    else:
+        r[reg] = r[A]
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 9
+
+###############################################################################
+# 16-bit loads and stack operations
+###############################################################################
+
+def ld_rr_nn(hi, lo, size, t, r, memory):
+    pc = r[PC]
+    r[lo] = memory[(pc + size - 2) & 65535]
+    r[hi] = memory[(pc + size - 1) & 65535]
+    r[PC] = (pc + size) & 65535
+    r[T] += t
+
+def ld_sp_nn(r, memory):
+    pc = r[PC]
+    r[SP] = _get_word(memory, (pc + 1) & 65535)
+    r[PC] = (pc + 3) & 65535
+    r[T] += 10
+
+def ld_rr_mm(hi, lo, size, t, r, memory):
+    pc = r[PC]
+    addr = _get_word(memory, (pc + size - 2) & 65535)
+    r[lo] = memory[addr]
+    r[hi] = memory[(addr + 1) & 65535]
+    r[PC] = (pc + size) & 65535
+    r[T] += t
+
+def ld_mm_rr(hi, lo, size, t, r, memory):
+    pc = r[PC]
+    addr = _get_word(memory, (pc + size - 2) & 65535)
+    memory[addr] = r[lo]
+    memory[(addr + 1) & 65535] = r[hi]
+    r[PC] = (pc + size) & 65535
+    r[T] += t
+
+def ld_sp_mm(r, memory):
+    pc = r[PC]
+    r[SP] = _get_word(memory, _get_word(memory, (pc + 2) & 65535))
+    r[PC] = (pc + 4) & 65535
+    r[T] += 20
+
+def ld_mm_sp(r, memory):
+    pc = r[PC]
+    _poke_word(memory, _get_word(memory, (pc + 2) & 65535), r[SP])
+    r[PC] = (pc + 4) & 65535
+    r[T] += 20
+
+def ld_sp_rr(hi, lo, size, t, r, memory):
+    r[SP] = r[lo] + 256 * r[hi]
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def push(hi, lo, size, t, r, memory):
+    sp = r[SP]
+    memory[(sp - 1) & 65535] = r[hi]
+    sp = (sp - 2) & 65535
+    memory[sp] = r[lo]
+    r[SP] = sp
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def pop(hi, lo, size, t, r, memory):
+    sp = r[SP]
+    r[lo] = memory[sp]
+    r[hi] = memory[(sp + 1) & 65535]
+    r[SP] = (sp + 2) & 65535
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def ex_sp_rr(hi, lo, size, t, r, memory):
+    sp = r[SP]
+    sp1 = (sp + 1) & 65535
+    r[lo], memory[sp] = memory[sp], r[lo]
+    r[hi], memory[sp1] = memory[sp1], r[hi]
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def ex_de_hl(r, memory):
+    r[D], r[E], r[H], r[L] = r[H], r[L], r[D], r[E]
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def ex_af_af(r, memory):
+    r[A], r[F], r[xA], r[xF] = r[xA], r[xF], r[A], r[F]
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def exx(r, memory):
+    r[B:IXh], r[xB:xL + 1] = r[xB:xL + 1], r[B:IXh]
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+###############################################################################
+# 8-bit arithmetic (INC/DEC)
+###############################################################################
+
+def _inc(r, v):
+    v2 = (v + 1) & 255
+    r[F] = (r[F] & 1) | SZ53[v2] | (16 if v & 15 == 15 else 0) | (4 if v == 127 else 0)
+    return v2
+
+def _dec(r, v):
+    v2 = (v - 1) & 255
+    r[F] = (r[F] & 1) | SZ53[v2] | 2 | (16 if v & 15 == 0 else 0) | (4 if v == 128 else 0)
+    return v2
+
+def inc_r(reg, size, t, r, memory):
+    r[reg] = _inc(r, r[reg])
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def dec_r(reg, size, t, r, memory):
+    r[reg] = _dec(r, r[reg])
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def inc_hl(r, memory):
+    addr = r[L] + 256 * r[H]
+    memory[addr] = _inc(r, memory[addr])
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 11
+
+def dec_hl(r, memory):
+    addr = r[L] + 256 * r[H]
+    memory[addr] = _dec(r, memory[addr])
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 11
+
+def inc_xd(xh, xl, r, memory):
+    addr = _index_address(r, memory, xh, xl)
+    memory[addr] = _inc(r, memory[addr])
+    r[PC] = (r[PC] + 3) & 65535
+    r[T] += 23
+
+def dec_xd(xh, xl, r, memory):
+    addr = _index_address(r, memory, xh, xl)
+    memory[addr] = _dec(r, memory[addr])
+    r[PC] = (r[PC] + 3) & 65535
+    r[T] += 23
+
+###############################################################################
+# 16-bit arithmetic
+###############################################################################
+
+def inc_rr(hi, lo, size, t, r, memory):
+    if r[lo] == 255:
+        r[lo] = 0
+        r[hi] = (r[hi] + 1) & 255
+    else:
+        r[lo] += 1
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def dec_rr(hi, lo, size, t, r, memory):
+    if r[lo] == 0:
+        r[lo] = 255
+        r[hi] = (r[hi] - 1) & 255
+    else:
+        r[lo] -= 1
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def inc_sp(size, t, r, memory):
+    r[SP] = (r[SP] + 1) & 65535
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def dec_sp(size, t, r, memory):
+    r[SP] = (r[SP] - 1) & 65535
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def _get_rr(r, hi, lo):
+    if hi == SP:
+        return r[SP]
+    return r[lo] + 256 * r[hi]
+
+def add_rr_rr(hi, lo, hi2, lo2, size, t, r, memory):
+    v1 = r[lo] + 256 * r[hi]
+    v2 = _get_rr(r, hi2, lo2)
+    s = v1 + v2
+    r[F] = (r[F] & 0xC4) | ((s >> 8) & 0x28) | (((v1 ^ v2 ^ s) >> 8) & 16) | (s >> 16)
+    r[hi] = (s >> 8) & 255
+    r[lo] = s & 255
+    r[PC] = (r[PC] + size) & 65535
+    r[T] += t
+
+def adc_hl_rr(hi, lo, r, memory):
+    v1 = r[L] + 256 * r[H]
+    v2 = _get_rr(r, hi, lo)
+    s = v1 + v2 + (r[F] & 1)
+    s16 = s & 65535
+    r[F] = ((s16 >> 8) & 0xA8) | (64 if s16 == 0 else 0) | (((v1 ^ v2 ^ s) >> 8) & 16) | (((v1 ^ s) & (v2 ^ s) & 32768) >> 13) | (s >> 16)
+    r[H] = s16 >> 8
+    r[L] = s16 & 255
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 15
+
+def sbc_hl_rr(hi, lo, r, memory):
+    v1 = r[L] + 256 * r[H]
+    v2 = _get_rr(r, hi, lo)
+    s = v1 - v2 - (r[F] & 1)
+    s16 = s & 65535
+    r[F] = ((s16 >> 8) & 0xA8) | (64 if s16 == 0 else 0) | (((v1 ^ v2 ^ s) >> 8) & 16) | (((v1 ^ v2) & (v1 ^ s) & 32768) >> 13) | (s < 0) | 2
+    r[H] = s16 >> 8
+    r[L] = s16 & 255
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 15
+
+###############################################################################
+# General purpose arithmetic and CPU control
+###############################################################################
+
+def daa(r, memory):
+    a = r[A]
+    f = r[F]
+    diff = 0
+    carry = f & 1
+    if f & 16 or a & 15 > 9:
+        diff = 6
+    if carry or a > 0x99:
+        diff |= 0x60
+        carry = 1
+    if f & 2:
+        h = 16 if f & 16 and a & 15 < 6 else 0
+        a = (a - diff) & 255
+    else:
+        h = 16 if a & 15 > 9 else 0
+        a = (a + diff) & 255
+    r[A] = a
+    r[F] = SZ53P[a] | h | (f & 2) | carry
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def cpl(r, memory):
+    r[A] ^= 255
+    r[F] = (r[F] & 0xC5) | (r[A] & 0x28) | 0x12
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def neg(r, memory):
+    v = r[A]
+    r[A] = 0
+    _sub(r, v)
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 8
+
+def scf(r, memory):
+    r[F] = (r[F] & 0xC4) | (r[A] & 0x28) | 1
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def ccf(r, memory):
+    f = r[F]
+    r[F] = (f & 0xC4) | (r[A] & 0x28) | ((f & 1) * 16) | ((f & 1) ^ 1)
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def halt(r, memory):
+    r[HALT] = 1
+    if r[IFF]:
+        # Skip ahead to the next interrupt
+        r[T] = max(r[T] + 4, r[INT_T])
+    else:
+        r[T] += 4
+
+def di(r, memory):
+    r[IFF] = r[IFF2] = 0
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def ei(r, memory):
+    r[IFF] = r[IFF2] = 1
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+    r[EI_T] = r[T]
+
+def im(mode, r, memory):
+    r[IM] = mode
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 8
+
+###############################################################################
+# Rotates and shifts
+###############################################################################
+
+def rlca(r, memory):
+    a = r[A]
+    a = ((a << 1) | (a >> 7)) & 255
+    r[A] = a
+    r[F] = (r[F] & 0xC4) | (a & 0x29)
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def rrca(r, memory):
+    a = r[A]
+    c = a & 1
+    a = (a >> 1) | (c << 7)
+    r[A] = a
+    r[F] = (r[F] & 0xC4) | (a & 0x28) | c
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def rla(r, memory):
+    a = r[A]
+    c = a >> 7
+    a = ((a << 1) | (r[F] & 1)) & 255
+    r[A] = a
+    r[F] = (r[F] & 0xC4) | (a & 0x28) | c
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def rra(r, memory):
+    a = r[A]
+    c = a & 1
+    a = (a >> 1) | ((r[F] & 1) << 7)
+    r[A] = a
+    r[F] = (r[F] & 0xC4) | (a & 0x28) | c
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+
+def _rlc(r, v):
+    v = ((v << 1) | (v >> 7)) & 255
+    r[F] = SZ53P[v] | (v & 1)
+    return v
+
+def _rrc(r, v):
+    c = v & 1
+    v = (v >> 1) | (c << 7)
+    r[F] = SZ53P[v] | c
+    return v
+
+def _rl(r, v):
+    c = v >> 7
+    v = ((v << 1) | (r[F] & 1)) & 255
+    r[F] = SZ53P[v] | c
+    return v
+
+def _rr(r, v):
+    c = v & 1
+    v = (v >> 1) | ((r[F] & 1) << 7)
+    r[F] = SZ53P[v] | c
+    return v
+
+def _sla(r, v):
+    c = v >> 7
+    v = (v << 1) & 255
+    r[F] = SZ53P[v] | c
+    return v
+
+def _sra(r, v):
+    c = v & 1
+    v = (v >> 1) | (v & 128)
+    r[F] = SZ53P[v] | c
+    return v
+
+def _sll(r, v):
+    c = v >> 7
+    v = ((v << 1) & 255) | 1
+    r[F] = SZ53P[v] | c
+    return v
+
+def _srl(r, v):
+    c = v & 1
+    v >>= 1
+    r[F] = SZ53P[v] | c
+    return v
+
+ROTATES = (_rlc, _rrc, _rl, _rr, _sla, _sra, _sll, _srl)
+
+def rot_r(op, reg, r, memory):
+    r[reg] = op(r, r[reg])
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 8
+
+def rot_hl(op, r, memory):
+    addr = r[L] + 256 * r[H]
+    memory[addr] = op(r, memory[addr])
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 15
+
+def rot_xd(op, xh, xl, reg, r, memory):
+    addr = _index_address(r, memory, xh, xl)
+    v = memory[addr] = op(r, memory[addr])
+    if reg is not None:
+        r[reg] = v
+    r[PC] = (r[PC] + 4) & 65535
+    r[T] += 23
+
+def rld(r, memory):
+    addr = r[L] + 256 * r[H]
+    v = memory[addr]
+    a = r[A]
+    memory[addr] = ((v << 4) | (a & 15)) & 255
+    a = (a & 0xF0) | (v >> 4)
+    r[A] = a
+    r[F] = (r[F] & 1) | SZ53P[a]
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 18
+
+def rrd(r, memory):
+    addr = r[L] + 256 * r[H]
+    v = memory[addr]
+    a = r[A]
+    memory[addr] = ((a << 4) | (v >> 4)) & 255
+    a = (a & 0xF0) | (v & 15)
+    r[A] = a
+    r[F] = (r[F] & 1) | SZ53P[a]
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 18
+
+###############################################################################
+# Bit set, reset and test
+###############################################################################
+
+def _bit(r, b, v):
+    v &= 1 << b
+    r[F] = (r[F] & 1) | 16 | (SZ53P[v] & 0xC4) | (v & 0x28)
+
+def bit_r(b, reg, r, memory):
+    _bit(r, b, r[reg])
+    r[F] = (r[F] & 0xD7) | (r[reg] & 0x28)
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 8
+
+def bit_hl(b, r, memory):
+    _bit(r, b, memory[r[L] + 256 * r[H]])
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 12
+
+def bit_xd(b, xh, xl, r, memory):
+    addr = _index_address(r, memory, xh, xl)
+    _bit(r, b, memory[addr])
+    r[F] = (r[F] & 0xD7) | ((addr >> 8) & 0x28)
+    r[PC] = (r[PC] + 4) & 65535
+    r[T] += 20
+
+def res_r(b, reg, r, memory):
+    r[reg] &= 255 ^ (1 << b)
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 8
+
+def set_r(b, reg, r, memory):
+    r[reg] |= 1 << b
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 8
+
+def res_hl(b, r, memory):
+    memory[r[L] + 256 * r[H]] &= 255 ^ (1 << b)
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 15
+
+def set_hl(b, r, memory):
+    memory[r[L] + 256 * r[H]] |= 1 << b
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 15
+
+def res_xd(b, xh, xl, reg, r, memory):
+    addr = _index_address(r, memory, xh, xl)
+    v = memory[addr] = memory[addr] & (255 ^ (1 << b))
+    if reg is not None:
+        r[reg] = v
+    r[PC] = (r[PC] + 4) & 65535
+    r[T] += 23
+
+def set_xd(b, xh, xl, reg, r, memory):
+    addr = _index_address(r, memory, xh, xl)
+    v = memory[addr] = memory[addr] | (1 << b)
+    if reg is not None:
+        r[reg] = v
+    r[PC] = (r[PC] + 4) & 65535
+    r[T] += 23
+
+###############################################################################
+# Jumps, calls and returns
+###############################################################################
+
+def jp(r, memory):
+    r[PC] = _get_word(memory, (r[PC] + 1) & 65535)
+    r[T] += 10
+
+def jp_cc(mask, value, r, memory):
+    if r[F] & mask == value:
+        r[PC] = _get_word(memory, (r[PC] + 1) & 65535)
+    else:
+        r[PC] = (r[PC] + 3) & 65535
+    r[T] += 10
+
+def jp_rr(hi, lo, size, t, r, memory):
+    r[PC] = r[lo] + 256 * r[hi]
+    r[T] += t
+
+def jr(r, memory):
+    pc = r[PC]
+    r[PC] = (pc + 2 + _signed(memory[(pc + 1) & 65535])) & 65535
+    r[T] += 12
+
+def jr_cc(mask, value, r, memory):
+    pc = r[PC]
+    if r[F] & mask == value:
+        r[PC] = (pc + 2 + _signed(memory[(pc + 1) & 65535])) & 65535
+        r[T] += 12
+    else:
+        r[PC] = (pc + 2) & 65535
+        r[T] += 7
+
+def djnz(r, memory):
+    pc = r[PC]
+    b = r[B] = (r[B] - 1) & 255
+    if b:
+        r[PC] = (pc + 2 + _signed(memory[(pc + 1) & 65535])) & 65535
+        r[T] += 13
+    else:
+        r[PC] = (pc + 2) & 65535
+        r[T] += 8
+
+def _push_pc(r, memory, pc):
+    sp = (r[SP] - 2) & 65535
+    memory[sp] = pc & 255
+    memory[(sp + 1) & 65535] = pc >> 8
+    r[SP] = sp
+
+def call(r, memory):
+    pc = r[PC]
+    _push_pc(r, memory, (pc + 3) & 65535)
+    r[PC] = _get_word(memory, (pc + 1) & 65535)
+    r[T] += 17
+
+def call_cc(mask, value, r, memory):
+    pc = r[PC]
+    if r[F] & mask == value:
+        _push_pc(r, memory, (pc + 3) & 65535)
+        r[PC] = _get_word(memory, (pc + 1) & 65535)
+        r[T] += 17
+    else:
+        r[PC] = (pc + 3) & 65535
+        r[T] += 10
+
+def ret(r, memory):
+    sp = r[SP]
+    r[PC] = _get_word(memory, sp)
+    r[SP] = (sp + 2) & 65535
+    r[T] += 10
+
+def ret_cc(mask, value, r, memory):
+    if r[F] & mask == value:
+        sp = r[SP]
+        r[PC] = _get_word(memory, sp)
+        r[SP] = (sp + 2) & 65535
+        r[T] += 11
+    else:
+        r[PC] = (r[PC] + 1) & 65535
+        r[T] += 5
+
+def retn(r, memory):
+    r[IFF] = r[IFF2]
+    sp = r[SP]
+    r[PC] = _get_word(memory, sp)
+    r[SP] = (sp + 2) & 65535
+    r[T] += 14
+
+def rst(address, r, memory):
+    _push_pc(r, memory, (r[PC] + 1) & 65535)
+    r[PC] = address
+    r[T] += 11
+
+###############################################################################
+# Block transfer and search
+###############################################################################
+
+def ldi(inc, repeat, r, memory):
+    hl = r[L] + 256 * r[H]
+    de = r[E] + 256 * r[D]
+    bc = (r[C] + 256 * r[B] - 1) & 65535
+    v = memory[de] = memory[hl]
+    hl = (hl + inc) & 65535
+    de = (de + inc) & 65535
+    r[H], r[L] = hl >> 8, hl & 255
+    r[D], r[E] = de >> 8, de & 255
+    r[B], r[C] = bc >> 8, bc & 255
+    n = v + r[A]
+    r[F] = (r[F] & 0xC1) | (n & 8) | ((n & 2) << 4) | (4 if bc else 0)
+    if repeat and bc:
+        r[T] += 21
+    else:
+        r[PC] = (r[PC] + 2) & 65535
+        r[T] += 16
+
+def cpi(inc, repeat, r, memory):
+    hl = r[L] + 256 * r[H]
+    bc = (r[C] + 256 * r[B] - 1) & 65535
+    a = r[A]
+    v = memory[hl]
+    s = (a - v) & 255
+    h = (a ^ v ^ s) & 16
+    n = s - (h >> 4)
+    hl = (hl + inc) & 65535
+    r[H], r[L] = hl >> 8, hl & 255
+    r[B], r[C] = bc >> 8, bc & 255
+    r[F] = (r[F] & 1) | (SZ53[s] & 0xC0) | h | (n & 8) | ((n & 2) << 4) | (4 if bc else 0) | 2
+    if repeat and bc and s:
+        r[T] += 21
+    else:
+        r[PC] = (r[PC] + 2) & 65535
+        r[T] += 16
+
+def ini(inc, repeat, r, memory):
+    hl = r[L] + 256 * r[H]
+    memory[hl] = 255
+    b = r[B] = (r[B] - 1) & 255
+    hl = (hl + inc) & 65535
+    r[H], r[L] = hl >> 8, hl & 255
+    r[F] = SZ53[b] | 2
+    if repeat and b:
+        r[T] += 21
+    else:
+        r[PC] = (r[PC] + 2) & 65535
+        r[T] += 16
+
+def outi(inc, repeat, r, memory):
+    hl = r[L] + 256 * r[H]
+    b = r[B] = (r[B] - 1) & 255
+    hl = (hl + inc) & 65535
+    r[H], r[L] = hl >> 8, hl & 255
+    r[F] = SZ53[b] | ((memory[hl] >> 6) & 2)
+    if repeat and b:
+        r[T] += 21
+    else:
+        r[PC] = (r[PC] + 2) & 65535
+        r[T] += 16
+
+###############################################################################
+# Input and output (there are no devices attached, so every port reads 255)
+###############################################################################
+
+def in_a_n(r, memory):
+    r[A] = 255
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 11
+
+def in_r_c(reg, r, memory):
+    if reg is not None:
+        r[reg] = 255
+    r[F] = (r[F] & 1) | SZ53P[255]
+    r[PC] = (r[PC] + 2) & 65535
+    r[T] += 12
+
+###############################################################################
+# Prefixes
+###############################################################################
+
+def prefix(table, r, memory):
+    table[memory[(r[PC] + 1) & 65535]](r, memory)
+    r[R] += 1
+
+def prefix_xcb(table, r, memory):
+    table[memory[(r[PC] + 3) & 65535]](r, memory)
+    r[R] += 1
+
+def prefix_nop(op, r, memory):
+    # A DD or FD prefix that has no effect on the following instruction
+    r[PC] = (r[PC] + 1) & 65535
+    r[T] += 4
+    op(r, memory)
+
+###############################################################################
+# Opcode tables
+###############################################################################
+
+_OPCODES = None
+
+def _get_opcodes():
+    global _OPCODES
+    if _OPCODES is None:
+        _OPCODES = _build_opcodes()
+    return _OPCODES
+
+def _cb_opcodes():
+    ops = [None] * 256
+    for op in range(256):
+        reg = (B, C, D, E, H, L, None, A)[op & 7]
+        b = (op >> 3) & 7
+        if op < 64:
+            if reg is None:
+                ops[op] = partial(rot_hl, ROTATES[b])
+            else:
+                ops[op] = partial(rot_r, ROTATES[b], reg)
+        elif op < 128:
+            ops[op] = partial(bit_hl, b) if reg is None else partial(bit_r, b, reg)
+        elif op < 192:
+            ops[op] = partial(res_hl, b) if reg is None else partial(res_r, b, reg)
+        else:
+            ops[op] = partial(set_hl, b) if reg is None else partial(set_r, b, reg)
+    return ops
+
+def _xcb_opcodes(xh, xl):
+    ops = [None] * 256
+    for op in range(256):
+        reg = (B, C, D, E, H, L, None, A)[op & 7]
+        b = (op >> 3) & 7
+        if op < 64:
+            ops[op] = partial(rot_xd, ROTATES[b], xh, xl, reg)
+        elif op < 128:
+            ops[op] = partial(bit_xd, b, xh, xl)
+        elif op < 192:
+            ops[op] = partial(res_xd, b, xh, xl, reg)
+        else:
+            ops[op] = partial(set_xd, b, xh, xl, reg)
+    return ops
+
+def _ed_opcodes():
+    ops = [partial(nop, 2, 8)] * 256
+    regs = (B, C, D, E, H, L, None, A)
+    pairs = ((B, C), (D, E), (H, L), (SP, None))
+    for i in range(8):
+        ops[64 + i * 8] = partial(in_r_c, regs[i])
+        ops[65 + i * 8] = partial(nop, 2, 12) # OUT (C),r
+        hi, lo = pairs[i // 2]
+        if i % 2 == 0:
+            ops[66 + i * 8] = partial(sbc_hl_rr, hi, lo)
+            if hi == SP:
+                ops[67 + i * 8] = ld_mm_sp
+            else:
+                ops[67 + i * 8] = partial(ld_mm_rr, hi, lo, 4, 20)
+        else:
+            ops[66 + i * 8] = partial(adc_hl_rr, hi, lo)
+            if hi == SP:
+                ops[67 + i * 8] = ld_sp_mm
+            else:
+                ops[67 + i * 8] = partial(ld_rr_mm, hi, lo, 4, 20)
+        ops[68 + i * 8] = neg
+        ops[69 + i * 8] = retn
+        ops[70 + i * 8] = partial(im, (0, 0, 1, 2)[i % 4])
+    ops[71] = partial(ld_ir_a, I)
+    ops[79] = partial(ld_ir_a, R)
+    ops[87] = partial(ld_a_ir, I)
+    ops[95] = partial(ld_a_ir, R)
+    ops[103] = rrd
+    ops[111] = rld
+    for op, func, inc, repeat in (
+            (160, ldi, 1, False), (161, cpi, 1, False), (162, ini, 1, False), (163, outi, 1, False),
+            (168, ldi, -1, False), (169, cpi, -1, False), (170, ini, -1, False), (171, outi, -1, False),
+            (176, ldi, 1, True), (177, cpi, 1, True), (178, ini, 1, True), (179, outi, 1, True),
+            (184, ldi, -1, True), (185, cpi, -1, True), (186, ini, -1, True), (187, outi, -1, True)):
+        ops[op] = partial(func, inc, repeat)
+    return ops
+
+def _main_opcodes(hi, lo, size, t, xcb):
+    # Build the table of opcodes that operate on HL (when hi=H and lo=L), or
+    # on IX or IY (when hi=IXh/IYh and lo=IXl/IYl, in which case the returned
+    # table contains entries only for instructions affected by the prefix)
+    indexed = hi != H
+    ops = [None] * 256
+    regs = [B, C, D, E, hi, lo, None, A]
+    pairs = ((B, C), (D, E), (hi, lo), (SP, None))
+
+    for i, (rh, rl) in enumerate(pairs):
+        if i == 2 or not indexed:
+            if rh == SP:
+                ops[1 + i * 16] = ld_sp_nn
+                ops[3 + i * 16] = partial(inc_sp, 1, 6)
+                ops[11 + i * 16] = partial(dec_sp, 1, 6)
+            else:
+                ops[1 + i * 16] = partial(ld_rr_nn, rh, rl, size + 2, t + 10)
+                ops[3 + i * 16] = partial(inc_rr, rh, rl, size, t + 6)
+                ops[11 + i * 16] = partial(dec_rr, rh, rl, size, t + 6)
+        ops[9 + i * 16] = partial(add_rr_rr, hi, lo, rh, rl, size, t + 11)
+    ops[34] = partial(ld_mm_rr, hi, lo, size + 2, t + 16)
+    ops[42] = partial(ld_rr_mm, hi, lo, size + 2, t + 16)
+
+    for i, reg in enumerate(regs):
+        if reg is None:
+            if indexed:
+                ops[52] = partial(inc_xd, hi, lo)
+                ops[53] = partial(dec_xd, hi, lo)
+                ops[54] = partial(ld_xd_n, hi, lo)
+            else:
+                ops[52] = inc_hl
+                ops[53] = dec_hl
+                ops[54] = ld_hl_n
+        elif reg in (hi, lo) or not indexed:
+            ops[4 + i * 8] = partial(inc_r, reg, size, t + 4)
+            ops[5 + i * 8] = partial(dec_r, reg, size, t + 4)
+            ops[6 + i * 8] = partial(ld_r_n, reg, size + 1, t + 7)
+
+    for i, dst in enumerate(regs):
+        for j, src in enumerate(regs):
+            op = 64 + i * 8 + j
+            if op == 118:
+                if not indexed:
+                    ops[op] = halt
+            elif dst is None:
+                if indexed:
+                    ops[op] = partial(ld_xd_r, hi, lo, (B, C, D, E, H, L, None, A)[j])
+                else:
+                    ops[op] = partial(ld_rr_r, H, L, src)
+            elif src is None:
+                if indexed:
+                    ops[op] = partial(ld_r_xd, (B, C, D, E, H, L, None, A)[i], hi, lo)
+                else:
+                    ops[op] = partial(ld_r_rr, dst, H, L)
+            elif not indexed or dst in (hi, lo) or src in (hi, lo):
+                ops[op] = partial(ld_r_r, dst, src, size, t + 4)
+
+    for i, func in enumerate(ALU):
+        for j, reg in enumerate(regs):
+            op = 128 + i * 8 + j
+            if reg is None:
+                ops[op] = partial(alu_xd, func, hi, lo) if indexed else partial(alu_hl, func)
+            elif not indexed or reg in (hi, lo):
+                ops[op] = partial(alu_r, func, reg, size, t + 4)
+
+    ops[225] = partial(pop, hi, lo, size, t + 10)
+    ops[227] = partial(ex_sp_rr, hi, lo, size, t + 19)
+    ops[229] = partial(push, hi, lo, size, t + 11)
+    ops[233] = partial(jp_rr, hi, lo, size, t + 4)
+    ops[249] = partial(ld_sp_rr, hi, lo, size, t + 6)
+    ops[203] = xcb
+
+    if indexed:
+        return ops
+
+    ops[0] = partial(nop, 1, 4)
+    ops[2] = partial(ld_rr_r, B, C, A)
+    ops[7] = rlca
+    ops[8] = ex_af_af
+    ops[10] = partial(ld_r_rr, A, B, C)
+    ops[15] = rrca
+    ops[16] = djnz
+    ops[18] = partial(ld_rr_r, D, E, A)
+    ops[23] = rla
+    ops[24] = jr
+    ops[26] = partial(ld_r_rr, A, D, E)
+    ops[31] = rra
+    ops[39] = daa
+    ops[47] = cpl
+    ops[50] = ld_nn_a
+    ops[55] = scf
+    ops[58] = ld_a_nn
+    ops[63] = ccf
+    for i, (mask, value) in enumerate(CONDITIONS):
+        ops[192 + i * 8] = partial(ret_cc, mask, value)
+        ops[194 + i * 8] = partial(jp_cc, mask, value)
+        ops[196 + i * 8] = partial(call_cc, mask, value)
+        ops[199 + i * 8] = partial(rst, i * 8)
+        ops[198 + i * 8] = partial(alu_n, ALU[i])
+        if i < 4:
+            ops[32 + i * 8] = partial(jr_cc, mask, value)
+    ops[193] = partial(pop, B, C, 1, 10)
+    ops[197] = partial(push, B, C, 1, 11)
+    ops[201] = ret
+    ops[195] = jp
+    ops[205] = call
+    ops[209] = partial(pop, D, E, 1, 10)
+    ops[211] = partial(nop, 2, 11) # OUT (n),A
+    ops[213] = partial(push, D, E, 1, 11)
+    ops[217] = exx
+    ops[219] = in_a_n
+    ops[235] = ex_de_hl
+    ops[241] = partial(pop, A, F, 1, 10)
+    ops[243] = di
+    ops[245] = partial(push, A, F, 1, 11)
+    ops[251] = ei
+    return ops
+
+def _build_opcodes():
+    base = _main_opcodes(H, L, 1, 0, partial(prefix, _cb_opcodes()))
+    base[237] = partial(prefix, _ed_opcodes())
+    tables = []
+    for prefix_byte, xh, xl in ((221, IXh, IXl), (253, IYh, IYl)):
+        ops = _main_opcodes(xh, xl, 2, 4, partial(prefix_xcb, _xcb_opcodes(xh, xl)))
+        base[prefix_byte] = partial(prefix, ops)
+        tables.append(ops)
+    for ops in tables:
+        for op in range(256):
+            if ops[op] is None:
+                ops[op] = partial(prefix_nop, base[op])
+    return base
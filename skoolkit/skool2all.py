@@ -0,0 +1,141 @@
+# Copyright 2017 Richard Dymond (rjdymond@gmail.com)
+#
+# This file is part of SkoolKit.
+#
+# SkoolKit is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# SkoolKit is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# SkoolKit. If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import multiprocessing
+import os
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from skoolkit import SkoolKitError, skoollexer, skool2asm, skool2bin, skool2ctl, skool2html, skool2sft, VERSION
+
+COMMANDS = {
+    'asm': skool2asm.main,
+    'bin': skool2bin.main,
+    'ctl': skool2ctl.main,
+    'html': skool2html.main,
+    'sft': skool2sft.main
+}
+
+TARGETS = ('asm', 'bin', 'ctl', 'html', 'sft')
+
+def _get_prefix(skoolfile):
+    if skoolfile == '-':
+        return 'program'
+    fname = os.path.basename(skoolfile)
+    if fname.lower().endswith('.skool'):
+        return fname[:-6]
+    return fname
+
+def _get_jobs(skoolfile, output_dir, targets, target_options):
+    prefix = os.path.join(output_dir, _get_prefix(skoolfile))
+    jobs = []
+    for target in targets:
+        args = target_options.get(target, [])
+        outfile = None
+        if target == 'bin':
+            args = args + [skoolfile, prefix + '.bin']
+        elif target == 'html':
+            args = ['-d', output_dir] + args + [skoolfile]
+        else:
+            args = args + [skoolfile]
+            outfile = '{}.{}'.format(prefix, target)
+        jobs.append((target, args, outfile))
+    return jobs
+
+def _run_job(target, args, outfile):
+    # Run the command for 'target' with 'args', redirecting standard output to
+    # 'outfile' (if given), and return an error message if it fails
+    stdout = sys.stdout
+    try:
+        if outfile:
+            sys.stdout = open(outfile, 'w')
+        COMMANDS[target](args)
+    except SkoolKitError as e:
+        return e.args[0]
+    except SystemExit as e:
+        if e.code:
+            return 'invalid options: {}'.format(' '.join(args))
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        sys.stdout.flush()
+
+def run(skoolfile, options):
+    targets = options.targets
+    target_options = {}
+    for spec in options.options:
+        target, sep, opts = spec.partition('=')
+        if target not in TARGETS or not sep:
+            raise SkoolKitError('Invalid option specification: {}'.format(spec))
+        target_options.setdefault(target, []).extend(shlex.split(opts))
+    jobs = _get_jobs(skoolfile, options.output_dir, targets, target_options)
+    num_workers = min(options.jobs, len(jobs))
+    if num_workers > 1 and skoolfile == '-' and multiprocessing.get_start_method() != 'fork':
+        # Worker processes that are not forked cannot see standard input as
+        # read by this process
+        num_workers = 1
+
+    os.makedirs(options.output_dir, exist_ok=True)
+    skoollexer.preload_skool(skoolfile)
+    try:
+        if num_workers > 1:
+            with ProcessPoolExecutor(num_workers) as executor:
+                futures = [executor.submit(_run_job, *job) for job in jobs]
+            results = [f.result() for f in futures]
+        else:
+            results = [_run_job(*job) for job in jobs]
+    finally:
+        skoollexer.clear_preloaded()
+
+    errors = ['{}: {}'.format(job[0], msg) for job, msg in zip(jobs, results) if msg]
+    if errors:
+        raise SkoolKitError('\n'.join(errors))
+
+def _parse_targets(value):
+    targets = [t.strip() for t in value.split(',') if t.strip()]
+    for target in targets:
+        if target not in TARGETS:
+            raise argparse.ArgumentTypeError("invalid target: '{}'".format(target))
+    return targets
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        usage='skool2all.py [options] FILE',
+        description="Convert a skool file into an ASM file, a binary file, a control file, HTML\n"
+                    "and a skool file template, reading the skool file only once and running the\n"
+                    "conversions in parallel. FILE may be a regular file, or '-' for standard input.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        add_help=False
+    )
+    parser.add_argument('skoolfile', help=argparse.SUPPRESS, nargs='?')
+    group = parser.add_argument_group('Options')
+    group.add_argument('-d', '--output-dir', dest='output_dir', metavar='DIR', default='.',
+                       help="Write files in this directory (default is '.').")
+    group.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, default=os.cpu_count() or 1,
+                       help="Run at most N conversions in parallel (default: the\nnumber of CPUs).")
+    group.add_argument('-o', '--options', dest='options', metavar='T=OPTS', action='append', default=[],
+                       help="Pass options OPTS to the command for target T (e.g.\n'asm=-H -c'). This option may be used multiple times.")
+    group.add_argument('-t', '--targets', dest='targets', metavar='T', type=_parse_targets, default=list(TARGETS),
+                       help="Convert to these targets only, where T is a comma-\nseparated list of one or more of: {}\n(default: all).".format(','.join(TARGETS)))
+    group.add_argument('-V', '--version', action='version', version='SkoolKit {}'.format(VERSION),
+                       help='Show SkoolKit version number and exit.')
+    namespace, unknown_args = parser.parse_known_args(args)
+    if unknown_args or namespace.skoolfile is None:
+        parser.exit(2, parser.format_help())
+    run(namespace.skoolfile, namespace)
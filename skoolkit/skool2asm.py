@@ -18,7 +18,7 @@ import argparse
 import os.path
 import time
 
-from skoolkit import info, get_class, integer, show_package_dir, VERSION, BASE_10, BASE_16
+from skoolkit import info, get_class, integer, show_package_dir, skoolcache, VERSION, BASE_10, BASE_16
 from skoolkit.config import get_config, show_config, update_options
 from skoolkit.skoolasm import AsmWriter
 from skoolkit.skoolparser import SkoolParser, CASE_LOWER, CASE_UPPER
@@ -37,9 +37,10 @@ def run(skoolfile, options):
         fname = 'stdin'
     else:
         fname = skoolfile
-    parser = clock(options.quiet, 'Parsed {}'.format(fname), SkoolParser, skoolfile,
-                   options.case, options.base, options.asm_mode, options.warn, options.fix_mode,
-                   False, options.create_labels, True, options.start, options.end)
+    params = (options.case, options.base, options.asm_mode, options.warn, options.fix_mode,
+              False, options.create_labels, True, options.start, options.end, None, options.lazy)
+    parser = clock(options.quiet, 'Parsed {}'.format(fname), skoolcache.load, options.cache_dir,
+                   options.rebuild_cache, 'SkoolParser', params, skoolfile, lambda: SkoolParser(skoolfile, *params))
 
     # Write the ASM file
     cls_name = options.writer or parser.asm_writer_class
@@ -74,6 +75,8 @@ def main(args):
     group = parser.add_argument_group('Options')
     group.add_argument('-c', '--create-labels', dest='create_labels', action='store_const', const=1, default=config['CreateLabels'],
                        help="Create default labels for unlabelled instructions.")
+    group.add_argument('--cache', dest='cache_dir', metavar='DIR', default=config['CacheDir'],
+                       help="Cache the parsed skool file in this directory.")
     group.add_argument('-D', '--decimal', dest='base', action='store_const', const=BASE_10, default=config['Base'],
                        help="Write the disassembly in decimal.")
     group.add_argument('-E', '--end', dest='end', metavar='ADDR', type=integer, default=65536,
@@ -90,6 +93,9 @@ def main(args):
                        help="Set the value of the configuration parameter 'p' to\n'v'. This option may be used multiple times.")
     group.add_argument('-l', '--lower', dest='case', action='store_const', const=CASE_LOWER, default=config['Case'],
                        help="Write the disassembly in lower case.")
+    group.add_argument('--lazy', dest='lazy', action='store_true',
+                       help="Parse only the entries between the --start and --end\n"
+                            "addresses, using an index of the skool file.")
     group.add_argument('-p', '--package-dir', dest='package_dir', action='store_true',
                        help="Show path to skoolkit package directory and exit.")
     group.add_argument('-P', '--set', dest='properties', metavar='p=v', action='append', default=def_properties,
@@ -98,6 +104,8 @@ def main(args):
                        help="Be quiet.")
     group.add_argument('-r', '--rsub', dest='asm_mode', action='store_const', const=3, default=1,
                        help="Apply safe substitutions (@ssub) and relocatability\nsubstitutions (@rsub) (implies '-f 1').")
+    group.add_argument('--rebuild-cache', dest='rebuild_cache', action='store_true',
+                       help="Ignore any cached copy of the parsed skool file and\nreplace it (used with --cache).")
     group.add_argument('--show-config', dest='show_config', action='store_true',
                        help="Show configuration parameter values.")
     group.add_argument('-s', '--ssub', dest='asm_mode', action='store_const', const=2, default=1,
@@ -17,9 +17,9 @@
 import argparse
 
 from skoolkit import SkoolParsingError, get_int_param, info, integer, open_file, warn, VERSION
+from skoolkit.skoollexer import BLANK, COMMENT, CONTINUATION, DIRECTIVE, read_skool
 from skoolkit.skoolparser import parse_asm_block_directive
 from skoolkit.skoolsft import VALID_CTLS
-from skoolkit.textutils import find_unquoted
 from skoolkit.z80 import assemble
 
 SKIP_BLOCKS = ('d', 'r')
@@ -38,18 +38,15 @@ class BinWriter:
 
     def _parse_skool(self, skoolfile):
         entry_ctl = None
-        f = open_file(skoolfile)
-        for line in f:
-            if line.startswith(';'):
+        for kind, line, index in read_skool(skoolfile):
+            if kind == COMMENT:
                 continue
-            if line.startswith('@'):
+            if kind == DIRECTIVE:
                 self._parse_asm_directive(line[1:].rstrip())
                 continue
             if not self.include:
                 continue
-            s_line = line.strip()
-            if not s_line:
-                # This line is blank
+            if kind == BLANK:
                 entry_ctl = None
                 continue
             # Check whether we're in a block that can be skipped
@@ -57,15 +54,14 @@ class BinWriter:
                 entry_ctl = line[0]
             if entry_ctl in SKIP_BLOCKS:
                 continue
-            if s_line.startswith(';'):
+            if kind == CONTINUATION:
                 # This line is a continuation of an instruction comment
                 continue
             if line[0] in VALID_CTLS:
                 # This line contains an instruction
-                self._parse_instruction(line)
-        f.close()
+                self._parse_instruction(line, index)
 
-    def _parse_instruction(self, line):
+    def _parse_instruction(self, line, comment_index):
         try:
             address = get_int_param(line[1:6])
         except ValueError:
@@ -76,7 +72,6 @@ class BinWriter:
                 self.subs = [None] * 4
                 break
         else:
-            comment_index = find_unquoted(line, ';', 6)
             operation = line[7:comment_index].strip()
         data = assemble(operation, address)
         if data:
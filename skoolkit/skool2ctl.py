@@ -21,8 +21,8 @@ from skoolkit.skoolctl import (CtlWriter, ASM_DIRECTIVES, BLOCKS, BLOCK_TITLES,
                                REGISTERS, BLOCK_COMMENTS, SUBBLOCKS, COMMENTS)
 
 def run(skoolfile, options):
-    writer = CtlWriter(skoolfile, options.elements, options.write_hex,
-                       options.preserve_base, options.start, options.end)
+    writer = CtlWriter(skoolfile, options.elements, options.write_hex, options.preserve_base,
+                       options.start, options.end, options.cache_dir, options.rebuild_cache)
     writer.write()
 
 def main(args):
@@ -38,12 +38,17 @@ def main(args):
     group.add_argument('-b', '--preserve-base', action='store_true', dest='preserve_base',
                        help="Preserve the base of decimal and hexadecimal values in\n"
                             "instruction operands and DEFB/DEFM/DEFS/DEFW statements.")
+    group.add_argument('--cache', dest='cache_dir', metavar='DIR',
+                       help="Cache the parsed skool file in this directory.")
     group.add_argument('-E', '--end', dest='end', metavar='ADDR', type=integer, default=65536,
                        help="Stop converting at this address.")
     group.add_argument('-h', '--hex', action='store_const', dest='write_hex', const=1, default=0,
                        help='Write addresses in upper case hexadecimal format.')
     group.add_argument('-l', '--hex-lower', action='store_const', dest='write_hex', const=-1, default=0,
                        help='Write addresses in lower case hexadecimal format.')
+    group.add_argument('--rebuild-cache', dest='rebuild_cache', action='store_true',
+                       help="Ignore any cached copy of the parsed skool file and\n"
+                            "replace it (used with --cache).")
     group.add_argument('-S', '--start', dest='start', metavar='ADDR', type=integer, default=0,
                        help="Start converting at this address.")
     group.add_argument('-V', '--version', action='version',
@@ -20,14 +20,16 @@ from os.path import isfile, isdir, basename, dirname
 import shutil
 import time
 import argparse
+import multiprocessing
+import tempfile
 from io import StringIO
 
-from skoolkit import (defaults, SkoolKitError, find_file, show_package_dir,
+from skoolkit import (defaults, skoolcache, SkoolKitError, find_file, show_package_dir,
                       write, write_line, get_class, normpath,
                       PACKAGE_DIR, VERSION, BASE_10, BASE_16)
 from skoolkit.config import get_config, show_config, update_options
 from skoolkit.refparser import RefParser
-from skoolkit.skoolhtml import FileInfo
+from skoolkit.skoolhtml import FileInfo, P_MEMORY_MAP
 from skoolkit.skoolparser import SkoolParser, CASE_UPPER, CASE_LOWER
 
 SEARCH_DIRS = (
@@ -158,7 +160,7 @@ def get_prefix(fname):
         return fname.rsplit('.', 1)[0]
     return fname
 
-def process_file(infile, topdir, options):
+def process_file(infile, topdir, options, image_pool=None):
     extra_search_dirs = options.search
     pages = options.pages
     stdin = False
@@ -235,10 +237,16 @@ def process_file(infile, topdir, options):
         fname = 'skool file from standard input'
     else:
         fname = skoolfile_f
-    skool_parser = clock(SkoolParser, 'Parsing {}'.format(fname), skoolfile_f, case=options.case, base=options.base,
-                         html=True, create_labels=options.create_labels, asm_labels=options.asm_labels)
+    params = (options.case, options.base, options.create_labels, options.asm_labels)
+    skool_parser = clock(skoolcache.load, 'Parsing {}'.format(fname), options.cache_dir, options.rebuild_cache,
+                         'SkoolParser-html', params, skoolfile_f,
+                         lambda: SkoolParser(skoolfile_f, case=options.case, base=options.base, html=True,
+                                             create_labels=options.create_labels, asm_labels=options.asm_labels))
     file_info = FileInfo(topdir, game_dir, options.new_images)
     html_writer = html_writer_class(skool_parser, ref_parser, file_info)
+    if options.cache_dir and options.image_cache_size > 0:
+        html_writer.image_cache = skoolcache.ImageCache(os.path.join(options.cache_dir, 'images'), options.image_cache_size * 1048576)
+    html_writer.image_pool = image_pool
 
     # Check that the specified pages exist
     all_page_ids = html_writer.get_page_ids()
@@ -247,9 +255,236 @@ def process_file(infile, topdir, options):
             raise SkoolKitError('Invalid page ID: {0}'.format(page_id))
     pages = pages or all_page_ids
 
-    write_disassembly(html_writer, options.files, ref_search_dir, extra_search_dirs, pages, options.themes, options.single_css)
-
-def write_disassembly(html_writer, files, search_dir, extra_search_dirs, pages, css_themes, single_css):
+    write_disassembly(html_writer, options.files, ref_search_dir, extra_search_dirs, pages, options.themes, options.single_css, options.jobs,
+                      options.incremental)
+
+class _StagingFileInfo(FileInfo):
+    # Writes files in a staging directory, from which the parent process moves
+    # them into place only if the pages that wrote them are kept
+    def __init__(self, file_info, staging_dir):
+        self.__dict__.update(vars(file_info))
+        self.images = set(file_info.images)
+        self.staging_dir = staging_dir
+        self.registered = []
+        self.written = []
+
+    def open_file(self, *names, mode='w'):
+        path = os.path.join(self.staging_dir, *names)
+        os.makedirs(dirname(path), exist_ok=True)
+        self.written.append('/'.join(names))
+        return open(path, mode)
+
+    def link_file(self, source, fname):
+        path = os.path.join(self.staging_dir, fname)
+        os.makedirs(dirname(path), exist_ok=True)
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+        self.written.append(fname)
+
+    def add_image(self, image_path):
+        self.images.add(image_path)
+        self.registered.append(image_path)
+
+    def need_image(self, image_path):
+        return image_path not in self.images and (self.replace_images or not self.file_exists(image_path))
+
+# The writer and the list of pages to write, as inherited by the worker
+# processes forked by _write_in_parallel()
+_html_writer = None
+_tasks = None
+
+def _can_fork():
+    # Worker processes must be forked so that they inherit the HTML writer
+    # (and so that they do not run skool2html.py's main() again), and a
+    # daemonic process (e.g. a multiprocessing.Pool worker) cannot have
+    # children; a skool2all.py worker is not daemonic, so it may have a pool of
+    # its own
+    return multiprocessing.get_start_method() == 'fork' and not multiprocessing.current_process().daemon
+
+def _can_write_in_parallel(jobs):
+    return jobs > 1 and _can_fork()
+
+def _write_image(image_writer, frames, img_format, fname):
+    with open(fname, 'wb') as f:
+        image_writer.write_image(frames, f, img_format)
+
+class _ImagePool:
+    # Encodes image files in a pool of worker processes while the main process
+    # goes on writing the pages that use them
+    def __init__(self, processes):
+        self.pool = multiprocessing.Pool(processes)
+        self.jobs = []
+
+    def write_image(self, image_writer, frames, img_format, fname, callback=None):
+        # Write an image file in the background, and call 'callback' (if
+        # given) when the pool is joined
+        result = self.pool.apply_async(_write_image, (image_writer, frames, img_format, fname))
+        self.jobs.append((result, callback))
+
+    def join(self):
+        # Wait for every outstanding image file to be written, and re-raise
+        # the first error (if any) that occurred while writing one
+        jobs, self.jobs = self.jobs, []
+        for result, callback in jobs:
+            result.get()
+            if callback:
+                callback()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+def _get_task(html_writer, method_name, *args):
+    # A task is a (key, method name, arguments) tuple, where the key identifies
+    # the page in the build manifest
+    return ((html_writer.code_id, method_name) + args, method_name, args)
+
+def _get_entry_tasks(html_writer, cwd, map_file):
+    if html_writer.asm_single_page_template:
+        return [_get_task(html_writer, '_write_asm_single_page', map_file)]
+    tasks = []
+    for i, entry in enumerate(html_writer.memory_map):
+        # Entries are keyed by address rather than index, so that adding or
+        # removing one entry does not invalidate the records of the others
+        key = (html_writer.code_id, 'write_entry', cwd, entry.address, map_file)
+        tasks.append((key, 'write_entry', (cwd, i, map_file)))
+    return tasks
+
+def _is_current(html_writer, record):
+    file_info = html_writer.file_info
+    if file_info.replace_images or ['volatile'] in record['keys']:
+        return False
+    if not all(file_info.file_exists(fname) for fname in record['outputs']):
+        return False
+    return html_writer.get_dependency_digest(record) == record['digest']
+
+def _run_task(html_writer, task):
+    # Write the page for 'task' and return its new build manifest record, or
+    # None if there is no manifest or the page is up to date
+    key, method_name, args = task
+    manifest = html_writer.manifest
+    if manifest is None:
+        getattr(html_writer, method_name)(*args)
+        return None
+    record = manifest['pages'].get(key)
+    if record and _is_current(html_writer, record):
+        return None
+    return html_writer.record_dependencies(method_name, *args, old_record=record)
+
+def _write_chunk(start, end, staging_dir):
+    # Write the pages for tasks start..end-1 in a worker process, and return a
+    # (changed, registered, written, record, warnings) tuple for each task
+    # completed, where 'changed' is whether the task changed the writer's
+    # state, 'registered' is a list of the images it used, 'written' is a list
+    # of the files it wrote, 'record' is its build manifest record, and
+    # 'warnings' is a list of the warnings it produced; stop at the first task
+    # that fails
+    html_writer = _html_writer
+    file_info = html_writer.file_info = _StagingFileInfo(html_writer.file_info, staging_dir)
+    # The image pool belongs to the parent process
+    html_writer.image_pool = None
+    # Warnings are written by the parent process, and only for the tasks whose
+    # results it keeps
+    html_writer._warnings = []
+    results = []
+    state = html_writer._get_state()
+    for task in _tasks[start:end]:
+        try:
+            record = _run_task(html_writer, task)
+        except Exception:
+            break
+        new_state = html_writer._get_state()
+        results.append((new_state != state, file_info.registered, file_info.written, record, html_writer._warnings))
+        file_info.registered = []
+        file_info.written = []
+        html_writer._warnings = []
+        state = new_state
+    return results
+
+def _write_in_parallel(html_writer, tasks, jobs):
+    global _html_writer, _tasks
+    file_info = html_writer.file_info
+    size = -(-len(tasks) // (jobs * 4))
+    chunks = [(start, min(start + size, len(tasks))) for start in range(0, len(tasks), size)]
+    records = []
+    with tempfile.TemporaryDirectory(prefix='.skoolkit-', dir=file_info.odir) as staging_dir:
+        args = [(start, end, os.path.join(staging_dir, str(start))) for start, end in chunks]
+        _html_writer, _tasks = html_writer, tasks
+        try:
+            # Each worker process writes one chunk of pages and then exits, so
+            # that every chunk is written from the writer's initial state
+            with multiprocessing.Pool(jobs, maxtasksperchild=1) as pool:
+                results = pool.starmap(_write_chunk, args, 1)
+        finally:
+            _html_writer = _tasks = None
+
+        # The pages in a chunk are valid only if no page in an earlier chunk
+        # changed the writer's state (e.g. by #POKES, #PUSHS or by defining a
+        # frame); pages after that point are written again here, in order
+        changed = False
+        for (start, end, chunk_dir), chunk_results in zip(args, results):
+            if changed:
+                for task in tasks[start:end]:
+                    records.append(_run_task(html_writer, task))
+                continue
+            for task, (task_changed, registered, written, record, warnings) in zip(tasks[start:end], chunk_results):
+                for fname in written:
+                    if fname not in file_info.images:
+                        dest = os.path.join(file_info.odir, fname)
+                        os.makedirs(dirname(dest), exist_ok=True)
+                        os.replace(os.path.join(chunk_dir, fname), dest)
+                for image_path in registered:
+                    file_info.add_image(image_path)
+                if task_changed:
+                    # Write the page again to bring this writer's state up to
+                    # date
+                    record = _run_task(html_writer, task)
+                    changed = True
+                else:
+                    html_writer.replay_warnings(warnings)
+                records.append(record)
+            for task in tasks[start + len(chunk_results):end]:
+                # This task failed in the worker process; write it here so
+                # that any error is reported
+                state = html_writer._get_state()
+                records.append(_run_task(html_writer, task))
+                changed = changed or html_writer._get_state() != state
+    return records
+
+def _write_pages(html_writer, tasks, jobs=1):
+    # Write the pages for 'tasks', update the build manifest (if any), and
+    # return the number of pages skipped because they were up to date
+    if _can_write_in_parallel(jobs):
+        records = _write_in_parallel(html_writer, tasks, jobs)
+    else:
+        records = [_run_task(html_writer, task) for task in tasks]
+    manifest = html_writer.manifest
+    if manifest is None:
+        return 0
+    skipped = 0
+    for (key, method_name, args), record in zip(tasks, records):
+        if record:
+            manifest['pages'][key] = record
+            manifest['images'].update(record['images'])
+        else:
+            skipped += 1
+    return skipped
+
+def _get_manifest_params(html_writer):
+    # Anything that may affect every page; if any of these change, the build
+    # manifest is discarded and every page is written
+    writer_class = html_writer.__class__
+    parser = html_writer.parser
+    return ((writer_class.__module__, writer_class.__qualname__),
+            (parser.case, parser.base, parser.mode.create_labels, parser.mode.asm_labels),
+            list(html_writer.ref_parser._sections.items()),
+            sorted(html_writer.game_vars.items()),
+            sorted(html_writer.paths.items()))
+
+def write_disassembly(html_writer, files, search_dir, extra_search_dirs, pages, css_themes, single_css, jobs=1,
+                      incremental=False):
     game_dir = html_writer.file_info.game_dir
     paths = html_writer.paths
     game_vars = html_writer.game_vars
@@ -274,25 +509,58 @@ def write_disassembly(html_writer, files, search_dir, extra_search_dirs, pages,
             raise SkoolKitError('Cannot copy resource "{}": file not found'.format(normpath(f)))
         copy_resource(fname, odir, dest_dir)
 
-    # Write disassembly files
-    if 'd' in files:
-        if html_writer.asm_single_page_template:
-            message = 'Writing {}'.format(normpath(game_dir, paths['AsmSinglePage']))
-        else:
-            message = 'Writing disassembly files in {}'.format(normpath(game_dir, html_writer.code_path))
-        clock(html_writer.write_asm_entries, '  ' + message)
+    if incremental:
+        manifest_file = os.path.join(odir, skoolcache.MANIFEST)
+        html_writer.manifest = skoolcache.load_manifest(manifest_file, _get_manifest_params(html_writer))
+    skipped = 0
+
+    if incremental or _can_write_in_parallel(jobs):
+        # Write disassembly files, memory maps and pages defined by [Page:*]
+        # sections as a list of tasks, skipping pages that are up to date
+        # and/or writing them in a pool of worker processes
+        tasks = []
+        if 'd' in files:
+            if html_writer.asm_single_page_template:
+                notify('  Writing {}'.format(normpath(game_dir, paths['AsmSinglePage'])))
+            else:
+                notify('  Writing disassembly files in {}'.format(normpath(game_dir, html_writer.code_path)))
+            tasks.extend(_get_entry_tasks(html_writer, html_writer.code_path, paths[P_MEMORY_MAP]))
+        if 'm' in files:
+            for map_name in html_writer.main_memory_maps:
+                notify('  Writing {}'.format(normpath(game_dir, paths[map_name])))
+                tasks.append(_get_task(html_writer, 'write_map', map_name))
+        if 'P' in files:
+            for page_id in pages:
+                page_details = html_writer.pages[page_id]
+                copy_resources(search_dir, extra_search_dirs, odir, page_details.get('JavaScript'), js_path, indent=2)
+                notify('  Writing {}'.format(normpath(game_dir, paths[page_id])))
+                tasks.append(_get_task(html_writer, 'write_page', page_id))
+        if tasks:
+            if _can_write_in_parallel(jobs):
+                message = '  Rendering {} pages in {} processes'.format(len(tasks), jobs)
+            else:
+                message = '  Rendering {} pages'.format(len(tasks))
+            skipped += clock(_write_pages, message, html_writer, tasks, jobs)
+    else:
+        # Write disassembly files
+        if 'd' in files:
+            if html_writer.asm_single_page_template:
+                message = 'Writing {}'.format(normpath(game_dir, paths['AsmSinglePage']))
+            else:
+                message = 'Writing disassembly files in {}'.format(normpath(game_dir, html_writer.code_path))
+            clock(html_writer.write_asm_entries, '  ' + message)
 
-    # Write the memory map files
-    if 'm' in files:
-        for map_name in html_writer.main_memory_maps:
-            clock(html_writer.write_map, '  Writing {}'.format(normpath(game_dir, paths[map_name])), map_name)
+        # Write the memory map files
+        if 'm' in files:
+            for map_name in html_writer.main_memory_maps:
+                clock(html_writer.write_map, '  Writing {}'.format(normpath(game_dir, paths[map_name])), map_name)
 
-    # Write pages defined by [Page:*] sections
-    if 'P' in files:
-        for page_id in pages:
-            page_details = html_writer.pages[page_id]
-            copy_resources(search_dir, extra_search_dirs, odir, page_details.get('JavaScript'), js_path, indent=2)
-            clock(html_writer.write_page, '  Writing {}'.format(normpath(game_dir, paths[page_id])), page_id)
+        # Write pages defined by [Page:*] sections
+        if 'P' in files:
+            for page_id in pages:
+                page_details = html_writer.pages[page_id]
+                copy_resources(search_dir, extra_search_dirs, odir, page_details.get('JavaScript'), js_path, indent=2)
+                clock(html_writer.write_page, '  Writing {}'.format(normpath(game_dir, paths[page_id])), page_id)
 
     # Write other code files
     if 'o' in files:
@@ -305,24 +573,50 @@ def write_disassembly(html_writer, files, search_dir, extra_search_dirs, pages,
             map_name = code['IndexPageId']
             map_path = paths[map_name]
             asm_path = paths[code['CodePathId']]
-            clock(html_writer2.write_map, '    Writing {}'.format(normpath(game_dir, map_path)), map_name)
             if html_writer.asm_single_page_template:
                 message = 'Writing {}'.format(normpath(game_dir, paths[code['AsmSinglePageId']]))
             else:
                 message = 'Writing disassembly files in {}'.format(normpath(game_dir, asm_path))
-            clock(html_writer2.write_entries, '    ' + message, asm_path, map_path)
+            if incremental:
+                notify('    Writing {}'.format(normpath(game_dir, map_path)))
+                tasks = [_get_task(html_writer2, 'write_map', map_name)]
+                tasks.extend(_get_entry_tasks(html_writer2, asm_path, map_path))
+                skipped += clock(_write_pages, '    {} ({} pages)'.format(message, len(tasks)), html_writer2, tasks)
+            else:
+                clock(html_writer2.write_map, '    Writing {}'.format(normpath(game_dir, map_path)), map_name)
+                clock(html_writer2.write_entries, '    ' + message, asm_path, map_path)
 
     # Write index.html
     if 'i' in files:
-        clock(html_writer.write_index, '  Writing {}'.format(normpath(game_dir, paths['GameIndex'])))
+        message = '  Writing {}'.format(normpath(game_dir, paths['GameIndex']))
+        if incremental:
+            skipped += clock(_write_pages, message, html_writer, [_get_task(html_writer, 'write_index')])
+        else:
+            clock(html_writer.write_index, message)
+
+    # Wait for any images still being written in the background
+    image_pool = html_writer.image_pool
+    if image_pool and image_pool.jobs:
+        clock(image_pool.join, '  Waiting for {} images'.format(len(image_pool.jobs)))
+
+    if incremental:
+        notify('  Skipped {} unchanged pages'.format(skipped))
+        skoolcache.save_manifest(manifest_file, html_writer.manifest)
 
 def run(files, options):
     if options.output_dir == '.':
         topdir = ''
     else:
         topdir = normpath(options.output_dir)
-    for infile in files:
-        process_file(infile, topdir, options)
+    image_pool = None
+    if options.image_jobs > 0 and _can_fork():
+        image_pool = _ImagePool(options.image_jobs)
+    try:
+        for infile in files:
+            process_file(infile, topdir, options, image_pool)
+    finally:
+        if image_pool:
+            image_pool.close()
 
 def main(args):
     global verbose, show_timings
@@ -342,6 +636,8 @@ def main(args):
                        help="Write all routines and data blocks to a single page.")
     group.add_argument('-a', '--asm-labels', dest='asm_labels', action='store_const', const=1, default=config['AsmLabels'],
                        help="Use ASM labels.")
+    group.add_argument('--cache', dest='cache_dir', metavar='DIR', default=config['CacheDir'],
+                       help="Cache the parsed skool file in this directory.")
     group.add_argument('-c', '--config', dest='config_specs', metavar='S/L', action='append', default=[],
                        help="Add the line 'L' to the ref file section 'S'. This\n"
                             "option may be used multiple times.")
@@ -353,8 +649,17 @@ def main(args):
                        help="Write the disassembly in decimal.")
     group.add_argument('-H', '--hex', dest='base', action='store_const', const=BASE_16, default=config['Base'],
                        help="Write the disassembly in hexadecimal.")
+    group.add_argument('--image-jobs', dest='image_jobs', metavar='N', type=int, default=0,
+                       help="Encode image files in N background processes while\n"
+                            "the pages are written (default: 0).")
+    group.add_argument('--incremental', dest='incremental', action='store_true',
+                       help="Write only the pages whose inputs have changed since the\n"
+                            "last run with this option.")
     group.add_argument('-I', '--ini', dest='params', metavar='p=v', action='append', default=[],
                        help="Set the value of the configuration parameter 'p' to\n'v'. This option may be used multiple times.")
+    group.add_argument('--jobs', dest='jobs', metavar='N', type=int, default=1,
+                       help="Write disassembly pages, memory maps and other pages in\n"
+                            "N processes (default: 1).")
     group.add_argument('-j', '--join-css', dest='single_css', metavar='NAME', default=config['JoinCss'],
                        help="Concatenate CSS files into a single file with this name.")
     group.add_argument('-l', '--lower', dest='case', action='store_const', const=CASE_LOWER, default=config['Case'],
@@ -368,6 +673,8 @@ def main(args):
                             "PAGES is a comma-separated list of page IDs.")
     group.add_argument('-q', '--quiet', dest='quiet', action='store_const', const=1, default=config['Quiet'],
                        help="Be quiet.")
+    group.add_argument('--rebuild-cache', dest='rebuild_cache', action='store_true',
+                       help="Ignore any cached copy of the parsed skool file and\nreplace it (used with --cache).")
     group.add_argument('-r', '--ref-sections', dest='ref_sections', metavar='PREFIX',
                        help="Show default ref file sections whose names start with\n"
                             "PREFIX and exit.")
@@ -397,6 +704,8 @@ def main(args):
     group.add_argument('-W', '--writer', dest='writer', metavar='CLASS',
                        help="Specify the HTML writer class to use; shorthand for\n"
                             "'--config Config/HtmlWriterClass=CLASS'.")
+    # ImageCacheSize has no command line option
+    parser.set_defaults(image_cache_size=config['ImageCacheSize'])
 
     start = time.time()
     namespace, unknown_args = parser.parse_known_args(args)
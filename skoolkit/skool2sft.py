@@ -20,7 +20,7 @@ from skoolkit import integer, VERSION
 from skoolkit.skoolsft import SftWriter
 
 def run(skoolfile, options):
-    writer = SftWriter(skoolfile, options.write_hex, options.preserve_base)
+    writer = SftWriter(skoolfile, options.write_hex, options.preserve_base, options.cache_dir, options.rebuild_cache)
     writer.write(options.start, options.end)
 
 def main(args):
@@ -34,12 +34,16 @@ def main(args):
     group = parser.add_argument_group('Options')
     group.add_argument('-b', '--preserve-base', action='store_true', dest='preserve_base',
                        help="Preserve the base of decimal and hexadecimal values in instruction operands and DEFB/DEFM/DEFS/DEFW statements.")
+    group.add_argument('--cache', dest='cache_dir', metavar='DIR',
+                       help="Cache the parsed skool file in this directory.")
     group.add_argument('-E', '--end', dest='end', metavar='ADDR', type=integer, default=65536,
                        help="Stop converting at this address.")
     group.add_argument('-h', '--hex', action='store_const', dest='write_hex', const=1, default=0,
                        help='Write addresses in upper case hexadecimal format.')
     group.add_argument('-l', '--hex-lower', action='store_const', dest='write_hex', const=-1, default=0,
                        help='Write addresses in lower case hexadecimal format.')
+    group.add_argument('--rebuild-cache', dest='rebuild_cache', action='store_true',
+                       help="Ignore any cached copy of the parsed skool file and replace it (used with --cache).")
     group.add_argument('-S', '--start', dest='start', metavar='ADDR', type=integer, default=0,
                        help="Start converting at this address.")
     group.add_argument('-V', '--version', action='version', version='SkoolKit {}'.format(VERSION),
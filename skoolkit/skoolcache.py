@@ -0,0 +1,184 @@
+# Copyright 2017 Richard Dymond (rjdymond@gmail.com)
+#
+# This file is part of SkoolKit.
+#
+# SkoolKit is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# SkoolKit is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# SkoolKit. If not, see <http://www.gnu.org/licenses/>.
+
+import gc
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+
+from skoolkit import VERSION, warn
+
+CACHE_SUFFIX = '.pickle'
+
+MANIFEST = '.skoolkit-manifest'
+
+# Increment this whenever the pickled form of a cached object changes, so that
+# stale cache files are not loaded
+CACHE_FORMAT = 1
+
+def _get_key(kind, params, skoolfile):
+    # Cache files are pickled with the highest protocol that this version of
+    # Python supports, so a cache directory shared by different versions keeps
+    # a separate copy for each one
+    digest = hashlib.sha256()
+    digest.update(repr((VERSION, CACHE_FORMAT, sys.version_info[:2], kind, params)).encode('utf-8'))
+    with open(skoolfile, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _load(fname):
+    try:
+        with open(fname, 'rb') as f:
+            # Unpickling creates a large number of objects that the cyclic
+            # garbage collector need not look at until loading is complete
+            gc.disable()
+            try:
+                return pickle.load(f)
+            finally:
+                gc.enable()
+    except (OSError, EOFError, AttributeError, ImportError, IndexError, KeyError, TypeError, ValueError,
+            pickle.UnpicklingError):
+        return None
+
+def _dump_pickle(obj, f):
+    pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+
+def _save(fname, obj, dump=_dump_pickle, mode='wb'):
+    tmpfile = '{}.{}.tmp'.format(fname, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(tmpfile, mode) as f:
+            dump(obj, f)
+        os.replace(tmpfile, fname)
+    except (OSError, TypeError, ValueError, pickle.PicklingError) as e:
+        warn('Failed to write {}: {}'.format(fname, e))
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+
+def load(cache_dir, rebuild, kind, params, skoolfile, build):
+    # Return the result of 'build()' for 'skoolfile', reusing the copy stored
+    # in 'cache_dir' if there is one for the same file contents, 'kind' and
+    # 'params'; if 'rebuild' is true, any stored copy is ignored and replaced
+    if not cache_dir or skoolfile == '-':
+        return build()
+    key = _get_key(kind, params, skoolfile)
+    fname = os.path.join(cache_dir, key + CACHE_SUFFIX)
+    if not rebuild:
+        obj = _load(fname)
+        if obj is not None:
+            for msg in getattr(obj, '_warnings', ()):
+                warn(msg)
+            return obj
+    obj = build()
+    _save(fname, obj)
+    return obj
+
+def load_manifest(fname, params):
+    # Return the build manifest stored in 'fname' if it was saved with the same
+    # 'params', or an empty manifest otherwise; the file is removed, so that a
+    # build that fails leaves no stale manifest behind
+    key = hashlib.sha256(repr((VERSION, CACHE_FORMAT, params)).encode('utf-8')).hexdigest()
+    manifest = {'key': key, 'pages': {}, 'images': {}}
+    try:
+        # The manifest is stored in the output directory, which is not to be
+        # trusted with anything more than JSON
+        with open(fname, encoding='utf-8') as f:
+            data = json.load(f)
+        if data['key'] == key:
+            manifest['pages'] = {tuple(page_key): record for page_key, record in data['pages']}
+            manifest['images'] = dict(data['images'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    if os.path.isfile(fname):
+        os.remove(fname)
+    return manifest
+
+def save_manifest(fname, manifest):
+    # JSON has no tuples, so the pages (keyed by tuples) are stored as a list
+    # of (key, record) pairs
+    data = dict(manifest, pages=[[list(k), r] for k, r in manifest['pages'].items()])
+    _save(fname, data, json.dump, 'w')
+
+class ImageCache:
+    # A store of image files, shared between runs and between disassemblies,
+    # in which each file is named after a digest of the data it was built from;
+    # when the files take up more than 'max_size' bytes, the least recently
+    # used are removed
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.size = None
+
+    def get(self, key):
+        # Return the path of the image file stored under 'key', or None if
+        # there is no such file
+        path = os.path.join(self.cache_dir, key)
+        try:
+            # Mark the file as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, fname):
+        # Store a copy of the image file 'fname' under 'key'
+        path = os.path.join(self.cache_dir, key)
+        tmpfile = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            shutil.copyfile(fname, tmpfile)
+            os.replace(tmpfile, path)
+        except OSError as e:
+            warn('Failed to write {}: {}'.format(path, e))
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+            return
+        if self.size is None:
+            self.size = sum(f[1] for f in self._get_files())
+        else:
+            self.size += os.path.getsize(path)
+        if self.size > self.max_size:
+            self._evict()
+
+    def _get_files(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.tmp'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def _evict(self):
+        # Remove the least recently used files until the cache is no more than
+        # three quarters full, so that it is not scanned again on every store
+        files = sorted(self._get_files())
+        self.size = sum(f[1] for f in files)
+        for mtime, size, path in files:
+            if self.size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
@@ -16,8 +16,9 @@
 
 import re
 
-from skoolkit import SkoolParsingError, write_line, get_int_param, get_address_format, open_file
-from skoolkit.skoolparser import (Comment, Register, parse_comment_block, parse_instruction, parse_address_comments,
+from skoolkit import SkoolParsingError, skoolcache, write_line, get_int_param, get_address_format
+from skoolkit.skoollexer import BLANK, COMMENT, CONTINUATION, DIRECTIVE, read_skool, split_instruction
+from skoolkit.skoolparser import (Comment, Register, parse_comment_block, parse_address_comments,
                                   join_comments, parse_asm_block_directive, DIRECTIVES)
 from skoolkit.z80 import get_size, parse_string, parse_word, split_operation
 
@@ -216,8 +217,11 @@ def extract_entry_asm_directives(asm_directives):
 
 class CtlWriter:
     def __init__(self, skoolfile, elements='abtdrmsc', write_hex=0,
-                 preserve_base=False, min_address=0, max_address=65536):
-        self.parser = SkoolParser(skoolfile, preserve_base, min_address, max_address)
+                 preserve_base=False, min_address=0, max_address=65536,
+                 cache_dir=None, rebuild_cache=False):
+        params = (preserve_base, min_address, max_address)
+        self.parser = skoolcache.load(cache_dir, rebuild_cache, 'skoolctl', params, skoolfile,
+                                      lambda: SkoolParser(skoolfile, *params))
         self.elements = elements
         self.write_asm_dirs = ASM_DIRECTIVES in elements
         self.address_fmt = get_address_format(write_hex, write_hex < 0)
@@ -438,32 +442,30 @@ class SkoolParser:
         self.stack = []
         self.end_address = 65536
 
-        with open_file(skoolfile) as f:
-            self._parse_skool(f, min_address, max_address)
+        self._parse_skool(read_skool(skoolfile), min_address, max_address)
 
-    def _parse_skool(self, skoolfile, min_address, max_address):
+    def _parse_skool(self, records, min_address, max_address):
         map_entry = None
         instruction = None
         comments = []
         ignores = []
         address_comments = []
-        for line in skoolfile:
-            if line.startswith(';'):
+        for kind, line, index in records:
+            if kind == COMMENT:
                 if self.mode.include:
                     comments.append(line[2:].rstrip())
                 instruction = None
                 address_comments.append((None, None))
                 continue
 
-            if line.startswith('@'):
+            if kind == DIRECTIVE:
                 self._parse_asm_directive(line[1:].rstrip(), ignores, len(comments))
                 continue
 
             if not self.mode.include:
                 continue
 
-            s_line = line.strip()
-            if not s_line:
+            if kind == BLANK:
                 instruction = None
                 address_comments.append((None, None))
                 if comments and map_entry:
@@ -472,14 +474,14 @@ class SkoolParser:
                 map_entry = None
                 continue
 
-            if s_line.startswith(';'):
+            if kind == CONTINUATION:
                 if map_entry and instruction:
                     # This is an instruction comment continuation line
-                    address_comments[-1][1] = '{} {}'.format(address_comments[-1][1], s_line[1:].lstrip())
+                    address_comments[-1][1] = '{} {}'.format(address_comments[-1][1], line[index + 1:].strip())
                 continue # pragma: no cover
 
             # This line contains an instruction
-            instruction, address_comment = self._parse_instruction(line)
+            instruction, address_comment = self._parse_instruction(line, index)
             address = instruction.address
             if address < min_address:
                 continue
@@ -546,8 +548,8 @@ class SkoolParser:
             else:
                 self.mode.add_asm_directive(directive)
 
-    def _parse_instruction(self, line):
-        ctl, addr_str, operation, comment = parse_instruction(line)
+    def _parse_instruction(self, line, index):
+        ctl, addr_str, operation, comment = split_instruction(line, index)
         try:
             address = get_int_param(addr_str)
         except ValueError:
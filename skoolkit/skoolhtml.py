@@ -18,15 +18,18 @@
 Defines the :class:`FileInfo` and :class:`HtmlWriter` classes.
 """
 
+import functools
+import hashlib
 import html
 import posixpath
+import shutil
 import os.path
 from os.path import isfile, isdir, basename
 from collections import defaultdict
 import re
 from io import StringIO
 
-from skoolkit import skoolmacro, SkoolKitError, warn, parse_int, format_template
+from skoolkit import skoolmacro, SkoolKitError, VERSION, warn, parse_int, compile_template
 from skoolkit.defaults import REF_FILE
 from skoolkit.graphics import Frame, adjust_udgs, build_udg, font_udgs, scr_udgs
 from skoolkit.image import ImageWriter
@@ -74,6 +77,18 @@ class HtmlWriter:
         self.defaults = RefParser()
         self.defaults.parse(StringIO(REF_FILE))
         self.file_info = file_info
+        self.manifest = None
+        self._deps = None
+        self._old_record = None
+        self._fingerprints = {}
+        self._neighbours = {}
+        # The key of the cached value being built (if any), the keys of the
+        # cached values whose warnings have been written, and the list (if
+        # any) in which warnings are collected as (key, message) tuples instead
+        # of being written
+        self._building = None
+        self._warned = set()
+        self._warnings = None
 
         self.fields = {
             'asm': 0,
@@ -86,6 +101,9 @@ class HtmlWriter:
         iw_options = self.get_dictionary('ImageWriter')
         self.image_writer = ImageWriter(colours, iw_options)
         self.default_image_format = self.image_writer.default_format
+        self.image_cache = None
+        self.image_pool = None
+        self._image_colours = colours
         self.frames = {}
 
         self.snapshot = self.parser.snapshot
@@ -220,6 +238,7 @@ class HtmlWriter:
         self.templates = {}
         for name, template in self.get_sections('Template'):
             self.templates[name] = template
+        self._renderers = {}
         self.skoolkit = {}
         self.stylesheets = {}
         self.javascript = {}
@@ -250,16 +269,147 @@ class HtmlWriter:
         return self.parser.case
 
     def warn(self, s):
-        warn(s)
+        if self._warnings is not None:
+            self._warnings.append((self._building, s))
+        elif self._building is None or self._building not in self._warned:
+            warn(s)
+
+    def replay_warnings(self, warnings):
+        # Write warnings collected by another copy of this writer, except
+        # those from building a cached value whose warnings have already been
+        # written (as they would not be written again by this writer)
+        for key, message in warnings:
+            if key is None or key not in self._warned:
+                warn(message)
+        self._warned.update(key for key, message in warnings if key is not None)
 
     def clone(self, skool_parser, code_id):
         the_clone = self.__class__(skool_parser, self.ref_parser, self.file_info, code_id)
         the_clone.set_style_sheet(self.game_vars['StyleSheet'])
+        the_clone.manifest = self.manifest
+        the_clone.image_cache = self.image_cache
+        the_clone.image_pool = self.image_pool
         return the_clone
 
     def set_style_sheet(self, value):
         self.game_vars['StyleSheet'] = value
 
+    def record_dependencies(self, method_name, *args, old_record=None):
+        # Call the named method with 'args', and return a build manifest record
+        # of the inputs it used and the files it wrote; 'old_record' is the
+        # record made the last time the page was written
+        if not isinstance(self.snapshot, _RecordingSnapshot):
+            snapshot = _RecordingSnapshot(self.snapshot, self)
+            if self.parser.snapshot is self.snapshot:
+                self.parser.snapshot = snapshot
+            self.snapshot = snapshot
+        snapshot = self.snapshot
+        snapshot.modified = False
+        depth = len(self._snapshots)
+        frames = self._get_named_frames()
+        deps = self._deps = _Dependencies()
+        self._old_record = old_record
+        try:
+            getattr(self, method_name)(*args)
+        finally:
+            self._deps = self._old_record = None
+        if self.snapshot is not snapshot or snapshot.modified or len(self._snapshots) != depth or self._get_named_frames() != frames:
+            # The pages written after this one depend on it
+            deps.keys.add(('volatile',))
+        record = deps.get_record()
+        record['digest'] = self.get_dependency_digest(record)
+        return record
+
+    def get_dependency_digest(self, record):
+        # Return a digest of the current values of the inputs in the build
+        # manifest record 'record'
+        fingerprints = [(key, self._get_fingerprint(tuple(key))) for key in record['keys']]
+        reads = record['reads']
+        values = [self.snapshot[a] for a in reads]
+        return hashlib.sha1(repr((fingerprints, reads, values)).encode('utf-8')).hexdigest()
+
+    def _get_state(self):
+        # Return the parts of this writer's state that writing one page may
+        # change for the pages written after it
+        return self.snapshot[:], len(self._snapshots), self._get_named_frames()
+
+    def _get_named_frames(self):
+        return {name: frame for name, frame in self.frames.items() if name}
+
+    def _add_dependency(self, *key):
+        if self._deps is not None:
+            self._deps.keys.add(key)
+
+    def _get_cached(self, cache, key, build, *args):
+        # Return the value cached under 'key' (building it first if necessary)
+        # and record the inputs that were used to build it
+        if key not in cache:
+            deps, self._deps = self._deps, _Dependencies()
+            building, self._building = self._building, (build.__name__, key)
+            try:
+                value = build(*args)
+            finally:
+                built_deps, self._deps = self._deps, deps
+                self._building = building
+            self._warned.add((build.__name__, key))
+            cache[key] = (value, built_deps)
+        value, built_deps = cache[key]
+        if self._deps is not None:
+            self._deps.update(built_deps)
+        return value
+
+    def _get_fingerprint(self, key):
+        kind = key[0]
+        if kind == 'x':
+            return self.file_info.file_exists(key[1])
+        if key not in self._fingerprints:
+            fingerprint = None
+            if kind == 'm':
+                fingerprint = [(e.address, e.ctl) for e in self.memory_map]
+            elif kind == 'n':
+                if not self._neighbours:
+                    addresses = [None] + [e.address for e in self.memory_map] + [None]
+                    for i in range(1, len(addresses) - 1):
+                        self._neighbours[addresses[i]] = (addresses[i - 1], addresses[i + 1])
+                fingerprint = self._neighbours.get(key[1])
+            elif kind == 'h':
+                fingerprint = self._get_header_fingerprint(self.parser.get_entry(key[1]))
+            elif kind == 'b':
+                fingerprint = self._get_body_fingerprint(self.parser.get_entry(key[1]))
+            elif kind == 'a':
+                entry = self.parser.get_entry(key[1])
+                instruction = self.parser.get_instruction(key[1], key[2])
+                if entry:
+                    fingerprint = [self._get_header_fingerprint(entry), [e.address for e in entry.referrers]]
+                if instruction:
+                    container = instruction.container
+                    fingerprint = (fingerprint, container.address, container.asm_id, instruction.asm_label,
+                                   instruction.addr_str, [e.address for e in instruction.referrers])
+            self._fingerprints[key] = fingerprint
+        return self._fingerprints[key]
+
+    def _get_header_fingerprint(self, entry):
+        if entry:
+            has_labels = any(i.asm_label for i in entry.instructions)
+            return (entry.ctl, entry.addr_str, entry.size, entry.description, entry.details,
+                    self.parser.get_asm_label(entry.address), has_labels)
+
+    def _get_body_fingerprint(self, entry):
+        if entry:
+            instructions = []
+            for instruction in entry.instructions:
+                comment = instruction.comment
+                if comment:
+                    comment = (comment.rowspan, comment.text)
+                reference = instruction.reference
+                if reference:
+                    reference = (reference.address, reference.addr_str, reference.entry.address,
+                                 reference.entry.asm_id, self.parser.get_asm_label(reference.address))
+                instructions.append((instruction.ctl, instruction.addr_str, instruction.address, instruction.operation,
+                                     instruction.mid_block_comment, comment, instruction.asm_label, reference))
+            registers = [(r.prefix, r.name, r.contents) for r in entry.registers]
+            return (registers, entry.end_comment, instructions)
+
     # API
     def format_template(self, name, fields, default=None):
         """Format a template with a set of replacement fields.
@@ -274,14 +424,29 @@ class HtmlWriter:
         """
         try:
             if default is None:
-                tname = '{}-{}'.format(self._get_page_id(), name)
-                template = self.templates.get(tname, self.templates[name])
+                page_id = self._get_page_id()
+                key = (page_id, name, None)
             else:
-                template = self.templates.get(name, self.templates[default])
+                key = (None, name, default)
+            render = self._renderers.get(key)
+            if render is None:
+                if default is None:
+                    tname = '{}-{}'.format(page_id, name)
+                    template = self.templates.get(tname, self.templates[name])
+                else:
+                    template = self.templates.get(name, self.templates[default])
+                render = self._renderers[key] = compile_template(template, name, self.template_subs)
         except KeyError as e:
             raise SkoolKitError("'{}' template does not exist".format(e.args[0]))
-        fields.update(self.template_subs)
-        return format_template(template, name, **fields)
+        return render(fields)
+
+    def _format(self, template, name, **fields):
+        # Format a template that is not defined in a [Template:*] section
+        key = (template, name)
+        render = self._renderers.get(key)
+        if render is None:
+            render = self._renderers[key] = compile_template(template, name)
+        return render(fields)
 
     def _expand_values(self, obj, *exceptions):
         if isinstance(obj, str):
@@ -431,12 +596,14 @@ class HtmlWriter:
 
     def get_entry(self, address):
         """Return the routine or data block that starts at `address`."""
+        self._add_dependency('a', address, '')
         return self.parser.get_entry(address)
 
     def get_entry_point_refs(self, address):
         """Return the addresses of the routines and data blocks that contain
         instructions that refer to `address`.
         """
+        self._add_dependency('a', address, '')
         return self.parser.get_entry_point_refs(address)
 
     # API
@@ -451,7 +618,10 @@ class HtmlWriter:
         :meth:`~skoolkit.skoolhtml.HtmlWriter.push_snapshot`)."""
         if len(self._snapshots) < 2:
             raise SkoolKitError("Cannot pop snapshot when snapshot stack is empty")
-        self.snapshot = self._snapshots.pop()[0]
+        snapshot = self._snapshots.pop()[0]
+        if isinstance(self.snapshot, _RecordingSnapshot):
+            snapshot = _RecordingSnapshot(snapshot, self)
+        self.snapshot = snapshot
 
     # API
     def push_snapshot(self, name=''):
@@ -477,16 +647,21 @@ class HtmlWriter:
         :param image_path: The full path of the image file relative to the root
                            directory of the disassembly.
         """
+        if self.manifest is not None:
+            # The manifest decides whether the image file is up to date when it
+            # is written
+            return image_path not in self.file_info.images
         return self.file_info.need_image(image_path)
 
     def file_exists(self, fname):
+        self._add_dependency('x', fname)
         return self.file_info.file_exists(fname)
 
     def relpath(self, cwd, target):
         return posixpath.relpath(target, cwd)
 
     def asm_fname(self, address, path=''):
-        return posixpath.normpath(join(path, format_template(self.asm_fname_template, 'CodeFiles', address=address)))
+        return posixpath.normpath(join(path, self._format(self.asm_fname_template, 'CodeFiles', address=address)))
 
     def _asm_relpath(self, cwd, address, code_id=None):
         if not code_id:
@@ -499,7 +674,7 @@ class HtmlWriter:
         return self.relpath(cwd, join(code_path, self.asm_fname(address)))
 
     def asm_anchor(self, address):
-        return format_template(self.asm_anchor_template, 'AddressAnchor', address=address)
+        return self._format(self.asm_anchor_template, 'AddressAnchor', address=address)
 
     def join_paragraphs(self, paragraphs, cwd):
         lines = []
@@ -527,6 +702,7 @@ class HtmlWriter:
 
     def write_index(self):
         index_fname, cwd = self._set_cwd(P_GAME_INDEX)
+        self._add_dependency('m')
 
         link_groups = {}
         for section_id, header_text, page_list in self.get_sections('Index', False, True):
@@ -574,6 +750,7 @@ class HtmlWriter:
         self.write_file(index_fname, html)
 
     def _get_entry_dict(self, cwd, entry, desc=True):
+        self._add_dependency('h', entry.address)
         if desc:
             description = self.join_paragraphs(entry.details, cwd)
         else:
@@ -594,20 +771,16 @@ class HtmlWriter:
         }
 
     def _get_map_entry_dict(self, cwd, entry, desc):
-        address = entry.address
-        key = (cwd, address, desc)
-        if key not in self.map_entry_dicts:
-            self.map_entry_dicts[key] = self._get_entry_dict(cwd, entry, desc)
-        return self.map_entry_dicts[key]
+        return self._get_cached(self.map_entry_dicts, (cwd, entry.address, desc), self._get_entry_dict, cwd, entry, desc)
 
     def _get_asm_entry_dict(self, cwd, index, map_file):
         entry = self.memory_map[index]
-        address = entry.address
-        if address not in self.asm_entry_dicts:
-            entry_dict = self._get_entry_dict(cwd, entry)
-            entry_dict['map_href'] = '{}#{}'.format(self.relpath(cwd, map_file), self.asm_anchor(entry.address))
-            self.asm_entry_dicts[address] = entry_dict
-        return self.asm_entry_dicts[address]
+        return self._get_cached(self.asm_entry_dicts, entry.address, self._build_asm_entry_dict, cwd, entry, map_file)
+
+    def _build_asm_entry_dict(self, cwd, entry, map_file):
+        entry_dict = self._get_entry_dict(cwd, entry)
+        entry_dict['map_href'] = '{}#{}'.format(self.relpath(cwd, map_file), self.asm_anchor(entry.address))
+        return entry_dict
 
     def _format_contents_list_items(self, link_list):
         items = []
@@ -746,6 +919,7 @@ class HtmlWriter:
 
     def _get_asm_entry(self, cwd, index, map_file):
         entry = self.memory_map[index]
+        self._add_dependency('b', entry.address)
         entry_dict = self._get_asm_entry_dict(cwd, index, map_file)
         entry_dict['annotated'] = int(any([i.comment and i.comment.text for i in entry.instructions]))
 
@@ -810,6 +984,7 @@ class HtmlWriter:
 
     def write_entry(self, cwd, index, map_file):
         entry = self.memory_map[index]
+        self._add_dependency('n', entry.address)
         page_id = self._get_asm_page_id(self.code_id, entry.ctl)
         fname = join(cwd, self.asm_fname(entry.address))
         self._set_cwd(page_id, fname)
@@ -832,6 +1007,7 @@ class HtmlWriter:
     def _write_asm_single_page(self, map_file):
         page_id = self._get_asm_page_id(self.code_id)
         fname, cwd = self._set_cwd(page_id)
+        self._add_dependency('m')
         asm_entries = []
         for i, entry in enumerate(self.memory_map):
             entry_subs = self._get_asm_entry(cwd, i, map_file)
@@ -860,6 +1036,7 @@ class HtmlWriter:
 
     def write_map(self, map_name):
         fname, cwd = self._set_cwd(map_name)
+        self._add_dependency('m')
 
         map_details = self.memory_maps.get(map_name, {})
         entry_types = map_details.get('EntryTypes', DEF_MEMORY_MAP_ENTRY_TYPES)
@@ -899,6 +1076,8 @@ class HtmlWriter:
         self.write_file(fname, html)
 
     def write_file(self, fname, contents):
+        if self._deps is not None:
+            self._deps.outputs.append(fname)
         with self.file_info.open_file(fname) as f:
             f.write(contents)
 
@@ -940,17 +1119,16 @@ class HtmlWriter:
         return self.format_template(self._get_page_id(), subs, default)
 
     def _get_logo(self, cwd):
-        if cwd not in self.logo:
-            logo_macro = self.game_vars.get('Logo')
-            if logo_macro:
-                self.logo[cwd] = self.expand(logo_macro, cwd)
-            else:
-                logo_image = self.game_vars.get('LogoImage')
-                if logo_image and self.file_exists(logo_image):
-                    self.logo[cwd] = self.format_img(self.game_name, self.relpath(cwd, logo_image))
-                else:
-                    self.logo[cwd] = self.game_name
-        return self.logo[cwd]
+        return self._get_cached(self.logo, cwd, self._build_logo, cwd)
+
+    def _build_logo(self, cwd):
+        logo_macro = self.game_vars.get('Logo')
+        if logo_macro:
+            return self.expand(logo_macro, cwd)
+        logo_image = self.game_vars.get('LogoImage')
+        if logo_image and self.file_exists(logo_image):
+            return self.format_img(self.game_name, self.relpath(cwd, logo_image))
+        return self.game_name
 
     def format_anchor(self, anchor):
         return self.format_template('anchor', {'anchor': anchor})
@@ -996,6 +1174,11 @@ class HtmlWriter:
         if image_path:
             if self.need_image(image_path):
                 self.write_animated_image(image_path, frames)
+            elif self._deps is not None:
+                # Record the image as an output of this page, and the memory
+                # it is built from as an input
+                self._deps.outputs.append(image_path)
+                self._deps.add_image(image_path, _get_frames_digest(frames, self._get_image_format(image_path)))
             return self.img_element(cwd, image_path, alt)
         return ''
 
@@ -1033,11 +1216,52 @@ class HtmlWriter:
                        the image.
         """
         img_format = self._get_image_format(image_path)
+        if self.manifest is not None:
+            digest = _get_frames_digest(frames, img_format)
+            if self._deps is not None:
+                self._deps.outputs.append(image_path)
+                self._deps.add_image(image_path, digest)
+            if self._old_record and image_path in self._old_record['images']:
+                old_digest = self._old_record['images'][image_path]
+            else:
+                old_digest = self.manifest['images'].get(image_path)
+            if not self.file_info.replace_images and old_digest == digest and self.file_info.file_exists(image_path):
+                # This page built the image from the same frames last time
+                self.file_info.add_image(image_path)
+                return
+        if self.image_cache:
+            key = '{}.{}'.format(self._get_image_key(frames, img_format), img_format)
+            cached = self.image_cache.get(key)
+            if cached:
+                self.file_info.link_file(cached, image_path)
+                self.file_info.add_image(image_path)
+                return
         f = self.file_info.open_file(image_path, mode='wb')
-        self.image_writer.write_image(frames, f, img_format)
-        f.close()
+        if self.image_pool:
+            # Encode the image in the background; the file is complete only
+            # when the pool has been joined
+            f.close()
+            callback = None
+            if self.image_cache:
+                callback = functools.partial(self.image_cache.put, key, f.name)
+            self.image_pool.write_image(self.image_writer, frames, img_format, f.name, callback)
+        else:
+            self.image_writer.write_image(frames, f, img_format)
+            f.close()
+            if self.image_cache:
+                self.image_cache.put(key, f.name)
         self.file_info.add_image(image_path)
 
+    def _get_image_key(self, frames, img_format):
+        # Return a digest of the frames and of everything else that affects
+        # the image file built from them
+        image_writer = self.image_writer
+        writer_class = image_writer.__class__
+        iw_config = (VERSION, writer_class.__module__, writer_class.__qualname__,
+                     sorted(image_writer.options.items()), sorted(self._image_colours.items()))
+        data = repr(iw_config) + _get_frames_digest(frames, img_format)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
     def build_table(self, table):
         rows = []
         for row in table.rows:
@@ -1114,6 +1338,8 @@ class HtmlWriter:
         return True
 
     def expand_call(self, text, index, cwd):
+        # The method called may depend on anything
+        self._add_dependency('volatile')
         return skoolmacro.parse_call(text, index, self, cwd)
 
     def expand_chr(self, text, index, cwd):
@@ -1137,6 +1363,7 @@ class HtmlWriter:
         return skoolmacro.parse_for(text, index)
 
     def expand_foreach(self, text, index, cwd):
+        self._add_dependency('m')
         return skoolmacro.parse_foreach(text, index, self)
 
     def expand_html(self, text, index, cwd):
@@ -1202,6 +1429,7 @@ class HtmlWriter:
             code_path = self.get_code_path(code_id)
         else:
             code_path = self.code_path
+        self._add_dependency('a', address, code_id or '')
         container = self.parser.get_container(address, code_id)
         if (not code_id or code_id == self.code_id) and not container:
             raise MacroParsingError('Could not find instruction at {}'.format(addr_str))
@@ -1249,13 +1477,15 @@ class HtmlWriter:
         addr, attr, scale, step, inc, flip, rotate, mask, mask_addr, mask_step = params
         udgs = lambda: [[build_udg(self.snapshot, addr, attr, step, inc, flip, rotate, mask, mask_addr, mask_step)]]
         if not fname and not frame:
-            fname = format_template(self.udg_fname_template, 'UDGFilename', addr=addr, attr=attr, scale=scale)
+            fname = self._format(self.udg_fname_template, 'UDGFilename', addr=addr, attr=attr, scale=scale)
             if frame == '':
                 frame = fname
         frames = [Frame(udgs, scale, mask, *crop_rect, name=frame)]
         return end, self.handle_image(frames, fname, cwd, alt)
 
     def _expand_udgarray_with_frames(self, text, index, cwd):
+        # The frames may have been defined on any page
+        self._add_dependency('volatile')
         end, fname, alt, frames = skoolmacro.parse_udgarray_with_frames(text, index, self.frames)
         return end, self.handle_image(frames, fname, cwd, alt)
 
@@ -1303,8 +1533,23 @@ class FileInfo:
             path = join(path, name)
         if not isdir(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path))
+        elif 'b' in mode and isfile(path):
+            # The file may be a hard link to a file in the image cache, which
+            # must not be overwritten
+            os.remove(path)
         return open(path, mode)
 
+    def link_file(self, source, fname):
+        path = join(self.odir, fname)
+        if not isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        elif isfile(path):
+            os.remove(path)
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+
     def add_image(self, image_path):
         self.images.add(image_path)
 
@@ -1313,3 +1558,68 @@ class FileInfo:
 
     def file_exists(self, fname):
         return isfile(join(self.odir, fname))
+
+class _Dependencies:
+    # The inputs used and the files written while writing a page
+    def __init__(self):
+        self.keys = set()
+        self.reads = set()
+        self.outputs = []
+        self.images = {}
+
+    def update(self, other):
+        self.keys.update(other.keys)
+        self.reads.update(other.reads)
+        self.outputs.extend(other.outputs)
+        for image_path, digest in other.images.items():
+            self.add_image(image_path, digest)
+
+    def add_image(self, image_path, digest):
+        # Only the first use of an image on a page may write the image file
+        self.images.setdefault(image_path, digest)
+
+    def get_record(self):
+        # Return these dependencies as a build manifest record, which is made
+        # of lists and dictionaries only, so that it can be stored as JSON
+        return {
+            'keys': sorted(list(key) for key in self.keys),
+            'reads': sorted(self.reads),
+            'outputs': self.outputs,
+            'images': self.images
+        }
+
+class _RecordingSnapshot(list):
+    # A memory snapshot that records the addresses read from it while the
+    # writer is recording dependencies
+    def __init__(self, data, html_writer):
+        list.__init__(self, data)
+        self.html_writer = html_writer
+        self.modified = False
+
+    def __getitem__(self, index):
+        deps = self.html_writer._deps
+        if deps is not None:
+            if isinstance(index, slice):
+                deps.reads.update(range(*index.indices(len(self))))
+            else:
+                deps.reads.add(index % len(self))
+        return list.__getitem__(self, index)
+
+    def __setitem__(self, index, value):
+        self.modified = True
+        list.__setitem__(self, index, value)
+
+    def __iter__(self):
+        deps = self.html_writer._deps
+        if deps is not None:
+            deps.reads.update(range(len(self)))
+        return list.__iter__(self)
+
+def _get_frames_digest(frames, img_format):
+    # Return a digest of the image that would be built from 'frames'
+    data = [img_format]
+    for frame in frames:
+        data.append((frame.scale, frame.mask, frame.x, frame.y, frame.width, frame.height, frame.delay))
+        for row in frame.udgs:
+            data.append([(udg.attr, list(udg.data), udg.mask and list(udg.mask)) for udg in row])
+    return hashlib.sha1(repr(data).encode('utf-8')).hexdigest()
@@ -0,0 +1,118 @@
+# Copyright 2017 Richard Dymond (rjdymond@gmail.com)
+#
+# This file is part of SkoolKit.
+#
+# SkoolKit is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# SkoolKit is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# SkoolKit. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from skoolkit import open_file
+from skoolkit.textutils import find_unquoted
+
+# Line types
+COMMENT = 0       # Entry-level comment (';' in column 1)
+DIRECTIVE = 1     # ASM directive ('@' in column 1)
+BLANK = 2         # Blank line (entry separator)
+CONTINUATION = 3  # Instruction comment continuation line
+INSTRUCTION = 4   # Instruction line
+
+# Lexed skool files, keyed by absolute path (or '-' for standard input)
+_preloaded = {}
+
+def _get_key(skoolfile):
+    if skoolfile == '-':
+        return skoolfile
+    return os.path.abspath(skoolfile)
+
+def preload_skool(skoolfile):
+    """Read and lex a skool file now, and keep the line records in memory for
+    subsequent calls to :func:`read_skool` for the same file.
+
+    :param skoolfile: The name of the skool file, or '-' for standard input.
+    """
+    with open_file(skoolfile) as f:
+        _preloaded[_get_key(skoolfile)] = list(lex_skool(f))
+
+def clear_preloaded():
+    """Discard the line records of every skool file preloaded by
+    :func:`preload_skool`."""
+    _preloaded.clear()
+
+def read_skool(skoolfile):
+    """Return an iterator over the line records of a skool file, using the
+    records preloaded by :func:`preload_skool` if there are any.
+
+    :param skoolfile: The name of the skool file, '-' for standard input, or a
+                      file-like object.
+    """
+    if isinstance(skoolfile, str):
+        records = _preloaded.get(_get_key(skoolfile))
+        if records is not None:
+            return iter(records)
+    return _lex_file(skoolfile)
+
+def _lex_file(skoolfile):
+    with open_file(skoolfile) as f:
+        for record in lex_skool(f):
+            yield record
+
+def lex_skool(lines):
+    """Classify each line of a skool file in a single pass.
+
+    :param lines: An iterable of lines (e.g. an open skool file).
+    :return: A generator of `(kind, line, index)` tuples. For an instruction
+             line, `index` is the index of the ';' that starts the comment
+             field (or the length of the line if there is no comment); for a
+             comment continuation line, it is the index of the ';'; for any
+             other type of line, it is 0.
+    """
+    for line in lines:
+        c = line[:1]
+        if c == ';':
+            yield (COMMENT, line, 0)
+        elif c == '@':
+            yield (DIRECTIVE, line, 0)
+        elif c and not c.isspace():
+            yield (INSTRUCTION, line, find_comment(line))
+        else:
+            s_line = line.lstrip()
+            if not s_line:
+                yield (BLANK, line, 0)
+            elif s_line[0] == ';':
+                yield (CONTINUATION, line, len(line) - len(s_line))
+            else:
+                yield (INSTRUCTION, line, find_comment(line))
+
+def find_comment(line):
+    """Return the index of the ';' that starts the comment field of an
+    instruction line, or the length of the line if there is no comment.
+
+    :param line: The instruction line.
+    """
+    if '"' in line:
+        return find_unquoted(line, ';', 6)
+    index = line.find(';', 6)
+    if index < 0:
+        return len(line)
+    return index
+
+def split_instruction(line, index):
+    """Split an instruction line into its fields.
+
+    :param line: The instruction line.
+    :param index: The index of the comment field, as produced by
+                  :func:`lex_skool`.
+    :return: A 4-tuple of the form
+             `(ctl, addr_str, operation, comment)`.
+    """
+    return line[0], line[1:6], line[6:index].strip(), line[index + 1:].strip()
@@ -14,19 +14,19 @@
 # You should have received a copy of the GNU General Public License along with
 # SkoolKit. If not, see <http://www.gnu.org/licenses/>.
 
-from collections import defaultdict
+from functools import lru_cache
 import html
 import inspect
+import operator
 import re
+import threading
+from types import MappingProxyType
 
 from skoolkit import BASE_10, BASE_16, VERSION, SkoolKitError, SkoolParsingError
 from skoolkit.graphics import Udg
 
-_map_cache = {}
-
-_writer = None
-
-_cwd = ()
+# The expansion contexts of the macro expansions in progress in each thread
+_local = threading.local()
 
 FILL_UDG = Udg(66, [129, 66, 36, 24, 24, 36, 66, 128])
 
@@ -40,6 +40,36 @@ DELIMITERS = {
 
 AE_CHARS = frozenset(' !=+-*/<>&|^%$ABCDEFabcdef0123456789()')
 
+# Maximum number of distinct arithmetic expressions whose values are
+# remembered (the least recently used are discarded first)
+EXPR_CACHE_SIZE = 4096
+
+# Maximum number of distinct strings whose macro tokens are remembered (the
+# least recently used are discarded first)
+MACRO_CACHE_SIZE = 1024
+
+# Binary operators: (precedence, function)
+EXPR_OPERATORS = {
+    '||': (1, None),
+    '&&': (2, None),
+    '==': (3, operator.eq),
+    '!=': (3, operator.ne),
+    '<': (3, operator.lt),
+    '>': (3, operator.gt),
+    '<=': (3, operator.le),
+    '>=': (3, operator.ge),
+    '|': (4, operator.or_),
+    '^': (5, operator.xor),
+    '&': (6, operator.and_),
+    '<<': (7, operator.lshift),
+    '>>': (7, operator.rshift),
+    '+': (8, operator.add),
+    '-': (8, operator.sub),
+    '*': (9, operator.mul),
+    '/': (9, operator.floordiv),
+    '%': (9, operator.mod)
+}
+
 INTEGER = '(\d+|\$[0-9a-fA-F]+)'
 
 PARAM_NAME = '[a-z]+'
@@ -48,6 +78,10 @@ PARAM = '({}=)?{}'.format(PARAM_NAME, INTEGER)
 
 RE_ANCHOR = re.compile('#[a-zA-Z0-9$#]*')
 
+RE_EXPR_INT = re.compile('[1-9][0-9]*|0+|\$[0-9A-Fa-f]+')
+
+RE_EXPR_TOKEN = re.compile(r'\s*(?:(\$[0-9A-Fa-f]+|0[xX][0-9A-Fa-f]+|0[bB][01]+|[0-9]+[eE][-+]?[0-9]+|[0-9]+)|(\*\*|&&|\|\||<<|>>|<=|>=|==|!=|[-+*/%&|^<>()])|(\S))')
+
 RE_CODE_ID = re.compile('@[a-zA-Z0-9$]*')
 
 RE_EXPAND = re.compile('#[^A-Za-z0-9\s]')
@@ -114,8 +148,7 @@ def parse_ints(text, index=0, num=0, defaults=(), names=(), fields=None):
     """
     if index < len(text) and text[index] == '(':
         end, params = parse_brackets(text, index)
-        if _writer:
-            params = _writer.expand(params, *_cwd)
+        params = _expand(params)
         if fields:
             params = params.format(**fields)
         return [end] + get_params(params, num, defaults, names, False)
@@ -304,8 +337,7 @@ def _parse_image_fname(text, index, fname=''):
     if p_text is None:
         return index, fname, None, None
     alt = frame = None
-    if _writer:
-        p_text = _writer.expand(p_text, *_cwd)
+    p_text = _expand(p_text)
     if p_text:
         if '|' in p_text:
             p_text, alt = p_text.split('|', 1)
@@ -319,14 +351,136 @@ def _parse_image_fname(text, index, fname=''):
             frame = fname
     return end, fname, frame, alt
 
-def evaluate(param, safe=False):
+def _tokenize_expr(text):
+    tokens = []
+    index = 0
+    end = len(text.rstrip())
+    while index < end:
+        match = RE_EXPR_TOKEN.match(text, index)
+        num, op, other = match.groups()
+        if other:
+            raise ValueError
+        if num:
+            if num.startswith('$'):
+                value = int(num[1:], 16)
+            elif num[:2] in ('0x', '0X'):
+                value = int(num[2:], 16)
+            elif num[:2] in ('0b', '0B'):
+                value = int(num[2:], 2)
+            elif 'e' in num or 'E' in num:
+                value = float(num)
+            elif num[0] == '0' and num.strip('0'):
+                raise ValueError
+            else:
+                value = int(num)
+            tokens.append((None, value))
+        else:
+            tokens.append((op, None))
+        index = match.end()
+    tokens.append(('', None))
+    return tokens
+
+class _ExprCompiler:
+    def __init__(self, text):
+        self.tokens = _tokenize_expr(text)
+        self.index = 0
+
+    def compile(self):
+        expr = self._binary(1)
+        if self.tokens[self.index][0] != '':
+            raise ValueError
+        return expr
+
+    def _next(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def _binary(self, min_prec):
+        left = self._unary()
+        while True:
+            op = self.tokens[self.index][0]
+            prec, func = EXPR_OPERATORS.get(op, (0, None))
+            if prec < min_prec:
+                return left
+            self.index += 1
+            if prec == 3:
+                # Comparisons may be chained: a < b < c
+                operands, funcs = [left, self._binary(4)], [func]
+                while EXPR_OPERATORS.get(self.tokens[self.index][0], (0,))[0] == 3:
+                    funcs.append(EXPR_OPERATORS[self._next()[0]][1])
+                    operands.append(self._binary(4))
+                left = _expr_compare(operands, funcs)
+            else:
+                left = _expr_binary(op, func, left, self._binary(prec + 1))
+
+    def _unary(self):
+        op = self.tokens[self.index][0]
+        if op == '-':
+            self.index += 1
+            operand = self._unary()
+            return lambda: -operand()
+        if op == '+':
+            self.index += 1
+            operand = self._unary()
+            return lambda: +operand()
+        return self._power()
+
+    def _power(self):
+        base = self._atom()
+        if self.tokens[self.index][0] == '**':
+            self.index += 1
+            exponent = self._unary()
+            return lambda: base() ** exponent()
+        return base
+
+    def _atom(self):
+        op, value = self._next()
+        if op is None:
+            return lambda: value
+        if op == '(':
+            expr = self._binary(1)
+            if self._next()[0] == ')':
+                return expr
+        raise ValueError
+
+def _expr_binary(op, func, left, right):
+    if op == '||':
+        return lambda: left() or right()
+    if op == '&&':
+        return lambda: left() and right()
+    return lambda: func(left(), right())
+
+def _expr_compare(operands, funcs):
+    def compare():
+        left = operands[0]()
+        for func, operand in zip(funcs, operands[1:]):
+            right = operand()
+            result = func(left, right)
+            if not result:
+                break
+            left = right
+        return result
+    return compare
+
+@lru_cache(maxsize=EXPR_CACHE_SIZE)
+def _evaluate(param, safe):
     param = html.unescape(param)
     if safe or set(param) <= AE_CHARS:
         try:
-            return int(eval(param.replace('$', '0x').replace('/', '//').replace('&&', ' and ').replace('||', ' or ')))
-        except:
+            return int(_ExprCompiler(param).compile()())
+        except Exception:
             pass
-    raise ValueError
+
+def evaluate(param, safe=False):
+    if RE_EXPR_INT.fullmatch(param):
+        if param.startswith('$'):
+            return int(param[1:], 16)
+        return int(param)
+    value = _evaluate(param, safe)
+    if value is None:
+        raise ValueError
+    return value
 
 def get_params(param_string, num=0, defaults=(), names=(), safe=True):
     params = []
@@ -408,26 +562,71 @@ def get_macros(writer):
             macros['#' + match.group(1).upper()] = method
     return macros
 
-def expand_macros(writer, text, *cwd):
-    global _writer, _cwd
-    _writer = writer
-    _cwd = cwd
+@lru_cache(maxsize=MACRO_CACHE_SIZE)
+def _find_macros(text):
+    return tuple((m.start(), m.end(), m.group()) for m in RE_MACRO.finditer(text))
+
+class _ExpansionContext:
+    def __init__(self, writer, cwd):
+        self.writer = writer
+        self.cwd = cwd
+
+    def expand(self, text):
+        return self.writer.expand(text, *self.cwd)
 
+def _expand(text):
+    # Expand macros in text (a macro parameter string) with the writer and cwd
+    # of the innermost macro expansion in progress in this thread, if any
+    contexts = getattr(_local, 'contexts', None)
+    if contexts:
+        return contexts[-1].expand(text)
+    return text
+
+def expand_macros(writer, text, *cwd):
     if text.find('#') < 0:
         return text
 
+    try:
+        contexts = _local.contexts
+    except AttributeError:
+        contexts = _local.contexts = []
+    contexts.append(_ExpansionContext(writer, cwd))
+    try:
+        return _expand_macros(writer, text, cwd)
+    finally:
+        contexts.pop()
+
+def _expand_macros(writer, text, cwd):
+    # Expanded text that cannot contain (or form part of) a macro is moved to
+    # 'fragments'; expanded text that can is put back in front of the rest of
+    # 'text' and scanned again. The positions of the macros in the original
+    # text are looked up in 'tokens'; once 'text' has been modified, the
+    # remaining macros are found by searching.
+    fragments = []
+    last_char = ''
+    tokens = _find_macros(text)
+    i = pos = 0
     while 1:
-        search = RE_MACRO.search(text)
-        if not search:
-            break
-        marker = search.group()
+        if tokens:
+            while i < len(tokens) and tokens[i][0] < pos:
+                i += 1
+            if i == len(tokens):
+                break
+            start, index, marker = tokens[i]
+        else:
+            search = RE_MACRO.search(text, pos)
+            if not search:
+                break
+            start, index = search.span()
+            marker = search.group()
         if marker not in writer.macros:
             raise SkoolParsingError('Found unknown macro: {}'.format(marker))
-        start, index = search.span()
 
-        while RE_EXPAND.match(text, index):
-            end, expr = parse_strings(text, index + 1, 1)
-            text = text[:index] + expand_macros(writer, expr, *cwd) + text[end:]
+        if RE_EXPAND.match(text, index):
+            while RE_EXPAND.match(text, index):
+                end, expr = parse_strings(text, index + 1, 1)
+                text = text[:index] + expand_macros(writer, expr, *cwd) + text[end:]
+            tokens = None
 
         repf = writer.macros[marker]
         try:
@@ -436,9 +635,29 @@ def expand_macros(writer, text, *cwd):
             raise SkoolParsingError('Found unsupported macro: {}'.format(marker))
         except MacroParsingError as e:
             raise SkoolParsingError('Error while parsing {} macro: {}'.format(marker, e.args[0]))
-        text = text[:start] + rep + text[end:]
 
-    return text
+        if start > pos:
+            fragments.append(text[pos:start])
+            last_char = text[start - 1]
+        following = rep[:1] or text[end:end + 1]
+        if '#' in rep or (last_char == '#' and 'A' <= following <= 'Z'):
+            if last_char == '#':
+                rep = '#' + rep
+                fragments[-1] = fragments[-1][:-1]
+                if not fragments[-1]:
+                    fragments.pop()
+                last_char = fragments[-1][-1] if fragments else ''
+            text = rep + text[end:]
+            tokens = None
+            pos = 0
+        else:
+            if rep:
+                fragments.append(rep)
+                last_char = rep[-1]
+            pos = end
+
+    fragments.append(text[pos:])
+    return ''.join(fragments)
 
 def parse_call(text, index, writer, cwd=None):
     # #CALL:methodName(args)
@@ -646,23 +865,23 @@ def parse_map(text, index, fields):
         end, args = parse_strings(text, args_index)
     except NoParametersError:
         raise NoParametersError("No mappings provided: {}".format(text[index:args_index]))
-    map_id = text[args_index:end]
-    if map_id in _map_cache:
-        return end, _map_cache[map_id][value]
-    default = args.pop(0)
-    m = defaultdict(lambda: default)
-    if args:
-        for pair in args:
-            if ':' in pair:
-                k, v = pair.split(':', 1)
-            else:
-                k = v = pair
-            try:
-                m[evaluate(k)] = v
-            except ValueError:
-                raise MacroParsingError("Invalid key ({}): {}".format(k, text[args_index:end]))
-    _map_cache[map_id] = m
-    return end, m[value]
+    default, m = _get_map(text[args_index:end], tuple(args))
+    return end, m.get(value, default)
+
+@lru_cache(maxsize=MACRO_CACHE_SIZE)
+def _get_map(map_id, args):
+    m = {}
+    for pair in args[1:]:
+        if ':' in pair:
+            k, v = pair.split(':', 1)
+        else:
+            k = v = pair
+        try:
+            m[evaluate(k)] = v
+        except ValueError:
+            raise MacroParsingError("Invalid key ({}): {}".format(k, map_id))
+    # The map is cached and shared, so it is returned as a read-only view
+    return args[0], MappingProxyType(m)
 
 def parse_n(text, index, base, is_lower):
     # #Nvalue[,hwidth,dwidth,affix,hex][(prefix[,suffix])]
@@ -15,11 +15,16 @@
 # SkoolKit. If not, see <http://www.gnu.org/licenses/>.
 
 import html
+import io
+import json
+import os
 import re
+from functools import lru_cache
 
-from skoolkit import BASE_10, BASE_16, SkoolParsingError, warn, wrap, get_int_param, parse_int, open_file
+from skoolkit import BASE_10, BASE_16, SkoolParsingError, warn, wrap, get_int_param, parse_int
+from skoolkit.skoollexer import BLANK, COMMENT, CONTINUATION, DIRECTIVE, find_comment, lex_skool, read_skool, split_instruction
 from skoolkit.skoolmacro import INTEGER, ClosingBracketError, parse_brackets
-from skoolkit.textutils import partition_unquoted, split_quoted, split_unquoted
+from skoolkit.textutils import split_quoted, split_unquoted
 from skoolkit.z80 import assemble, convert_case, get_size, split_operation
 
 DIRECTIVES = 'bcgistuw'
@@ -31,13 +36,28 @@ COLUMN_WRAP_MARKER = ':w'
 LIST_MARKER = '#LIST'
 LIST_END_MARKER = 'LIST#'
 
+BLOCK_DIRECTIVES = ('ofix', 'bfix', 'rfix', 'isub', 'ssub', 'rsub')
+GLOBAL_DIRECTIVES = ('start', 'end', 'replace=', 'assemble=', 'writer=', 'set-', 'equ=')
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
 #: Force upper case.
 CASE_UPPER = 2
 #: Force lower case.
 CASE_LOWER = 1
 
+# Maximum number of distinct operations whose case and base conversions are
+# remembered (the least recently used are discarded first)
+CONVERSION_CACHE_SIZE = 16384
+
+RE_NUMS = re.compile(r'(?<=[\s,(%*/+-])(\$[0-9A-Fa-f]+|\d+)')
+RE_INDEX_DISP = re.compile(r'\(I[XY] *[+-].*\)')
+RE_INDEX_HALF = re.compile('(I[XY])([HL])')
+RE_ADDRESS = re.compile(r'(\A|(?<=[\s,(+-]))(\$[0-9A-Fa-f]+|%[01]+|\d+)')
+
 def _replace_nums(operation, hex_fmt=None, skip_bit=False, prefix=None):
-    elements = re.split('(?<=[\s,(%*/+-])(\$[0-9A-Fa-f]+|\d+)', (prefix or '(') + operation)
+    elements = RE_NUMS.split((prefix or '(') + operation)
     for i in range(2 * int(skip_bit) + 1, len(elements), 2):
         p1, p2 = elements[i - 1][:-1].strip(), elements[i - 1][-1]
         if (p2 != '%' or not p1 or p1[-1] in ')"') and p2 != '"':
@@ -61,7 +81,7 @@ def parse_asm_block_directive(directive, stack):
     prefix = directive[:4]
     infix = directive[len(prefix):len(prefix) + 1]
     suffix = directive[len(prefix) + len(infix):].rstrip()
-    if prefix in ('ofix', 'bfix', 'rfix', 'isub', 'ssub', 'rsub') and infix in '+-' and suffix in ('begin', 'else', 'end'):
+    if prefix in BLOCK_DIRECTIVES and infix in '+-' and suffix in ('begin', 'else', 'end'):
         if stack:
             cur_op = stack[-1]
         else:
@@ -167,12 +187,6 @@ def parse_comment_block(comments, ignores, mode):
     start_comment = join_comments(sections[3], split=True)
     return start_comment, title, description, registers
 
-def parse_instruction(line):
-    ctl = line[0]
-    addr_str = line[1:6]
-    operation, sep, comment = partition_unquoted(line[6:], ';')
-    return ctl, addr_str, operation.strip(), comment.strip()
-
 def parse_address_comments(comments):
     i = 0
     while i < len(comments):
@@ -197,6 +211,122 @@ def parse_address_comments(comments):
             instruction.set_comment(rowspan, address_comment)
         i += 1
 
+def _is_global_directive(directive):
+    if directive.startswith(GLOBAL_DIRECTIVES):
+        return True
+    return directive[:4] in BLOCK_DIRECTIVES and directive[4:5] in ('+', '-')
+
+def _index_paragraph(lines):
+    # Return the addresses of the entries that start in a paragraph, or None
+    # if the paragraph must always be parsed
+    addresses = []
+    for line in lines:
+        if line.startswith((';', '@')) or line.lstrip().startswith(';'):
+            continue
+        if line[0] == 'r':
+            return None
+        if line[0] in DIRECTIVES:
+            address = parse_int(line[1:6])
+            if address is None:
+                return None
+            addresses.append(address)
+    return addresses or None
+
+def build_skool_index(skoolfile):
+    """Scan a skool file and return an index of its paragraphs (runs of
+    non-blank lines). Each item in the index is a list of the form
+    ``[start, end, addresses, directives]``, where `start` and `end` are the
+    byte offsets of the paragraph (including any trailing blank lines),
+    `addresses` is a list of the addresses of the entries in the paragraph (or
+    `None` if the paragraph must always be parsed), and `directives` is a list
+    of the ASM directives in the paragraph that have an effect beyond it.
+
+    :param skoolfile: The name of the skool file.
+    """
+    index = []
+    lines = []
+    directives = []
+    start = offset = 0
+    with open(skoolfile, 'rb') as f:
+        for line in f:
+            if line.strip():
+                if not lines and index:
+                    # Attach any blank lines to the end of the previous paragraph
+                    index[-1][1] = start = offset
+                text = line.decode('utf-8').rstrip('\r\n')
+                lines.append(text)
+                if text.startswith('@') and _is_global_directive(text[1:].rstrip()):
+                    directives.append(text)
+            elif lines:
+                index.append([start, offset, _index_paragraph(lines), directives])
+                lines, directives = [], []
+            offset += len(line)
+    if lines:
+        index.append([start, offset, _index_paragraph(lines), directives])
+    elif index:
+        index[-1][1] = offset
+    else:
+        index.append([0, offset, None, []])
+
+    # Merge consecutive paragraphs that must always be parsed
+    merged = []
+    for item in index:
+        if merged and merged[-1][2] is None and item[2] is None:
+            merged[-1][1] = item[1]
+        else:
+            merged.append(item)
+    return merged
+
+def get_skool_index(skoolfile):
+    """Return the index of a skool file (as returned by
+    :func:`build_skool_index`), reading it from the file `skoolfile.idx` if
+    that file exists and is up to date, or building it and writing it to that
+    file otherwise.
+
+    :param skoolfile: The name of the skool file.
+    """
+    stat = os.stat(skoolfile)
+    stamp = [INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+    index_file = skoolfile + INDEX_SUFFIX
+    try:
+        with open(index_file, encoding='utf-8') as f:
+            data = json.load(f)
+        if data['stamp'] == stamp:
+            return data['index']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    index = build_skool_index(skoolfile)
+    try:
+        with open(index_file, 'w', encoding='utf-8') as f:
+            json.dump({'stamp': stamp, 'index': index}, f, separators=(',', ':'))
+    except OSError:
+        pass
+    return index
+
+def _read_skool_lines(skoolfile, min_address, max_address):
+    # Yield the lines of the paragraphs of a skool file that are needed to
+    # parse the entries from min_address to max_address; for every other
+    # paragraph, yield only its global ASM directives
+    chunks = []
+    for start, end, addresses, directives in get_skool_index(skoolfile):
+        if addresses is None or any(min_address <= a < max_address for a in addresses):
+            if chunks and isinstance(chunks[-1], list) and chunks[-1][1] == start:
+                chunks[-1][1] = end
+            else:
+                chunks.append([start, end])
+        elif directives:
+            chunks.append(tuple(directives) + ('',))
+    with open(skoolfile, 'rb') as f:
+        for chunk in chunks:
+            if isinstance(chunk, list):
+                f.seek(chunk[0])
+                data = f.read(chunk[1] - chunk[0])
+                for line in io.TextIOWrapper(io.BytesIO(data), encoding='utf-8'):
+                    yield line
+            else:
+                for line in chunk:
+                    yield line + '\n'
+
 class SkoolParser:
     """Parses a skool file.
 
@@ -221,16 +351,23 @@ class SkoolParser:
     :param min_address: Ignore addresses below this one.
     :param max_address: Ignore addresses above this one.
     :param snapshot: Base snapshot to use instead of an empty one.
+    :param lazy: Whether to use the skool file's index (see
+                 :func:`get_skool_index`) to parse only the entries between
+                 `min_address` and `max_address`, instead of parsing every
+                 entry and then discarding those outside that range. In this
+                 mode, the snapshot contains only the data defined by the
+                 entries that are parsed.
     """
     def __init__(self, skoolfile, case=0, base=0, asm_mode=0, warnings=False, fix_mode=0, html=False,
-                 create_labels=False, asm_labels=True, min_address=0, max_address=65536, snapshot=None):
+                 create_labels=False, asm_labels=True, min_address=0, max_address=65536, snapshot=None,
+                 lazy=False):
         self.skoolfile = skoolfile
         self.mode = Mode(case, base, asm_mode, warnings, fix_mode, html, create_labels, asm_labels)
         self.case = case
         self.base = base
 
         self.snapshot = snapshot or [0] * 65536  # 64K of Spectrum memory
-        self._instructions = {}                  # address -> [Instructions]
+        self._instructions = {}                  # address -> (Instructions)
         self._entries = {}                       # address -> SkoolEntry
         self.memory_map = []                     # SkoolEntry instances
         self.base_address = 65536
@@ -244,9 +381,76 @@ class SkoolParser:
         self._replacements = []
         self.equs = []
         self._equ_values = {}
+        self._warnings = []
 
-        with open_file(skoolfile) as f:
-            self._parse_skool(f, min_address, max_address)
+        if lazy and (min_address > 0 or max_address < 65536) and isinstance(skoolfile, str) and skoolfile != '-':
+            records = lex_skool(_read_skool_lines(skoolfile, min_address, max_address))
+        else:
+            records = read_skool(skoolfile)
+        self._parse_skool(records, min_address, max_address)
+
+    def __getstate__(self):
+        # Replace the links between entries and instructions with indexes so
+        # that pickling does not recurse through the entire memory map
+        entries = []
+        entry_index = {}
+        def get_index(entry):
+            if id(entry) not in entry_index:
+                entry_index[id(entry)] = len(entries)
+                entries.append(entry)
+            return entry_index[id(entry)]
+        for entry in self.memory_map:
+            get_index(entry)
+        for instructions in self._instructions.values():
+            for instruction in instructions:
+                get_index(instruction.container)
+        entry_states = []
+        instruction_index = {}
+        i = 0
+        while i < len(entries):
+            entry = entries[i]
+            entry_state = _get_slot_values(entry, SkoolEntry.__slots__)
+            entry_state[_E_REFERRERS] = [get_index(e) for e in entry.referrers]
+            instruction_states = []
+            for j, instruction in enumerate(entry.instructions):
+                instruction_index[id(instruction)] = (i, j)
+                instruction_state = _get_slot_values(instruction, Instruction.__slots__)
+                instruction_state[_I_CONTAINER] = None
+                instruction_state[_I_REFERRERS] = [get_index(e) for e in instruction.referrers]
+                reference = instruction.reference
+                if reference:
+                    instruction_state[_I_REFERENCE] = (get_index(reference.entry), reference.address, reference.addr_str)
+                instruction_states.append(instruction_state)
+            entry_state[_E_INSTRUCTIONS] = instruction_states
+            entry_states.append((entry.__class__, entry_state))
+            i += 1
+        state = dict(self.__dict__)
+        state['memory_map'] = [entry_index[id(e)] for e in self.memory_map]
+        state['_entries'] = {a: entry_index[id(e)] for a, e in self._entries.items()}
+        state['_instructions'] = {a: [instruction_index[id(i)] for i in instructions] for a, instructions in self._instructions.items()}
+        state['_entry_states'] = entry_states
+        return state
+
+    def __setstate__(self, state):
+        entries = []
+        for entry_class, entry_state in state.pop('_entry_states'):
+            entries.append(_set_slot_values(entry_class.__new__(entry_class), SkoolEntry.__slots__, entry_state))
+        for entry in entries:
+            entry.referrers = [entries[i] for i in entry.referrers]
+            instructions = []
+            for instruction_state in entry.instructions:
+                instruction = _set_slot_values(Instruction.__new__(Instruction), Instruction.__slots__, instruction_state)
+                instruction.container = entry
+                instruction.referrers = [entries[i] for i in instruction.referrers]
+                if instruction.reference:
+                    index, address, addr_str = instruction.reference
+                    instruction.reference = Reference(entries[index], address, addr_str)
+                instructions.append(instruction)
+            entry.instructions = instructions
+        state['memory_map'] = [entries[i] for i in state['memory_map']]
+        state['_entries'] = {a: entries[i] for a, i in state['_entries'].items()}
+        state['_instructions'] = {a: tuple(entries[i].instructions[j] for i, j in v) for a, v in state['_instructions'].items()}
+        self.__dict__.update(state)
 
     def clone(self, skoolfile):
         return SkoolParser(
@@ -302,12 +506,12 @@ class SkoolParser:
     def convert_address_operand(self, operand):
         return self.mode.convert_address_operand(operand)
 
-    def _parse_skool(self, skoolfile, min_address, max_address):
+    def _parse_skool(self, records, min_address, max_address):
         map_entry = None
         instruction = None
         address_comments = []
-        for line in skoolfile:
-            if line.startswith(';'):
+        for kind, line, index in records:
+            if kind == COMMENT:
                 if self.mode.started and self.mode.include:
                     self.comments.append(line[2:].rstrip())
                     self.mode.ignoreua = False
@@ -315,15 +519,14 @@ class SkoolParser:
                 address_comments.append((None, None))
                 continue
 
-            if line.startswith('@'):
+            if kind == DIRECTIVE:
                 self._parse_asm_directive(line[1:].rstrip())
                 continue
 
             if not self.mode.include:
                 continue
 
-            s_line = line.strip()
-            if not s_line:
+            if kind == BLANK:
                 instruction = None
                 address_comments.append((None, None))
                 if self.comments:
@@ -336,13 +539,15 @@ class SkoolParser:
                 map_entry = None
                 continue
 
-            if s_line[0] == ';' and map_entry and instruction:
-                # This is an instruction comment continuation line
-                address_comments[-1][1] = '{0} {1}'.format(address_comments[-1][1], s_line[1:].lstrip())
-                continue
+            if kind == CONTINUATION:
+                if map_entry and instruction:
+                    # This is an instruction comment continuation line
+                    address_comments[-1][1] = '{0} {1}'.format(address_comments[-1][1], line[index + 1:].strip())
+                    continue
+                index = find_comment(line)
 
             # This line contains an instruction
-            instruction, address_comment = self._parse_instruction(line)
+            instruction, address_comment = self._parse_instruction(line, index)
             address = instruction.address
             addr_str = instruction.addr_str
             ctl = instruction.ctl
@@ -368,7 +573,7 @@ class SkoolParser:
             if map_entry:
                 address_comments.append([instruction, address_comment])
                 if address is not None:
-                    self._instructions.setdefault(address, []).append(instruction)
+                    self._instructions[address] = self._instructions.get(address, ()) + (instruction,)
                 map_entry.add_instruction(instruction)
                 if self.comments:
                     instruction.mid_block_comment = join_comments(self.comments, split=True)
@@ -534,8 +739,8 @@ class SkoolParser:
         elif directive.startswith('start'):
             self.mode.start()
 
-    def _parse_instruction(self, line):
-        ctl, addr_str, operation, comment = parse_instruction(line)
+    def _parse_instruction(self, line, index):
+        ctl, addr_str, operation, comment = split_instruction(line, index)
         addr_str, operation = self.mode.apply_case(addr_str, operation)
         addr_str, operation = self.mode.apply_base(addr_str, operation)
         instruction = Instruction(ctl, addr_str, operation)
@@ -591,18 +796,42 @@ class SkoolParser:
 
     def warn(self, s):
         if self.mode.warn:
+            self._warnings.append(s)
             warn(s)
 
+    def _warn_all(self, messages):
+        if self.mode.warn and messages:
+            self._warnings.extend(messages)
+            for message in messages:
+                warn(message)
+
     def _substitute_labels(self):
+        # Index the instructions that operands may refer to (the first
+        # instruction at each address that is not in an @isub/@ssub/@rsub/@ofix
+        # block), and collect warnings to be written once all operands have
+        # been examined
+        references = {}
+        for address, instructions in self._instructions.items():
+            for instruction in instructions:
+                if not instruction.container.asm_id:
+                    references[address] = instruction
+                    break
+        warnings = []
         for entry in self.memory_map:
             for instruction in entry.instructions:
                 if not instruction.keep_values():
                     operation = instruction.operation
-                    if operation.upper().startswith(('DEFB', 'DEFM', 'DEFW')):
-                        operands = [self._replace_addresses(instruction, op) for op in split_unquoted(operation[5:], ',')]
-                        instruction.operation = operation[:5] + ','.join(operands)
-                    elif not operation.upper().startswith(('RST', 'DEFS')):
-                        instruction.operation = self._replace_addresses(instruction, operation)
+                    operation_u = operation.upper()
+                    if operation_u.startswith(('DEFB', 'DEFM', 'DEFW')):
+                        if '"' in operation:
+                            operands = [self._replace_addresses(instruction, operation_u, op, references, warnings)
+                                        for op in split_unquoted(operation[5:], ',')]
+                            instruction.operation = operation[:5] + ','.join(operands)
+                        else:
+                            instruction.operation = operation[:5] + self._replace_addresses(instruction, operation_u, operation[5:], references, warnings)
+                    elif not operation_u.startswith(('RST', 'DEFS')):
+                        instruction.operation = self._replace_addresses(instruction, operation_u, operation, references, warnings)
+        self._warn_all(warnings)
 
     def _generate_labels(self):
         """Generate labels for mid-routine entry points (based on the label of
@@ -620,21 +849,24 @@ class SkoolParser:
                             instruction.asm_label = '{0}_{1}'.format(main_label, index)
                             index += 1
 
-    def _replace_addresses(self, instruction, operand):
+    def _replace_addresses(self, instruction, operation_u, operand, references, warnings):
+        if '"' in operand:
+            parts = split_quoted(operand)
+        else:
+            parts = (operand,)
         rep = ''
-        for p in split_quoted(operand):
+        for p in parts:
             if not p.startswith('"'):
-                pieces = re.split('(\A|(?<=[\s,(+-]))(\$[0-9A-Fa-f]+|%[01]+|\d+)', p)
+                pieces = RE_ADDRESS.split(p)
                 for i in range(2, len(pieces), 3):
-                    label = self._get_label(instruction, pieces[i])
+                    label = self._get_label(instruction, operation_u, pieces[i], references, warnings)
                     if label:
                         pieces[i] = label
                 p = ''.join(pieces)
             rep += p
         return rep
 
-    def _get_label(self, instruction, addr_str):
-        operation_u = instruction.operation.upper()
+    def _get_label(self, instruction, operation_u, addr_str, references, warnings):
         address = get_int_param(addr_str)
         if instruction.keep_value(address):
             return
@@ -642,7 +874,7 @@ class SkoolParser:
                               or self._is_8_bit_ld_instruction(operation_u)):
             return
         label_warn = instruction.sub is None and instruction.warn
-        reference = self.get_instruction(address)
+        reference = references.get(address)
         if reference:
             if reference.asm_label:
                 if reference.is_in_routine() and label_warn and operation_u.startswith('LD '):
@@ -650,22 +882,22 @@ class SkoolParser:
                     # an unsubbed operation (will need @keep to retain operand,
                     # or @nowarn if the replacement is OK)
                     rep = instruction.operation.replace(addr_str, reference.asm_label)
-                    self.warn('LD operand replaced with routine label in unsubbed operation:\n  {} {} -> {}'.format(instruction.addr_str, instruction.operation, rep))
+                    warnings.append('LD operand replaced with routine label in unsubbed operation:\n  {} {} -> {}'.format(instruction.addr_str, instruction.operation, rep))
                 return reference.asm_label
             if instruction.warn and instruction.is_in_routine():
                 # Warn if we cannot find a label to replace the operand of this
                 # routine instruction (will need @nowarn if this is OK)
-                self.warn('Found no label for operand: {} {}'.format(instruction.addr_str, instruction.operation))
+                warnings.append('Found no label for operand: {} {}'.format(instruction.addr_str, instruction.operation))
         elif address in self._equ_values:
             return self._equ_values[address]
         else:
-            references = self._instructions.get(address)
-            is_local = not (references and references[0].container.is_remote())
+            instructions = self._instructions.get(address)
+            is_local = not (instructions and instructions[0].container.is_remote())
             if is_local and label_warn and self.mode.do_ssubs and self.base_address <= address < self.end_address:
                 # Warn if the operand is inside the address range of the
                 # disassembly (where code might be) but doesn't refer to the
                 # address of an instruction (will need @nowarn if this is OK)
-                self.warn('Unreplaced operand: {} {}'.format(instruction.addr_str, instruction.operation))
+                warnings.append('Unreplaced operand: {} {}'.format(instruction.addr_str, instruction.operation))
 
 class Mode:
     def __init__(self, case, base, asm_mode, warnings, fix_mode, html, create_labels, asm_labels):
@@ -785,10 +1017,7 @@ class Mode:
         elif self.upper:
             addr_str = addr_str.upper()
         if self.lower or self.upper:
-            operation = convert_case(operation, self.lower)
-            if self.upper and not operation.startswith(('DEFB', 'DEFM', 'DEFS', 'DEFW')):
-                operation = re.sub('(I[XY])H', r'\1h', operation)
-                operation = re.sub('(I[XY])L', r'\1l', operation)
+            operation = _convert_case(operation, self.lower)
         return addr_str, operation
 
     def apply_base(self, addr_str, operation):
@@ -806,47 +1035,62 @@ class Mode:
         return addr_str, operation
 
     def convert(self, operation, hex2fmt=None, hex4fmt=None):
-        if operation.upper().startswith(('DEFB ', 'DEFM ', 'DEFS ', 'DEFW ')):
-            if operation.upper().startswith('DEFW'):
-                hex_fmt = hex4fmt
+        return _convert_base(operation, hex2fmt, hex4fmt)
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def _convert_case(operation, lower):
+    operation = convert_case(operation, lower)
+    if not lower and not operation.startswith(('DEFB', 'DEFM', 'DEFS', 'DEFW')):
+        operation = RE_INDEX_HALF.sub(lambda m: m.group(1) + m.group(2).lower(), operation)
+    return operation
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def _convert_base(operation, hex2fmt, hex4fmt):
+    if operation.upper().startswith(('DEFB ', 'DEFM ', 'DEFS ', 'DEFW ')):
+        if operation.upper().startswith('DEFW'):
+            hex_fmt = hex4fmt
+        else:
+            hex_fmt = hex2fmt
+        converted = operation[:4]
+        prefix = None
+        for p in split_quoted(operation[4:]):
+            if p.startswith('"'):
+                converted += p
+                prefix = '"'
             else:
-                hex_fmt = hex2fmt
-            converted = operation[:4]
-            prefix = None
-            for p in split_quoted(operation[4:]):
-                if p.startswith('"'):
-                    converted += p
-                    prefix = '"'
-                else:
-                    converted += _replace_nums(p, hex_fmt, prefix=prefix)
-                    prefix = None
-            return converted
+                converted += _replace_nums(p, hex_fmt, prefix=prefix)
+                prefix = None
+        return converted
 
-        elements = split_operation(operation, tidy=True)
-        op = elements[0]
+    elements = split_operation(operation, tidy=True)
+    op = elements[0]
 
-        # Instructions containing '(I[XY]+d)'
-        if re.search('\(I[XY] *[+-].*\)', operation.upper()):
-            return _replace_nums(operation, hex2fmt, op in ('BIT', 'RES', 'SET'))
+    # Instructions containing '(I[XY]+d)'
+    if RE_INDEX_DISP.search(operation.upper()):
+        return _replace_nums(operation, hex2fmt, op in ('BIT', 'RES', 'SET'))
 
-        if op in ('CALL', 'DJNZ', 'JP', 'JR'):
-            return _replace_nums(operation, hex4fmt)
+    if op in ('CALL', 'DJNZ', 'JP', 'JR'):
+        return _replace_nums(operation, hex4fmt)
 
-        if op in ('AND', 'OR', 'XOR', 'SUB', 'CP', 'IN', 'OUT', 'ADD', 'ADC', 'SBC', 'RST'):
-            return _replace_nums(operation, hex2fmt)
+    if op in ('AND', 'OR', 'XOR', 'SUB', 'CP', 'IN', 'OUT', 'ADD', 'ADC', 'SBC', 'RST'):
+        return _replace_nums(operation, hex2fmt)
 
-        if op == 'LD' and len(elements) == 3:
-            operands = elements[1:]
-            if operands[0] in ('A', 'B', 'C', 'D', 'E', 'H', 'L', 'IXL', 'IXH', 'IYL', 'IYH', '(HL)') and not operands[1].startswith('('):
-                # LD r,n; LD (HL),n
-                return _replace_nums(operation, hex2fmt)
-            if not set(('A', 'BC', 'DE', 'HL', 'IX', 'IY', 'SP')).isdisjoint(operands):
-                # LD A,(nn); LD (nn),A; LD rr,nn; LD rr,(nn); LD (nn),rr
-                return _replace_nums(operation, hex4fmt)
+    if op == 'LD' and len(elements) == 3:
+        operands = elements[1:]
+        if operands[0] in ('A', 'B', 'C', 'D', 'E', 'H', 'L', 'IXL', 'IXH', 'IYL', 'IYH', '(HL)') and not operands[1].startswith('('):
+            # LD r,n; LD (HL),n
+            return _replace_nums(operation, hex2fmt)
+        if not set(('A', 'BC', 'DE', 'HL', 'IX', 'IY', 'SP')).isdisjoint(operands):
+            # LD A,(nn); LD (nn),A; LD rr,nn; LD rr,(nn); LD (nn),rr
+            return _replace_nums(operation, hex4fmt)
 
-        return operation
+    return operation
 
 class Instruction:
+    __slots__ = ('ctl', 'addr_str', 'addr_base', 'address', 'operation', 'container', 'reference',
+                 'mid_block_comment', 'comment', 'referrers', 'asm_label', 'nolabel', 'org', 'sub',
+                 'keep', 'warn', 'ignoreua', 'ignoremrcua')
+
     def __init__(self, ctl, addr_str, operation):
         self.ctl = ctl
         if addr_str[0].isdigit():
@@ -916,12 +1160,16 @@ class Instruction:
         return self.keep_values() or (self.keep and value in self.keep)
 
 class Reference:
+    __slots__ = ('entry', 'address', 'addr_str')
+
     def __init__(self, entry, address, addr_str):
         self.entry = entry
         self.address = address
         self.addr_str = addr_str
 
 class Comment:
+    __slots__ = ('rowspan', 'text')
+
     def __init__(self, rowspan, text):
         self.rowspan = rowspan
         self.text = text
@@ -930,6 +1178,9 @@ class Comment:
         self.text = repf(self.text)
 
 class SkoolEntry:
+    __slots__ = ('asm_id', 'address', 'addr_str', 'ctl', 'description', 'details', 'registers',
+                 'instructions', 'end_comment', 'referrers', 'size', 'ignoreua')
+
     def __init__(self, address, addr_str=None, ctl=None, description=None, details=(), registers=()):
         self.asm_id = ''
         self.address = address
@@ -973,6 +1224,8 @@ class SkoolEntry:
         self.end_comment = [repf(p) for p in self.end_comment]
 
 class RemoteEntry(SkoolEntry):
+    __slots__ = ()
+
     def __init__(self, asm_id, address):
         SkoolEntry.__init__(self, address)
         self.asm_id = asm_id
@@ -981,6 +1234,8 @@ class RemoteEntry(SkoolEntry):
         return True
 
 class Register:
+    __slots__ = ('prefix', 'name', 'contents')
+
     def __init__(self, prefix, name, contents):
         self.prefix = prefix
         self.name = name
@@ -989,6 +1244,20 @@ class Register:
     def apply_replacements(self, repf):
         self.contents = repf(self.contents)
 
+_I_CONTAINER = Instruction.__slots__.index('container')
+_I_REFERENCE = Instruction.__slots__.index('reference')
+_I_REFERRERS = Instruction.__slots__.index('referrers')
+_E_INSTRUCTIONS = SkoolEntry.__slots__.index('instructions')
+_E_REFERRERS = SkoolEntry.__slots__.index('referrers')
+
+def _get_slot_values(obj, slots):
+    return [getattr(obj, name) for name in slots]
+
+def _set_slot_values(obj, slots, values):
+    for name, value in zip(slots, values):
+        setattr(obj, name, value)
+    return obj
+
 class TableParser:
     def parse_text(self, writer, text, index, *cwd):
         try:
@@ -14,11 +14,11 @@
 # You should have received a copy of the GNU General Public License along with
 # SkoolKit. If not, see <http://www.gnu.org/licenses/>.
 
-from skoolkit import SkoolParsingError, write_line, get_int_param, get_address_format, open_file
+from skoolkit import SkoolParsingError, skoolcache, write_line, get_int_param, get_address_format
 from skoolkit.skoolctl import (get_instruction_ctl, get_lengths, get_operand_bases,
                                get_defb_length, get_defs_length, get_defw_length)
+from skoolkit.skoollexer import BLANK, COMMENT, CONTINUATION, DIRECTIVE, read_skool
 from skoolkit.skoolparser import parse_asm_block_directive, DIRECTIVES
-from skoolkit.textutils import find_unquoted
 from skoolkit.z80 import get_size
 
 VALID_CTLS = DIRECTIVES + ' *'
@@ -103,9 +103,12 @@ class ControlLine:
         return False
 
 class SftWriter:
-    def __init__(self, skoolfile, write_hex=0, preserve_base=False):
+    def __init__(self, skoolfile, write_hex=0, preserve_base=False, cache_dir=None, rebuild_cache=False):
         self.skoolfile = skoolfile
+        self.write_hex = write_hex
         self.preserve_base = preserve_base
+        self.cache_dir = cache_dir
+        self.rebuild_cache = rebuild_cache
         self.stack = []
         self.verbatim = False
         self.address_fmt = get_address_format(write_hex, write_hex < 0)
@@ -115,12 +118,11 @@ class SftWriter:
         lines = []
         ctl_lines = []
         entry_ctl = None
-        f = open_file(self.skoolfile)
-        for line in f:
-            if line.startswith(';'):
+        for kind, line, index in read_skool(self.skoolfile):
+            if kind == COMMENT:
                 lines.append(VerbatimLine(line))
                 continue
-            if line.startswith('@'):
+            if kind == DIRECTIVE:
                 lines.append(VerbatimLine(line))
                 self._parse_asm_directive(line[1:].rstrip())
                 continue
@@ -128,9 +130,7 @@ class SftWriter:
                 # This line is inside a '+' block, so include it as is
                 lines.append(VerbatimLine(line))
                 continue
-            s_line = line.strip()
-            if not s_line:
-                # This line is blank
+            if kind == BLANK:
                 lines.append(VerbatimLine(line))
                 entry_ctl = None
                 continue
@@ -139,13 +139,12 @@ class SftWriter:
                 entry_ctl = line[0]
             if entry_ctl in VERBATIM_BLOCKS:
                 lines.append(VerbatimLine(line))
-            elif s_line.startswith(';'):
+            elif kind == CONTINUATION:
                 # This line is a continuation of an instruction comment
-                comment_index = line.index(';')
-                lines.append(VerbatimLine(" ;{} {}".format(comment_index, line[comment_index + 1:].lstrip())))
+                lines.append(VerbatimLine(" ;{} {}".format(index, line[index + 1:].lstrip())))
             elif line[0] in VALID_CTLS:
                 # This line contains an instruction
-                ctl_line = self._parse_instruction(line)
+                ctl_line = self._parse_instruction(line, index)
                 if ctl_line.address >= max_address:
                     while lines and lines[-1].is_trimmable():
                         lines.pop()
@@ -158,7 +157,6 @@ class SftWriter:
                 ctl_lines.append(ctl_line)
             else:
                 lines.append(VerbatimLine(line))
-        f.close()
 
         if min_address > 0:
             if start_index < 0:
@@ -173,20 +171,19 @@ class SftWriter:
                 return self._compress_blocks(lines[start_index + 1:])
         return self._compress_blocks(lines)
 
-    def _parse_instruction(self, line):
+    def _parse_instruction(self, line, index):
         ctl = line[0]
         try:
             address = get_int_param(line[1:6])
         except ValueError:
             raise SkoolParsingError("Invalid address ({}):\n{}".format(line[1:6], line.rstrip()))
         addr_str = self.address_fmt.format(address)
-        comment_index = find_unquoted(line, ';', 6, neg=True)
-        if comment_index > 0:
-            end = comment_index
+        if index < len(line):
+            comment_index = index
         else:
-            end = len(line)
-        operation = line[7:end].strip()
-        comment = line[end + 1:].strip()
+            comment_index = -1
+        operation = line[7:index].strip()
+        comment = line[index + 1:].strip()
         return ControlLine(ctl, address, addr_str, operation, comment_index, comment, self.preserve_base)
 
     def _parse_asm_directive(self, directive):
@@ -221,5 +218,8 @@ class SftWriter:
         return compressed
 
     def write(self, min_address=0, max_address=65536):
-        for line in self._parse_skool(min_address, max_address):
+        params = (self.write_hex, self.preserve_base, min_address, max_address)
+        lines = skoolcache.load(self.cache_dir, self.rebuild_cache, 'skoolsft', params, self.skoolfile,
+                                lambda: self._parse_skool(min_address, max_address))
+        for line in lines:
             write_line(str(line))
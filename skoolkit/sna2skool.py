@@ -20,7 +20,8 @@ from skoolkit import find_file, info, integer, read_bin_file, VERSION
 from skoolkit.config import get_config, show_config, update_options
 from skoolkit.ctlparser import CtlParser
 from skoolkit.sftparser import SftParser
-from skoolkit.snapshot import get_snapshot
+from skoolkit.simulator import Simulator
+from skoolkit.snapshot import get_registers, get_snapshot
 from skoolkit.snaskool import SkoolWriter, generate_ctls, write_ctl
 
 START = 16384
@@ -28,9 +29,12 @@ END = 65536
 
 def run(snafile, options, config):
     # Read the snapshot file
+    registers = None
     if snafile[-4:].lower() in ('.sna', '.szx', '.z80'):
         snapshot = get_snapshot(snafile, options.page)
         start = max(START, options.start)
+        if options.genctlfile and options.tstates:
+            registers = get_registers(snafile)
     else:
         ram = read_bin_file(snafile, 65536)
         if options.org is None:
@@ -40,6 +44,7 @@ def run(snafile, options, config):
         snapshot = [0] * org
         snapshot.extend(ram)
         start = max(org, options.start)
+        registers = {'pc': start}
     end = min(options.end, len(snapshot))
 
     snapshot += [0] * (65536 - len(snapshot))
@@ -53,7 +58,10 @@ def run(snafile, options, config):
 
     if options.genctlfile:
         # Generate a control file
-        ctls = generate_ctls(snapshot, start, end, options.code_map)
+        executed = None
+        if options.tstates:
+            executed = _simulate(snapshot, registers, options.tstates)
+        ctls = generate_ctls(snapshot, start, end, options.code_maps, executed)
         write_ctl(options.genctlfile, ctls, options.ctl_hex)
         ctl_parser = CtlParser(ctls)
     elif options.ctlfile:
@@ -66,6 +74,11 @@ def run(snafile, options, config):
     writer = SkoolWriter(snapshot, ctl_parser, options, config)
     writer.write_skool(options.write_refs, options.text)
 
+def _simulate(snapshot, registers, tstates):
+    info('Simulating {} T-states from PC={}'.format(tstates, registers['pc']))
+    simulator = Simulator(snapshot[:], registers)
+    return simulator.run(max_tstates=tstates)
+
 def main(args):
     config = get_config('sna2skool')
     parser = argparse.ArgumentParser(
@@ -96,8 +109,9 @@ def main(args):
                        help='Write the disassembly in lower case.')
     group.add_argument('-m', '--defb-mod', dest='defb_mod', metavar='M', type=int, default=config['DefbMod'],
                        help=argparse.SUPPRESS)
-    group.add_argument('-M', '--map', dest='code_map', metavar='FILE',
-                       help='Use FILE as a code execution map when generating a control file.')
+    group.add_argument('-M', '--map', dest='code_maps', metavar='FILE', action='append', default=[],
+                       help='Use FILE as a code execution map when generating a control file. '
+                            'This option may be used multiple times.')
     group.add_argument('-n', '--defb-size', dest='defb_size', metavar='N', type=int, default=config['DefbSize'],
                        help=argparse.SUPPRESS)
     group.add_argument('-o', '--org', dest='org', metavar='ADDR', type=integer,
@@ -120,6 +134,9 @@ def main(args):
                        help='Show SkoolKit version number and exit.')
     group.add_argument('-w', '--line-width', dest='line_width', metavar='W', type=int, default=config['LineWidth'],
                        help='Set the maximum line width of the skool file (default: {}).'.format(config['LineWidth']))
+    group.add_argument('-x', '--run', dest='tstates', metavar='T', type=integer, default=0,
+                       help='Simulate T T-states of execution (starting at the PC in the snapshot, or at the start address of a binary file) '
+                            'and use the addresses executed as a code execution map when generating a control file.')
     group.add_argument('-z', '--defb-zfill', dest='zfill', action='store_const', const=1, default=config['DefbZfill'],
                        help=argparse.SUPPRESS)
 
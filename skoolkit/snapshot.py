@@ -17,7 +17,7 @@
 import textwrap
 import zlib
 
-from skoolkit import SkoolKitError, get_int_param, read_bin_file
+from skoolkit import SkoolKitError, get_int_param, get_word, read_bin_file
 
 # http://www.worldofspectrum.org/faq/reference/z80format.htm
 Z80_REGISTERS = {
@@ -68,6 +68,17 @@ def get_snapshot(fname, page=None):
     mem.extend(ram)
     return mem
 
+def get_registers(fname):
+    ext = fname[-4:].lower()
+    if ext not in ('.sna', '.z80', '.szx'):
+        raise SnapshotError("{0}: Unknown file type '{1}'".format(fname, ext[1:]))
+    data = read_bin_file(fname)
+    if ext == '.sna':
+        return _read_sna_registers(data)
+    if ext == '.z80':
+        return _read_z80_registers(data)
+    return _read_szx_registers(data)
+
 def set_z80_registers(z80, *specs):
     for spec in specs:
         reg, sep, val = spec.lower().partition('=')
@@ -225,6 +236,41 @@ def poke(snapshot, param_str):
     for a in range(addr1, addr2 + 1, step):
         snapshot[a] = poke_f(snapshot[a])
 
+def _read_sna_registers(data):
+    registers = {
+        'i': data[0],
+        '^hl': get_word(data, 1),
+        '^de': get_word(data, 3),
+        '^bc': get_word(data, 5),
+        '^f': data[7],
+        '^a': data[8],
+        'hl': get_word(data, 9),
+        'de': get_word(data, 11),
+        'bc': get_word(data, 13),
+        'iy': get_word(data, 15),
+        'ix': get_word(data, 17),
+        'iff': (data[19] >> 2) & 1,
+        'r': data[20],
+        'f': data[21],
+        'a': data[22],
+        'im': data[25] & 3
+    }
+    sp = get_word(data, 23)
+    if len(data) > 49179:
+        registers['pc'] = get_word(data, 49179)
+    else:
+        # The PC is on the stack in a 48K SNA file; any byte of it that lies
+        # in the ROM (which is not in the file) is taken to be 0
+        pc = 0
+        for i in (0, 1):
+            address = (sp + i) & 65535
+            if address >= 16384:
+                pc += data[address - 16357] * 256 ** i
+        registers['pc'] = pc
+        sp = (sp + 2) & 65535
+    registers['sp'] = sp
+    return registers
+
 def _read_sna(data, page=None):
     if len(data) <= 49179 or page is None:
         return data[27:49179]
@@ -268,6 +314,21 @@ def _read_z80(data, page=None):
         banks = (5, 2, page) # 128K
     return _decompress(data[header_size:], banks, extension)
 
+def _read_z80_registers(data):
+    registers = {'iff': data[27], 'im': data[29] & 3}
+    for reg in ('a', 'f', 'bc', 'hl', 'sp', 'i', 'de', '^bc', '^de', '^hl', '^a', '^f', 'iy', 'ix'):
+        index = Z80_REGISTERS[reg]
+        if len(reg.lstrip('^')) == 2:
+            registers[reg] = get_word(data, index)
+        else:
+            registers[reg] = data[index]
+    registers['r'] = (data[11] & 127) | ((data[12] & 1) << 7)
+    if sum(data[6:8]) > 0:
+        registers['pc'] = get_word(data, 6)
+    else:
+        registers['pc'] = get_word(data, 32)
+    return registers
+
 def _read_szx(data, page=None):
     extension = ()
     machine_id = data[6]
@@ -304,6 +365,20 @@ def _read_szx(data, page=None):
             pages[page] = ram
     return _concatenate_pages(pages, banks, extension)
 
+def _read_szx_registers(data):
+    z80r = _get_zxstblock(data, 8, 'Z80R')[1]
+    if z80r is None:
+        raise SnapshotError("Z80REGS (Z80R) block not found")
+    registers = {}
+    for i, reg in enumerate(('af', 'bc', 'de', 'hl', '^af', '^bc', '^de', '^hl', 'ix', 'iy', 'sp', 'pc')):
+        registers[reg] = get_word(z80r, i * 2)
+    for reg in ('af', '^af'):
+        af = registers.pop(reg)
+        registers[reg[:-1]] = af // 256
+        registers[reg[:-2] + 'f'] = af % 256
+    registers.update({'i': z80r[24], 'r': z80r[25], 'iff': z80r[26], 'im': z80r[28]})
+    return registers
+
 def _get_zxstblock(data, index, block_id):
     block = None
     while index < len(data) and block is None:
@@ -14,17 +14,22 @@
 # You should have received a copy of the GNU General Public License along with
 # SkoolKit. If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
+import heapq
+import io
+import mmap
+import multiprocessing
+import re
 import sys
 import os
 
 from skoolkit import (SkoolKitError, open_file, read_bin_file, warn, write_line,
-                      wrap, parse_int, get_address_format, format_template)
-from skoolkit.ctlparser import CtlParser
-from skoolkit.disassembler import Disassembler
+                      wrap, get_address_format, format_template)
+from skoolkit.disassembler import Disassembler, FLOW_JUMP, FLOW_BRANCH, FLOW_CALL, FLOW_RETURN, FLOW_INDIRECT
 from skoolkit.skoolasm import UDGTABLE_MARKER
 from skoolkit.skoolctl import (AD_START, AD_ORG, AD_IGNOREUA,
                                TITLE, DESCRIPTION, REGISTERS, MID_BLOCK, INSTRUCTION, END)
-from skoolkit.skoolparser import get_address, TABLE_MARKER, TABLE_END_MARKER, LIST_MARKER, LIST_END_MARKER
+from skoolkit.skoolparser import TABLE_MARKER, TABLE_END_MARKER, LIST_MARKER, LIST_END_MARKER
 
 OP_WIDTH = 13
 MIN_COMMENT_WIDTH = 10
@@ -50,10 +55,48 @@ PUNC_CHARS = ',.'
 # will be joined
 TEXT_GAP_MAX = 8
 
+# The class of each byte value: 1 (text character), 2 (punctuation character)
+# or 0 (neither)
+_TEXT_CLASSES = bytes((2 if chr(b) in PUNC_CHARS else 1) if chr(b) in CHARS else 0 for b in range(256))
+_PUNC_BYTES = frozenset(PUNC_CHARS.encode())
+_TEXT_RUN_RE = re.compile(b'[\x01\x02]+')
+_REPEAT_RE = re.compile(br'(.)\1{3,}', re.S)
+
 class CodeMapError(SkoolKitError):
     pass
 
-def _get_code_blocks(snapshot, start, end, fname):
+# Flags for each byte of a Z80 map file, expanded to one byte per address
+_Z80_MAP_FLAGS = [bytes((b >> i) & 1 for i in range(8)) for b in range(256)]
+
+# Translation table for the bytes of a SpecEmu map file
+_SPECEMU_MAP_FLAGS = bytes(b & 1 for b in range(256))
+
+class CodeMap:
+    def __init__(self):
+        self.flags = bytearray(65536)
+
+    def add(self, address):
+        self.flags[address] = 1
+
+    def update(self, flags):
+        merged = int.from_bytes(self.flags, 'little') | int.from_bytes(flags, 'little')
+        self.flags = bytearray(merged.to_bytes(65536, 'little'))
+
+    def get_code_blocks(self, disassembler, start, end):
+        # Skip over unexecuted addresses and addresses inside instructions by
+        # searching the flags for the next executed address
+        code_blocks = []
+        find = self.flags.find
+        address = find(1, start, end)
+        while address >= 0:
+            b_start = b_end = address
+            while address == b_end:
+                b_end += disassembler.flow(address)[0]
+                address = find(1, b_end, end)
+            code_blocks.append([b_start, b_end - b_start])
+        return code_blocks
+
+def _read_code_map(code_map, start, end, fname):
     if os.path.isdir(fname):
         raise SkoolKitError('{0} is a directory'.format(fname))
     try:
@@ -67,91 +110,188 @@ def _get_code_blocks(snapshot, start, end, fname):
         # Assume this is a Z80 map file
         sys.stderr.write('Reading {0}'.format(fname))
         sys.stderr.flush()
-        addresses = []
         data = read_bin_file(fname)
-        address = start & 65528
-        for b in data[start // 8:end // 8 + 1]:
-            for i in range(8):
-                if b & 1 and start <= address < end:
-                    addresses.append(address)
-                b >>= 1
-                address += 1
+        code_map.update(b''.join([_Z80_MAP_FLAGS[b] for b in data]))
     elif size == 65536:
         # Assume this is a SpecEmu map file
         sys.stderr.write('Reading {}'.format(fname))
         sys.stderr.flush()
-        addresses = []
-        data = read_bin_file(fname)
-        for address in range(start, end):
-            if data[address] & 1:
-                addresses.append(address)
+        code_map.update(read_bin_file(fname).translate(_SPECEMU_MAP_FLAGS))
     else:
         sys.stderr.write('Reading {0}: '.format(fname))
         sys.stderr.flush()
-        with open_file(fname) as f:
-            addresses = _get_addresses(f, fname, size, start, end)
+        _get_addresses(code_map, fname, size, start, end)
     sys.stderr.write('\n')
 
-    code_blocks = []
-    disassembler = Disassembler(snapshot)
-    for address in addresses:
-        size = disassembler.disassemble(address, address + 1)[0].size()
-        if code_blocks and address <= sum(code_blocks[-1]):
-            if address == sum(code_blocks[-1]):
-                code_blocks[-1][1] += size
+def _get_code_blocks(disassembler, start, end, fnames, executed=None):
+    code_map = CodeMap()
+    for fname in fnames:
+        _read_code_map(code_map, start, end, fname)
+    if executed:
+        code_map.update(executed)
+    return code_map.get_code_blocks(disassembler, start, end)
+
+# The maximum size of the chunks in which a code execution log is scanned
+# (a chunk is also no larger than 1% of the log, so that progress is reported
+# once per percentage point)
+LOG_CHUNK_SIZE = 1 << 24
+
+# The minimum size of a code execution log (in multiples of LOG_CHUNK_SIZE)
+# for its chunks to be scanned by a pool of worker processes
+LOG_PARALLEL_MIN_CHUNKS = 8
+
+def _get_zero_address(s_line):
+    return s_line[:s_line.find('\t')]
+
+def _log_format(address_f, base, ignore_prefixes, address_re):
+    # The address regex matches a line only if it is in the form that the
+    # emulator writes, and captures exactly the characters that address_f
+    # would extract from the stripped line; lines that are not blank, ignored
+    # or matched are handed back to address_f so that any errors are reported
+    # with the correct line number. Lines are anchored on '\n' instead of '^'
+    # so that the regex engine can search for them quickly.
+    ws = rb'[ \t\r\f\v]*'
+    ignore_re = b''.join([b'|' + re.escape(p.encode()) for p in ignore_prefixes])
+    return (
+        address_f,
+        base,
+        ignore_prefixes,
+        re.compile(b'\n' + ws + address_re),
+        re.compile(b'\n(?!' + ws + b'(?:' + address_re + ignore_re + b'|\n|\\Z))')
+    )
+
+_LOG_FORMATS = {
+    'fuse': _log_format(lambda s_line: s_line[2:6], 16, (), rb'0x([0-9A-Fa-f]{4})'),
+    'spud': _log_format(lambda s_line: s_line[5:9], 16, (), rb'PC = ([0-9A-Fa-f]{4}|[0-9A-Fa-f]{3}[ \t\f\v]|[0-9A-Fa-f]{2}[ \t\f\v]{2}|[0-9A-Fa-f][ \t\f\v]{3})'),
+    'specemu': _log_format(lambda s_line: s_line[:4], 16, ('PC:', 'IX:', 'HL:', 'DE:', 'BC:', 'AF:'), rb'([0-9A-Fa-f]{4})'),
+    'zero10': _log_format(_get_zero_address, 10, (), rb'([0-9]+)\t[!-~]'),
+    'zero16': _log_format(_get_zero_address, 16, (), rb'([0-9A-Fa-f]+)\t[!-~]')
+}
+
+def _get_addresses(code_map, fname, size, start, end, workers=None):
+    with open_file(fname, 'rb') as f:
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                _scan_log(code_map, data, fname, start, end, workers)
         else:
-            code_blocks.append([address, size])
-
-    return code_blocks
+            _scan_log(code_map, b'', fname, start, end, workers)
 
-def _get_addresses(f, fname, size, start, end):
-    addresses = set()
-    base = 16
+def _scan_log(code_map, data, fname, start, end, workers):
+    size = len(data)
     i = 1
-    rewind = True
-    ignore_prefixes = ()
-
+    pos = 0
     s_line = ''
-    while 1:
-        line = f.readline()
-        if not line:
-            break
-        i += 1
-        s_line = line.strip()
+    lines = []
+    while pos < size:
+        eol = data.find(b'\n', pos) + 1 or size
+        lines = _split_lines(data[pos:eol])
+        pos = eol
+        while lines:
+            s_line = lines.pop(0).strip()
+            i += 1
+            if s_line:
+                break
         if s_line:
             break
 
     if s_line.startswith('0x'):
         # Fuse profile
-        address_f = lambda s_line: s_line[2:6]
+        log_format = 'fuse'
     elif s_line.startswith('PC = '):
         # Spud log
-        address_f = lambda s_line: s_line[5:9]
+        log_format = 'spud'
     elif s_line.startswith('PC:'):
         # SpecEmu log
-        address_f = lambda s_line: s_line[:4]
-        ignore_prefixes = ('PC:', 'IX:', 'HL:', 'DE:', 'BC:', 'AF:')
-        rewind = False
+        log_format = 'specemu'
     elif s_line.endswith('decimal'):
         # Zero log
         if s_line.endswith('in decimal'):
-            base = 10
-        address_f = lambda s_line: s_line[:s_line.find('\t')]
-        rewind = False
+            log_format = 'zero10'
+        else:
+            log_format = 'zero16'
     else:
         raise CodeMapError('{0}: Unrecognised format'.format(fname))
 
-    if rewind:
-        f.seek(0)
+    if log_format in ('fuse', 'spud'):
+        # Rewind
+        pos = 0
         i = 1
-
-    while 1:
-        line = f.readline()
-        if not line:
-            break
-        progress_msg = '{0}%'.format((100 * f.tell()) // size)
-        sys.stderr.write(progress_msg + chr(8) * len(progress_msg))
-        sys.stderr.flush()
+    elif lines:
+        # The header line was followed by more lines on the same line of the
+        # file (with only CR between them)
+        i = _read_lines(code_map, lines, i, log_format, fname, start, end)
+
+    chunks = []
+    chunk_size = max(min(LOG_CHUNK_SIZE, size // 100), 1)
+    while pos < size:
+        eol = data.find(b'\n', pos + chunk_size) + 1 or size
+        chunks.append((pos, eol))
+        pos = eol
+
+    parallel = size >= LOG_CHUNK_SIZE * LOG_PARALLEL_MIN_CHUNKS
+    progress = None
+    for (c_start, c_end), (addresses, num_lines) in zip(chunks, _scan_chunks(data, fname, log_format, chunks, workers, parallel)):
+        if addresses is None:
+            lines = _split_lines(data[c_start:c_end])
+            _read_lines(code_map, lines, i, log_format, fname, start, end)
+            num_lines = len(lines)
+        else:
+            for address in addresses:
+                if start <= address < end:
+                    code_map.add(address)
+        i += num_lines
+        percentage = (100 * c_end) // size
+        if percentage != progress:
+            progress = percentage
+            progress_msg = '{0}%'.format(percentage)
+            sys.stderr.write(progress_msg + chr(8) * len(progress_msg))
+            sys.stderr.flush()
+
+def _split_lines(data):
+    # Split lines the way a file opened in text mode would
+    return io.StringIO(data.decode('utf-8', 'replace'), None).readlines()
+
+def _scan_chunks(data, fname, log_format, chunks, workers, parallel):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and parallel and 'fork' in multiprocessing.get_all_start_methods():
+        try:
+            pool = multiprocessing.get_context('fork').Pool(workers)
+        except (NotImplementedError, OSError): # pragma: no cover
+            pass
+        else:
+            with pool:
+                args = [(fname, log_format, c_start, c_end) for c_start, c_end in chunks]
+                yield from pool.imap(_scan_file_chunk, args)
+            return
+    for c_start, c_end in chunks:
+        yield _scan_chunk(data[c_start:c_end], log_format)
+
+def _scan_file_chunk(args):
+    fname, log_format, c_start, c_end = args
+    with open(fname, 'rb') as f:
+        f.seek(c_start)
+        return _scan_chunk(f.read(c_end - c_start), log_format)
+
+def _scan_chunk(chunk, log_format):
+    # Return the set of addresses in a chunk of a code execution log, or None
+    # if the chunk must be read line by line
+    address_f, base, ignore_prefixes, address_re, invalid_re = _LOG_FORMATS[log_format]
+    num_lines = chunk.count(b'\n')
+    chunk = b'\n' + chunk
+    if chunk.count(b'\r') != chunk.count(b'\r\n') or invalid_re.search(chunk):
+        return None, num_lines
+    addresses = set()
+    for address_str in set(address_re.findall(chunk)):
+        address = int(address_str, base)
+        if address > 65535:
+            return None, num_lines
+        addresses.add(address)
+    return addresses, num_lines
+
+def _read_lines(code_map, lines, i, log_format, fname, start, end):
+    address_f, base, ignore_prefixes, address_re, invalid_re = _LOG_FORMATS[log_format]
+    for line in lines:
         s_line = line.strip()
         if s_line:
             address_str = address_f(s_line)
@@ -166,52 +306,158 @@ def _get_addresses(f, fname, size, start, end):
                     if address < 0 or address > 65535:
                         raise CodeMapError('{0}, line {1}: Address out of range: {2}'.format(fname, i, s_line))
                     if start <= address < end:
-                        addresses.add(address)
+                        code_map.add(address)
         i += 1
-
-    return sorted(addresses)
-
-def _is_terminal_instruction(instruction):
-    data = instruction.bytes
-    if data[0] == 201:
-        # RET
-        return True
-    if data[0] == 237 and data[1] in (69, 77, 85, 93, 101, 109, 117, 125):
-        # RETN/RETI
-        return True
-    if data[0] == 233:
-        # JP (HL)
-        return True
-    if len(data) == 2 and data[0] in (221, 253) and data[1] == 233:
-        # JP (IX)/JP (IY)
-        return True
-    if data[0] == 24 and data[1] > 0:
-        # JR d (d != 0)
-        return True
-    if data[0] == 195:
-        # JP nn
-        return True
-    return False
-
-def _find_terminal_instruction(disassembler, ctls, start, end=65536, ctl=None):
+    return i
+
+class ControlFlowGraph:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.disassembler = Disassembler(snapshot)
+        self._flows = {}
+
+    def flow(self, address):
+        flow = self._flows.get(address)
+        if flow is None:
+            flow = self._flows[address] = self.disassembler.flow(address)
+        return flow
+
+    def walk(self, start, end):
+        # Return the address of the last instruction in a block disassembled
+        # from start, and the address of the byte after it
+        address = last = start
+        while address < end:
+            last = address
+            address += self.flow(address)[0]
+        return last, address
+
+    def is_terminal(self, address):
+        length, kind, target = self.flow(address)
+        if kind == FLOW_JUMP:
+            # 'JR d' is terminal only if d != 0
+            return length == 3 or target != address + 2
+        return kind in (FLOW_RETURN, FLOW_INDIRECT)
+
+    def successors(self, start, end):
+        # Return the JP/JR/DJNZ/CALL/RST targets of the instructions in a block
+        targets = []
+        address = start
+        while address < end:
+            length, kind, target = self.flow(address)
+            if target is not None and kind in (FLOW_JUMP, FLOW_BRANCH, FLOW_CALL):
+                targets.append(target)
+            address += length
+        return targets
+
+    def jumps_to(self, start, end, target):
+        # Return whether any 'JP' or 'JR' instruction (but not 'DJNZ') in a
+        # block jumps to target
+        address = start
+        while address < end:
+            length, kind, j_target = self.flow(address)
+            if j_target == target and kind in (FLOW_JUMP, FLOW_BRANCH) and self.snapshot[address] != 16:
+                return True
+            address += length
+        return False
+
+    def overlaps(self, start, end):
+        return self.walk(start, end)[1] > end
+
+def _find_terminal_instruction(graph, ctls, start, end=65536, ctl=None):
     address = start
     while address < end:
-        instruction = disassembler.disassemble(address, address + 1)[0]
-        address = instruction.address + instruction.size()
+        i_address = address
+        address += graph.flow(address)[0]
         if ctl is None:
-            for a in range(instruction.address, address):
+            for a in range(i_address, address):
                 if a in ctls:
                     next_ctl = ctls[a]
                     del ctls[a]
             if ctls.get(address) == 'c':
                 break
-        if _is_terminal_instruction(instruction):
+        if graph.is_terminal(i_address):
             if address < 65536 and address not in ctls:
                 ctls[address] = ctl or next_ctl
             break
     return address
 
-def _generate_ctls_with_code_map(snapshot, start, end, code_map):
+def _join_blocks(ctls, join):
+    # Join each block to the next block if join(start, end) is true for it,
+    # and then re-examine only the blocks that were joined, until no more
+    # joins are made
+    addresses = sorted(ctls)
+    next_block = dict(zip(addresses, addresses[1:]))
+    prev_block = dict(zip(addresses[1:], addresses))
+    worklist = addresses[:-2]
+    while worklist:
+        joins = [(a, next_block[a]) for a in worklist if next_block[a] in next_block and join(a, next_block[a])]
+        groups = {}
+        for address, b_start in joins:
+            groups[b_start] = groups.get(address, address)
+        for address, b_start in joins:
+            del ctls[b_start]
+            b_end = next_block.pop(b_start)
+            b_prev = prev_block.pop(b_start)
+            next_block[b_prev] = b_end
+            prev_block[b_end] = b_prev
+        worklist = sorted({groups[b_start] for address, b_start in joins})
+
+def _mark_entry_points(graph, ctls):
+    # Build the control flow graph of the 'c' blocks and use a worklist to
+    # mark 'U' blocks that are CALLed or JPed to from a 'c' block as 'c'
+    # (which in turn may reveal new entry points)
+    addresses = sorted(ctls)
+    predecessors = {}
+    for ctl, b_start, b_end in _get_blocks(ctls):
+        if ctl == 'c':
+            for target in graph.successors(b_start, b_end):
+                predecessors.setdefault(target, set()).add(b_start)
+    worklist = [a for a in predecessors if ctls.get(a) == 'U']
+    heapq.heapify(worklist)
+    while worklist:
+        address = heapq.heappop(worklist)
+        if ctls.get(address) != 'U':
+            continue
+        ctls[address] = 'c'
+        e_end = addresses[bisect.bisect_right(addresses, address)]
+        u_start = _find_terminal_instruction(graph, ctls, address, e_end, 'U')
+        if ctls.get(u_start) == 'U':
+            index = bisect.bisect_left(addresses, u_start)
+            if addresses[index:index + 1] != [u_start]:
+                addresses.insert(index, u_start)
+            if u_start in predecessors:
+                heapq.heappush(worklist, u_start)
+        b_end = addresses[bisect.bisect_right(addresses, address)]
+        for target in graph.successors(address, b_end):
+            predecessors.setdefault(target, set()).add(address)
+            if ctls.get(target) == 'U':
+                heapq.heappush(worklist, target)
+
+def _extend_code_blocks(graph, ctls, end):
+    # Where a 'c' block doesn't end with a RET/JP/JR, extend it up to the next
+    # RET/JP/JR in the following blocks, or up to the next 'c' block
+    addresses = sorted(ctls)
+    i = 0
+    while i < len(addresses) - 1:
+        if ctls[addresses[i]] == 'c':
+            address = addresses[i]
+            while i < len(addresses) - 1:
+                b_end = addresses[i + 1]
+                while address < b_end:
+                    last = address
+                    address += graph.flow(address)[0]
+                if graph.is_terminal(last):
+                    break
+                next_address = _find_terminal_instruction(graph, ctls, b_end, end)
+                j = bisect.bisect_left(addresses, next_address, i + 1)
+                del addresses[i + 1:j]
+                if next_address in ctls and addresses[i + 1:i + 2] != [next_address]:
+                    addresses.insert(i + 1, next_address)
+                if next_address >= end:
+                    break
+        i += 1
+
+def _generate_ctls_with_code_map(snapshot, start, end, code_maps, executed):
     # (1) Use the code map to create an initial set of 'c' ctls, and mark all
     #     unexecuted blocks as 'U' (unknown)
     # (2) Where a 'c' block doesn't end with a RET/JP/JR, extend it up to the
@@ -228,88 +474,39 @@ def _generate_ctls_with_code_map(snapshot, start, end, code_map):
 
     # (1) Mark all executed blocks as 'c' and unexecuted blocks as 'U'
     # (unknown)
+    graph = ControlFlowGraph(snapshot)
     ctls = {start: 'U', end: 'i'}
-    for address, length in _get_code_blocks(snapshot, start, end, code_map):
+    for address, length in _get_code_blocks(graph.disassembler, start, end, code_maps, executed):
         ctls[address] = 'c'
         if address + length < end:
             ctls[address + length] = 'U'
 
     # (2) Where a 'c' block doesn't end with a RET/JP/JR, extend it up to the
     # next RET/JP/JR in the following 'U' blocks, or up to the next 'c' block
-    disassembler = Disassembler(snapshot)
-    while 1:
-        done = True
-        for ctl, b_start, b_end in _get_blocks(ctls):
-            if ctl == 'c':
-                if _is_terminal_instruction(disassembler.disassemble(b_start, b_end)[-1]):
-                    continue
-                if _find_terminal_instruction(disassembler, ctls, b_end, end) < end:
-                    done = False
-                    break
-        if done:
-            break
+    _extend_code_blocks(graph, ctls, end)
 
     # (3) Mark entry points in 'U' blocks that are CALLed or JPed to from 'c'
     # blocks with 'c'
-    ctl_parser = CtlParser(ctls)
-    disassembly = Disassembly(snapshot, ctl_parser)
-    while 1:
-        disassembly.build(True)
-        done = True
-        for entry in disassembly.entries:
-            if entry.ctl == 'U':
-                for instruction in entry.instructions:
-                    for referrer in instruction.referrers:
-                        if ctls[referrer.address] == 'c':
-                            ctls[instruction.address] = 'c'
-                            if entry.next:
-                                e_end = entry.next.address
-                            else:
-                                e_end = 65536
-                            _find_terminal_instruction(disassembler, ctls, instruction.address, e_end, entry.ctl)
-                            disassembly.remove_entry(entry.address)
-                            done = False
-                            break
-                    if not done:
-                        break
-                if not done:
-                    break
-        if done:
-            break
+    _mark_entry_points(graph, ctls)
 
     # (4) Split 'c' blocks on RET/JP/JR
     for ctl, b_address, b_end in _get_blocks(ctls):
         if ctl == 'c':
-            next_address = _find_terminal_instruction(disassembler, ctls, b_address, b_end, 'c')
-            if next_address < b_end:
-                disassembly.remove_entry(b_address)
-                while next_address < b_end:
-                    next_address = _find_terminal_instruction(disassembler, ctls, next_address, b_end, 'c')
+            next_address = _find_terminal_instruction(graph, ctls, b_address, b_end, 'c')
+            while next_address < b_end:
+                next_address = _find_terminal_instruction(graph, ctls, next_address, b_end, 'c')
 
     # (5) Scan the disassembly for pairs of adjacent blocks where the start
     # address of the second block is JRed or JPed to from the first block, and
     # join such pairs
-    while 1:
-        disassembly.build()
-        done = True
-        for entry in disassembly.entries[:-1]:
-            if entry.ctl == 'c':
-                for instruction in entry.instructions:
-                    operation = instruction.operation
-                    if operation[:2] in ('JR', 'JP') and operation[-5:] == str(entry.next.address):
-                        del ctls[entry.next.address]
-                        disassembly.remove_entry(entry.address)
-                        disassembly.remove_entry(entry.next.address)
-                        done = False
-                        break
-        if done:
-            break
+    _join_blocks(ctls, lambda b_start, b_end: ctls[b_start] == 'c' and graph.jumps_to(b_start, b_end, b_end))
 
     # (6) Examine the 'U' blocks for text/data
+    analyser = BlockAnalyser(snapshot)
     for ctl, b_start, b_end in _get_blocks(ctls):
         if ctl == 'U':
             ctls[b_start] = 'b'
-            for t_start, t_end in _get_text_blocks(snapshot, b_start, b_end):
+            for t_start, t_end in analyser.get_text_blocks(b_start, b_end):
                 ctls[t_start] = 't'
                 if t_end < b_end:
                     ctls[t_end] = 'b'
@@ -342,70 +539,41 @@ def _generate_ctls_without_code_map(snapshot, start, end):
         elif b == 24 and address < end - 2:
             ctls[address + 2] = 'c'
 
-    ctl_parser = CtlParser(ctls)
-    disassembly = Disassembly(snapshot, ctl_parser)
+    graph = ControlFlowGraph(snapshot)
 
     # Scan the disassembly for pairs of adjacent blocks that overlap, and join
     # such pairs
-    while True:
-        done = True
-        for entry in disassembly.entries[:-1]:
-            if entry.bad_blocks:
-                del ctls[entry.next.address]
-                disassembly.remove_entry(entry.address)
-                disassembly.remove_entry(entry.next.address)
-                done = False
-        if done:
-            break
-        disassembly.build()
+    _join_blocks(ctls, graph.overlaps)
 
     # Scan the disassembly for blocks that don't end in a 'RET', 'JP nn' or
     # 'JR d' instruction, and join them to the next block
-    changed = False
-    for entry in disassembly.entries[:-1]:
-        last_instr = entry.instructions[-1].operation
-        if last_instr != 'RET' and not (last_instr[:2] in ('JP', 'JR') and last_instr[3:].isdigit()):
-            next_address = entry.next.address
-            if next_address < end:
-                del ctls[entry.next.address]
-                disassembly.remove_entry(entry.address)
-                disassembly.remove_entry(entry.next.address)
-                changed = True
-    if changed:
-        disassembly.build()
+    blocks = _get_blocks(ctls)
+    for ctl, b_start, b_end in blocks[:-1]:
+        last = graph.walk(b_start, b_end)[0]
+        length, kind, target = graph.flow(last)
+        if not ((kind == FLOW_RETURN and length == 1) or (kind == FLOW_JUMP and target is not None)):
+            if b_end < end:
+                del ctls[b_end]
 
     # Scan the disassembly for pairs of adjacent blocks where the start address
     # of the second block is JRed or JPed to from the first block, and join
     # such pairs
-    while True:
-        done = True
-        for entry in disassembly.entries[:-1]:
-            for instruction in entry.instructions:
-                operation = instruction.operation
-                if operation[:2] in ('JR', 'JP') and operation[-5:] == str(entry.next.address):
-                    del ctls[entry.next.address]
-                    disassembly.remove_entry(entry.address)
-                    disassembly.remove_entry(entry.next.address)
-                    done = False
-                    break
-        if done:
-            break
-        disassembly.build()
+    _join_blocks(ctls, lambda b_start, b_end: graph.jumps_to(b_start, b_end, b_end))
 
     # Mark any NOP sequences at the beginning of a block as a separate zero
     # block
-    for entry in disassembly.entries:
-        if entry.instructions[0].operation != 'NOP':
+    for ctl, b_start, b_end in _get_blocks(ctls):
+        if snapshot[b_start]:
             continue
-        for instruction in entry.instructions[1:]:
-            if instruction.operation != 'NOP':
-                break
-        ctls[entry.address] = 's'
-        if entry.instructions[-1].operation != 'NOP':
-            ctls[instruction.address] = 'c'
+        z_end = b_start
+        while z_end < b_end and snapshot[z_end] == 0:
+            z_end += 1
+        ctls[b_start] = 's'
+        if snapshot[graph.walk(b_start, b_end)[0]]:
+            ctls[z_end] = 'c'
 
     # See which blocks marked as code look like text or data
-    _analyse_blocks(disassembly, ctls)
+    _analyse_blocks(graph, ctls)
 
     return ctls
 
@@ -416,62 +584,70 @@ def write_ctl(ctlfile, ctls, ctl_hex):
         for address in [a for a in sorted(ctls) if a < 65536]:
             f.write('{0} {1}\n'.format(ctls[address], addr_fmt.format(address)))
 
-def _check_for_data(snapshot, start, end):
-    size = end - start
-    if size > 3:
-        count = 1
-        prev_b = snapshot[start]
-        for a in range(start + 1, end):
-            b = snapshot[a]
-            if b == prev_b:
-                count += 1
-                if count > 3:
+class BlockAnalyser:
+    def __init__(self, snapshot):
+        self.data = bytes(snapshot)
+        self._text_blocks = {}
+        self._data = {}
+
+        # Find every maximal run of text characters, and every run of four or
+        # more identical bytes, in one pass over the memory
+        classes = self.data.translate(_TEXT_CLASSES)
+        self._text_runs = [m.span() for m in _TEXT_RUN_RE.finditer(classes)]
+        self._text_starts = [r[0] for r in self._text_runs]
+        self._repeats = [m.span() for m in _REPEAT_RE.finditer(self.data)]
+        self._repeat_starts = [r[0] for r in self._repeats]
+
+    def get_text_blocks(self, start, end):
+        key = (start, end)
+        if key not in self._text_blocks:
+            self._text_blocks[key] = self._find_text_blocks(start, end)
+        return self._text_blocks[key]
+
+    def is_data(self, start, end):
+        key = (start, end)
+        if key not in self._data:
+            self._data[key] = self._check_for_data(start, end)
+        return self._data[key]
+
+    def _find_text_blocks(self, start, end):
+        t_blocks = []
+        if end - start >= MIN_LENGTH:
+            data = self.data
+            i = max(bisect.bisect_right(self._text_starts, start) - 1, 0)
+            for r_start, r_end in self._text_runs[i:]:
+                if r_start >= end:
+                    break
+                t_start = max(r_start, start)
+                t_end = min(r_end, end)
+                if t_start and t_start < t_end:
+                    chars = data[t_start:t_end]
+                    punc = chars.count(b',') + chars.count(b'.')
+                    letters = set(chars).difference(_PUNC_BYTES)
+                    _check_text(t_blocks, t_start, t_end, letters, punc)
+        return tuple(tuple(b) for b in t_blocks)
+
+    def _check_for_data(self, start, end):
+        size = end - start
+        if size > 3:
+            i = max(bisect.bisect_right(self._repeat_starts, start) - 1, 0)
+            for r_start, r_end in self._repeats[i:]:
+                if r_start + 3 >= end:
+                    break
+                if min(r_end, end) - max(r_start, start) > 3:
                     return True
-            else:
-                count = 1
-                prev_b = b
-    if size > 9:
-        d = len(set(snapshot[start:end]))
-        return d < size * UNIQUE_BYTES_MAX
+        if size > 9:
+            return len(set(self.data[start:end])) < size * UNIQUE_BYTES_MAX
+        return False
 
 def _check_text(t_blocks, t_start, t_end, letters, punc):
     length = t_end - t_start
-    if length >= MIN_LENGTH and len(set(letters)) >= length * UNIQUE_CHARS_MIN and len(punc) <= length * PUNC_CHARS_MAX:
-        t_block = [t_start, t_end]
-        if t_blocks:
-            prev_t_block = t_blocks[-1]
-            if prev_t_block[1] + TEXT_GAP_MAX >= t_start:
-                # If the previous t-block is close to this one, merge them
-                prev_t_block[1] = t_end
-            else:
-                t_blocks.append(t_block)
+    if length >= MIN_LENGTH and len(letters) >= length * UNIQUE_CHARS_MIN and punc <= length * PUNC_CHARS_MAX:
+        if t_blocks and t_blocks[-1][1] + TEXT_GAP_MAX >= t_start:
+            # If the previous t-block is close to this one, merge them
+            t_blocks[-1][1] = t_end
         else:
-            t_blocks.append(t_block)
-
-def _get_text_blocks(snapshot, start, end):
-    t_blocks = []
-    if end - start >= MIN_LENGTH:
-        letters = []
-        punc = []
-        t_start = None
-        for address in range(start, end):
-            char = chr(snapshot[address])
-            if char in CHARS:
-                if char in PUNC_CHARS:
-                    punc.append(char)
-                else:
-                    letters.append(char)
-                if t_start is None:
-                    t_start = address
-            else:
-                if t_start:
-                    _check_text(t_blocks, t_start, address, letters, punc)
-                letters[:] = []
-                punc[:] = []
-                t_start = None
-        if t_start:
-            _check_text(t_blocks, t_start, end, letters, punc)
-    return t_blocks
+            t_blocks.append([t_start, t_end])
 
 def _get_blocks(ctls):
     # Determine the block start and end addresses
@@ -481,24 +657,23 @@ def _get_blocks(ctls):
     blocks.pop()
     return blocks
 
-def _analyse_blocks(disassembly, ctls):
-    snapshot = disassembly.disassembler.snapshot
+def _analyse_blocks(graph, ctls):
+    snapshot = graph.snapshot
+    analyser = BlockAnalyser(snapshot)
 
     # See which blocks marked as code look like text or data
     while 1:
         done = True
         for ctl, start, end in _get_blocks(ctls):
             if ctl == 'c':
-                text_blocks = _get_text_blocks(snapshot, start, end)
+                text_blocks = analyser.get_text_blocks(start, end)
                 if text_blocks:
                     for t_start, t_end in text_blocks:
                         ctls[t_start] = 't'
                         ctls[t_end] = 'c'
-                    disassembly.remove_entry(start)
                     done = False
-                elif _check_for_data(snapshot, start, end):
+                elif analyser.is_data(start, end):
                     ctls[start] = 'b'
-                    disassembly.remove_entry(start)
                 else:
                     # This block is unidentified (it doesn't look like text or
                     # data); mark it with an 'X' so that we don't examine it
@@ -515,10 +690,11 @@ def _analyse_blocks(disassembly, ctls):
     # Scan the disassembly for pairs of adjacent blocks that overlap, and mark
     # the first block in each pair as data; also mark code blocks that have no
     # terminal instruction as data
-    disassembly.build()
-    for entry in disassembly.entries:
-        if entry.bad_blocks or (ctls[entry.address] == 'c' and not _is_terminal_instruction(entry.instructions[-1])):
-            ctls[entry.address] = 'b'
+    for ctl, start, end in _get_blocks(ctls):
+        if ctl == 'c':
+            last, next_address = graph.walk(start, end)
+            if next_address > end or not graph.is_terminal(last):
+                ctls[start] = 'b'
 
     # Mark any NOP sequences at the beginning of a code block as a separate
     # zero block
@@ -532,9 +708,9 @@ def _analyse_blocks(disassembly, ctls):
                 if z_end < end:
                     ctls[z_end] = 'c'
 
-def generate_ctls(snapshot, start, end, code_map):
-    if code_map:
-        ctls = _generate_ctls_with_code_map(snapshot, start, end, code_map)
+def generate_ctls(snapshot, start, end, code_maps, executed=None):
+    if code_maps or executed:
+        ctls = _generate_ctls_with_code_map(snapshot, start, end, code_maps, executed)
     else:
         ctls = _generate_ctls_without_code_map(snapshot, start, end)
 
@@ -593,7 +769,7 @@ class Disassembly:
                 self.address_fmt = '{0:04X}'
         else:
             self.address_fmt = '{0}'
-        self.entry_map = {}
+        self.flows = {}
         self.config = config or {}
         self.build(final)
 
@@ -610,12 +786,6 @@ class Disassembly:
 
     def _create_entries(self):
         for block in self.ctl_parser.get_blocks():
-            if block.start in self.entry_map:
-                entry = self.entry_map[block.start]
-                self.entries.append(entry)
-                for instruction in entry.instructions:
-                    self.instructions[instruction.address] = instruction
-                continue
             title = block.title
             if not title:
                 ctl = block.ctl
@@ -627,6 +797,8 @@ class Disassembly:
                 if sub_block.ctl in 'cBT':
                     base = sub_block.sublengths[0][1]
                     instructions = self.disassembler.disassemble(sub_block.start, sub_block.end, base)
+                    for instruction in instructions:
+                        self.flows[instruction.address] = self.disassembler.flow(instruction.address)
                 elif sub_block.ctl in 'bgstuw':
                     sublengths = sub_block.sublengths
                     if sublengths[0][0]:
@@ -672,15 +844,10 @@ class Disassembly:
             entry = Entry(title, block.description, block.ctl, sub_blocks,
                           block.registers, block.end_comment, block.asm_directives,
                           block.ignoreua_directives)
-            self.entry_map[entry.address] = entry
             self.entries.append(entry)
         for i, entry in enumerate(self.entries[1:]):
             self.entries[i].next = entry
 
-    def remove_entry(self, address):
-        if address in self.entry_map:
-            del self.entry_map[address]
-
     def contains_entry_asm_directive(self, asm_dir):
         for entry in self.entries:
             for directive in entry.asm_directives:
@@ -693,13 +860,11 @@ class Disassembly:
                 instruction.referrers = []
         for entry in self.entries:
             for instruction in entry.instructions:
-                operation = instruction.operation
-                if operation.upper().startswith(('DJ', 'JR', 'JP', 'CA', 'RS')):
-                    addr_str = get_address(operation)
-                    if addr_str:
-                        callee = self.instructions.get(parse_int(addr_str))
-                        if callee:
-                            callee.add_referrer(entry)
+                flow = self.flows.get(instruction.address)
+                if flow and flow[2] is not None and flow[1] in (FLOW_JUMP, FLOW_BRANCH, FLOW_CALL):
+                    callee = self.instructions.get(flow[2])
+                    if callee:
+                        callee.add_referrer(entry)
 
     def _address_str(self, address):
         return self.address_fmt.format(address)
@@ -220,6 +220,8 @@ man_pages = [
      'convert a binary file into a Z80 snapshot', _authors, 1),
     ('man/bin2tap.py', 'bin2tap.py',
      'convert a binary file or snapshot into a TAP file', _authors, 1),
+    ('man/skool2all.py', 'skool2all.py',
+     'convert a skool file into ASM, binary, control, HTML and skool file template files', _authors, 1),
     ('man/skool2asm.py', 'skool2asm.py',
      'convert a skool file to ASM format', _authors, 1),
     ('man/skool2bin.py', 'skool2bin.py',
@@ -10,9 +10,9 @@ from unittest import TestCase
 
 SKOOLKIT_HOME = abspath(dirname(dirname(__file__)))
 sys.path.insert(0, SKOOLKIT_HOME)
-from skoolkit import (bin2sna, bin2tap, sna2img, skool2asm, skool2bin,
-                      skool2ctl, skool2html, skool2sft, sna2skool, snapinfo,
-                      snapmod, tap2sna, tapinfo)
+from skoolkit import (bin2sna, bin2tap, sna2img, skool2all, skool2asm,
+                      skool2bin, skool2ctl, skool2html, skool2sft, sna2skool,
+                      snapinfo, snapmod, tap2sna, tapinfo)
 
 Z80_REGISTERS = {
     'a': 0, 'f': 1, 'bc': 2, 'c': 2, 'b': 3, 'hl': 4, 'l': 4, 'h': 5,
@@ -350,6 +350,9 @@ class SkoolKitTestCase(TestCase):
     def run_sna2img(self, args='', out_lines=True, err_lines=False, strip_cr=True, catch_exit=None):
         return self._run_skoolkit_command(sna2img.main, args, out_lines, err_lines, strip_cr, catch_exit)
 
+    def run_skool2all(self, args='', out_lines=True, err_lines=False, strip_cr=True, catch_exit=None):
+        return self._run_skoolkit_command(skool2all.main, args, out_lines, err_lines, strip_cr, catch_exit)
+
     def run_skool2asm(self, args='', out_lines=True, err_lines=False, strip_cr=True, catch_exit=None):
         return self._run_skoolkit_command(skool2asm.main, args, out_lines, err_lines, strip_cr, catch_exit)
 
@@ -674,6 +674,38 @@ class CtlParserTest(SkoolKitTestCase):
         }
         self._check_instruction_asm_directives(exp_instruction_asm_directives, blocks)
 
+    def test_get_blocks_twice(self):
+        ctl = '\n'.join((
+            '@ 30000 start',
+            '@ 30000 label=START',
+            'c 30000 Routine at 30000',
+            '@ 30001 label=NEXT',
+            '@ 30001 ignoreua:i',
+            '  30001 Next instruction',
+            'c 30002 Routine at 30002',
+            'i 30003'
+        ))
+        ctl_parser = self._get_ctl_parser(ctl)
+        for i in range(2):
+            blocks = ctl_parser.get_blocks()
+            self._check_entry_asm_directives({30000: ['start'], 30002: [], 30003: []}, blocks)
+            exp_instruction_asm_directives = {
+                30000: ['label=START'],
+                30001: ['label=NEXT']
+            }
+            self._check_instruction_asm_directives(exp_instruction_asm_directives, blocks)
+            self._check_ignoreua_directives({30000: [], 30002: [], 30003: []}, {30001: ['i']}, blocks)
+
+    def test_get_blocks_with_many_sub_blocks(self):
+        ctl = ['b 40000']
+        ctl.extend('  {},2'.format(a) for a in range(40000, 41000, 2))
+        ctl.append('c 41000')
+        ctl.append('i 41001')
+        blocks = self._get_ctl_parser('\n'.join(ctl)).get_blocks()
+        self.assertEqual([40000, 41000, 41001], [b.start for b in blocks])
+        self.assertEqual(list(range(40000, 41000, 2)), [s.start for s in blocks[0].blocks])
+        self.assertEqual(list(range(40002, 41001, 2)), [s.end for s in blocks[0].blocks])
+
     def test_parse_ctl_with_min_and_max_addresses(self):
         ctl_parser = self._get_ctl_parser(CTL, 30100, 30300)
         blocks = ctl_parser.get_blocks()
@@ -1713,6 +1745,25 @@ class CtlParserTest(SkoolKitTestCase):
         }
         self._check_end_comments(exp_end_comments, blocks)
 
+    def test_nested_loops(self):
+        ctl = '\n'.join((
+            'b 30000',
+            'B 30000,1 Byte',
+            'T 30001,1 Char',
+            'L 30000,2,2',
+            'L 30000,4,3',
+            'i 30012'
+        ))
+        blocks = self._get_ctl_parser(ctl).get_blocks()
+
+        exp_subctls = {a: 'b' if a % 2 == 0 else 't' for a in range(30000, 30012)}
+        exp_subctls[30012] = 'i'
+        self._check_subctls(exp_subctls, blocks)
+
+        exp_instruction_comments = {a: 'Byte' if a % 2 == 0 else 'Char' for a in range(30000, 30012)}
+        exp_instruction_comments[30012] = ''
+        self._check_instruction_comments(exp_instruction_comments, blocks)
+
     def test_terminate_multiline_comments(self):
         ctl = '\n'.join((
             'c 30000',
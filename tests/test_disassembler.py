@@ -1,7 +1,8 @@
 import unittest
 
 from skoolkittest import SkoolKitTestCase
-from skoolkit.disassembler import Disassembler
+from skoolkit.disassembler import (Disassembler, decode_flow, FLOW_NONE, FLOW_JUMP, FLOW_BRANCH,
+                                   FLOW_CALL, FLOW_RETURN, FLOW_COND_RETURN, FLOW_INDIRECT)
 
 ASM = {
     '000000': ('NOP', 'NOP', 'NOP'),
@@ -2006,6 +2007,85 @@ class DisassemblerTest(SkoolKitTestCase):
         self.assertEqual(defw.operation, 'DEFW 1,257,514,65283')
         self.assertEqual(defw.bytes, data)
 
+    def test_decode_cache_is_invalidated_when_bytes_change(self):
+        snapshot = [62, 1, 201]
+        disassembler = self._get_disassembler(snapshot)
+        self.assertEqual(disassembler.disassemble(0, 1)[0].operation, 'LD A,1')
+        snapshot[1] = 2
+        self.assertEqual(disassembler.disassemble(0, 1)[0].operation, 'LD A,2')
+        snapshot[0] = 201
+        instructions = disassembler.disassemble(0, 1)
+        self.assertEqual(instructions[0].operation, 'RET')
+        self.assertEqual(instructions[0].bytes, [201])
+
+    def test_decode_cache_is_cleared_when_snapshot_is_replaced(self):
+        disassembler = self._get_disassembler([62, 1])
+        self.assertEqual(disassembler.disassemble(0, 1)[0].operation, 'LD A,1')
+        disassembler.snapshot = [6, 1]
+        self.assertEqual(disassembler.disassemble(0, 1)[0].operation, 'LD B,1')
+
+    def test_decode_cache_returns_distinct_instructions(self):
+        disassembler = self._get_disassembler([201])
+        instruction1 = disassembler.disassemble(0, 1)[0]
+        instruction1.ctl = '*'
+        instruction2 = disassembler.disassemble(0, 1)[0]
+        self.assertIsNot(instruction1, instruction2)
+        self.assertIsNone(instruction2.ctl)
+        self.assertEqual(instruction2.operation, 'RET')
+
+    def test_decode_cache_is_keyed_by_base(self):
+        disassembler = self._get_disassembler([62, 10])
+        self.assertEqual(disassembler.disassemble(0, 2, 'd')[0].operation, 'LD A,10')
+        self.assertEqual(disassembler.disassemble(0, 2, 'h')[0].operation, 'LD A,$0A')
+
+    def test_flow_lengths_match_instruction_sizes(self):
+        for hex_bytes in ASM:
+            data = [int(hex_bytes[i:i + 2], 16) for i in range(0, len(hex_bytes), 2)]
+            snapshot = self._get_snapshot(32768, data)
+            disassembler = self._get_disassembler(snapshot)
+            size = disassembler.disassemble(32768, 32769)[0].size()
+            self.assertEqual(disassembler.flow(32768)[0], size, hex_bytes)
+
+    def test_flow(self):
+        flows = (
+            ((0,), (1, FLOW_NONE, None)),
+            ((1, 0, 128), (3, FLOW_NONE, None)),
+            ((16, 254), (2, FLOW_BRANCH, 40000)),
+            ((24, 0), (2, FLOW_JUMP, 40002)),
+            ((24, 128), (2, FLOW_JUMP, 39874)),
+            ((32, 127), (2, FLOW_BRANCH, 40129)),
+            ((195, 1, 2), (3, FLOW_JUMP, 513)),
+            ((202, 1, 2), (3, FLOW_BRANCH, 513)),
+            ((205, 1, 2), (3, FLOW_CALL, 513)),
+            ((212, 1, 2), (3, FLOW_CALL, 513)),
+            ((239,), (1, FLOW_CALL, 40)),
+            ((201,), (1, FLOW_RETURN, None)),
+            ((248,), (1, FLOW_COND_RETURN, None)),
+            ((237, 69), (2, FLOW_RETURN, None)),
+            ((237, 77), (2, FLOW_RETURN, None)),
+            ((237, 125), (2, FLOW_RETURN, None)),
+            ((237, 99, 0, 0), (4, FLOW_NONE, None)),
+            ((233,), (1, FLOW_INDIRECT, None)),
+            ((221, 233), (2, FLOW_INDIRECT, None)),
+            ((253, 233), (2, FLOW_INDIRECT, None)),
+            ((221, 203, 1, 6), (4, FLOW_NONE, None)),
+            ((221, 195, 0, 0), (1, FLOW_NONE, None)),
+            ((203, 195), (2, FLOW_NONE, None)),
+        )
+        for data, exp_flow in flows:
+            self.assertEqual(decode_flow(data, 40000), exp_flow, data)
+
+    def test_flow_relative_jump_out_of_range(self):
+        self.assertEqual(decode_flow((24, 126), 65500), (2, FLOW_JUMP, None))
+        self.assertEqual(decode_flow((56, 128), 10), (2, FLOW_BRANCH, None))
+
+    def test_flow_at_end_of_memory(self):
+        snapshot = [0] * 65536
+        snapshot[65534:] = [195, 0]
+        disassembler = self._get_disassembler(snapshot)
+        self.assertEqual(disassembler.flow(65534), (2, FLOW_JUMP, None))
+        self.assertEqual(disassembler.flow(65535), (1, FLOW_NONE, None))
+
     def test_num_str(self):
         disassembler = self._get_disassembler(asm_hex=False)
         self.assertEqual(disassembler.num_str(123), '123')
@@ -0,0 +1,243 @@
+import unittest
+
+from skoolkittest import SkoolKitTestCase
+from skoolkit.simulator import Simulator, FRAME_DURATION
+
+class SimulatorTest(SkoolKitTestCase):
+    def _run(self, code, registers=None, start=32768, steps=1, memory=None):
+        if memory is None:
+            memory = [0] * 65536
+        memory[start:start + len(code)] = code
+        simulator = Simulator(memory, registers)
+        simulator.set_registers({'pc': start})
+        count = [steps + 1]
+        def until(s):
+            count[0] -= 1
+            return count[0] == 0
+        simulator.run(until=until)
+        return simulator
+
+    def _test_instruction(self, code, registers, exp_registers, exp_tstates, exp_pc=None, memory=None):
+        simulator = self._run(code, registers, memory=memory)
+        for reg, value in exp_registers.items():
+            self.assertEqual(simulator.get_register(reg), value, "Register '{}'".format(reg))
+        if exp_pc is None:
+            exp_pc = 32768 + len(code)
+        self.assertEqual(simulator.get_register('pc'), exp_pc)
+        self.assertEqual(simulator.get_register('t'), exp_tstates)
+        return simulator
+
+    def test_default_registers(self):
+        simulator = Simulator([0] * 65536)
+        self.assertEqual(simulator.get_register('pc'), 0)
+        self.assertEqual(simulator.get_register('sp'), 65535)
+        self.assertEqual(simulator.get_register('t'), 0)
+        self.assertEqual(simulator.get_register('iff'), 0)
+
+    def test_set_registers(self):
+        registers = {
+            'a': 1, 'f': 2, 'bc': 772, 'de': 1286, 'hl': 1800, 'ix': 2314, 'iy': 2828,
+            'sp': 3342, 'pc': 3856, 'i': 17, 'r': 146, '^a': 19, '^f': 20,
+            '^bc': 5398, '^de': 5912, '^hl': 6426, 'iff': 1, 'im': 2
+        }
+        simulator = Simulator([0] * 65536, registers)
+        for reg, value in registers.items():
+            self.assertEqual(simulator.get_register(reg), value)
+
+    def test_set_unknown_register(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown register: xy'):
+            Simulator([0] * 65536, {'xy': 0})
+
+    def test_ld_r_n(self):
+        self._test_instruction((62, 17), {}, {'a': 17}, 7)
+
+    def test_ld_rr_nn(self):
+        self._test_instruction((33, 52, 18), {}, {'hl': 4660}, 10)
+
+    def test_ld_ix_nn(self):
+        self._test_instruction((221, 33, 120, 86), {}, {'ix': 22136}, 14)
+
+    def test_ld_ixd_n(self):
+        simulator = self._test_instruction((253, 54, 254, 99), {'iy': 40000}, {}, 19)
+        self.assertEqual(simulator.memory[39998], 99)
+
+    def test_ld_a_nn(self):
+        memory = [0] * 65536
+        memory[40000] = 171
+        self._test_instruction((58, 64, 156), {}, {'a': 171}, 13, memory=memory)
+
+    def test_push_pop(self):
+        simulator = self._run((197, 209), {'bc': 4660, 'sp': 40000}, steps=2)
+        self.assertEqual(simulator.get_register('de'), 4660)
+        self.assertEqual(simulator.get_register('sp'), 40000)
+        self.assertEqual(simulator.memory[39998:40000], [52, 18])
+        self.assertEqual(simulator.get_register('t'), 21)
+
+    def test_ex_af_af(self):
+        self._test_instruction((8,), {'a': 1, 'f': 2, '^a': 3, '^f': 4}, {'a': 3, 'f': 4, '^a': 1, '^f': 2}, 4)
+
+    def test_exx(self):
+        registers = {'bc': 1, 'de': 2, 'hl': 3, '^bc': 4, '^de': 5, '^hl': 6, 'ix': 7}
+        exp_registers = {'bc': 4, 'de': 5, 'hl': 6, '^bc': 1, '^de': 2, '^hl': 3, 'ix': 7}
+        self._test_instruction((217,), registers, exp_registers, 4)
+
+    def test_add_a_n(self):
+        self._test_instruction((198, 1), {'a': 127}, {'a': 128, 'f': 148}, 7)
+        self._test_instruction((198, 1), {'a': 255}, {'a': 0, 'f': 81}, 7)
+
+    def test_sub_n(self):
+        self._test_instruction((214, 1), {'a': 0}, {'a': 255, 'f': 187}, 7)
+
+    def test_cp_r_sets_bits_3_and_5_from_operand(self):
+        self._test_instruction((184,), {'a': 0, 'b': 40}, {'a': 0, 'f': 187}, 4)
+
+    def test_and_or_xor(self):
+        self._test_instruction((230, 15), {'a': 60}, {'a': 12, 'f': 28}, 7)
+        self._test_instruction((246, 15), {'a': 48}, {'a': 63, 'f': 44}, 7)
+        self._test_instruction((175,), {'a': 123}, {'a': 0, 'f': 68}, 4)
+
+    def test_inc_dec_r_preserve_carry(self):
+        self._test_instruction((60,), {'a': 127, 'f': 1}, {'a': 128, 'f': 149}, 4)
+        self._test_instruction((5,), {'b': 1, 'f': 1}, {'b': 0, 'f': 67}, 4)
+
+    def test_daa(self):
+        self._test_instruction((39,), {'a': 154, 'f': 0}, {'a': 0, 'f': 85}, 4)
+
+    def test_add_hl_rr(self):
+        self._test_instruction((9,), {'hl': 65535, 'bc': 1}, {'hl': 0, 'f': 17}, 11)
+
+    def test_sbc_hl_rr(self):
+        self._test_instruction((237, 82), {'hl': 0, 'de': 1, 'f': 0}, {'hl': 65535, 'f': 187}, 15)
+
+    def test_rlca(self):
+        self._test_instruction((7,), {'a': 129, 'f': 0}, {'a': 3, 'f': 1}, 4)
+
+    def test_rl_ixd(self):
+        memory = [0] * 65536
+        memory[40001] = 128
+        simulator = self._test_instruction((221, 203, 1, 22), {'ix': 40000}, {'f': 69}, 23, memory=memory)
+        self.assertEqual(simulator.memory[40001], 0)
+
+    def test_bit_set_res(self):
+        self._test_instruction((203, 71), {'a': 0, 'f': 1}, {'f': 85}, 8)
+        self._test_instruction((203, 255), {'a': 0}, {'a': 128}, 8)
+        self._test_instruction((203, 135), {'a': 255}, {'a': 254}, 8)
+
+    def test_jr(self):
+        self._test_instruction((24, 254), {}, {}, 12, 32768)
+
+    def test_jr_nz_not_taken(self):
+        self._test_instruction((32, 16), {'f': 64}, {}, 7)
+
+    def test_djnz(self):
+        simulator = self._run((16, 254), {'b': 3}, steps=3)
+        self.assertEqual(simulator.get_register('b'), 0)
+        self.assertEqual(simulator.get_register('pc'), 32770)
+        self.assertEqual(simulator.get_register('t'), 34)
+
+    def test_call_ret(self):
+        memory = [0] * 65536
+        memory[40000] = 201 # RET
+        simulator = self._run((205, 64, 156), {'sp': 50000}, steps=2, memory=memory)
+        self.assertEqual(simulator.get_register('pc'), 32771)
+        self.assertEqual(simulator.get_register('sp'), 50000)
+        self.assertEqual(simulator.get_register('t'), 27)
+
+    def test_ret_nc_not_taken(self):
+        self._test_instruction((208,), {'f': 1, 'sp': 50000}, {'sp': 50000}, 5)
+
+    def test_rst(self):
+        self._test_instruction((239,), {'sp': 50000}, {'sp': 49998}, 11, 40)
+
+    def test_jp_hl(self):
+        self._test_instruction((233,), {'hl': 40000}, {}, 4, 40000)
+
+    def test_ldir(self):
+        memory = [0] * 65536
+        memory[40000:40003] = (1, 2, 3)
+        simulator = self._run((237, 176), {'hl': 40000, 'de': 50000, 'bc': 3}, memory=memory, steps=3)
+        self.assertEqual(simulator.memory[50000:50003], [1, 2, 3])
+        self.assertEqual(simulator.get_register('bc'), 0)
+        self.assertEqual(simulator.get_register('pc'), 32770)
+        self.assertEqual(simulator.get_register('t'), 58)
+
+    def test_in_a_n_reads_255(self):
+        self._test_instruction((219, 254), {'a': 0}, {'a': 255}, 11)
+
+    def test_r_register(self):
+        self._test_instruction((0,), {'r': 255}, {'r': 128}, 4)
+
+    def test_run_until_stop_address(self):
+        simulator = Simulator([0] * 65536)
+        executed = simulator.run(start=100, stop=105)
+        self.assertEqual(simulator.get_register('pc'), 105)
+        self.assertEqual(simulator.get_register('t'), 20)
+        self.assertEqual([a for a in range(65536) if executed[a]], [100, 101, 102, 103, 104])
+
+    def test_run_for_max_tstates(self):
+        memory = [0] * 65536
+        memory[32768:32771] = (195, 0, 128) # JP 32768
+        simulator = Simulator(memory, {'pc': 32768})
+        simulator.run(max_tstates=100)
+        self.assertEqual(simulator.get_register('t'), 100)
+        simulator.run(max_tstates=5)
+        self.assertEqual(simulator.get_register('t'), 110)
+
+    def test_run_until_condition(self):
+        memory = [0] * 65536
+        memory[32768:32772] = (60, 195, 0, 128) # INC A; JP 32768
+        simulator = Simulator(memory, {'pc': 32768})
+        simulator.run(until=lambda s: s.get_register('a') == 3)
+        self.assertEqual(simulator.get_register('a'), 3)
+        self.assertEqual(simulator.get_register('pc'), 32769)
+
+    def test_run_records_executed_addresses(self):
+        memory = [0] * 65536
+        memory[32768:32779] = (
+            243,           # 32768 DI
+            24, 3,         # 32769 JR 32774
+            0, 0, 0,       # 32771 NOP (x3)
+            205, 10, 128,  # 32774 CALL 32778
+            118,           # 32777 HALT
+            201,           # 32778 RET
+        )
+        executed = bytearray(65536)
+        Simulator(memory, {'pc': 32768, 'sp': 40000}).run(executed=executed)
+        self.assertEqual([a for a in range(65536) if executed[a]], [32768, 32769, 32774, 32777, 32778])
+
+    def test_halt_with_interrupts_disabled_stops(self):
+        memory = [0] * 65536
+        memory[32768:32770] = (243, 118) # DI; HALT
+        simulator = Simulator(memory, {'pc': 32768})
+        simulator.run(max_tstates=2 * FRAME_DURATION)
+        self.assertEqual(simulator.get_register('pc'), 32769)
+        self.assertLess(simulator.get_register('t'), 2 * FRAME_DURATION)
+
+    def test_halt_with_interrupts_enabled_im1(self):
+        memory = [0] * 65536
+        memory[32768:32771] = (251, 118, 60) # EI; HALT; INC A
+        simulator = Simulator(memory, {'pc': 32768, 'im': 1})
+        simulator.run(stop=32771)
+        self.assertEqual(simulator.get_register('a'), 1)
+        self.assertEqual(simulator.get_register('iff'), 1)
+        self.assertGreaterEqual(simulator.get_register('t'), FRAME_DURATION)
+
+    def test_interrupt_im2(self):
+        memory = [0] * 65536
+        memory[32768:32770] = (251, 118) # EI; HALT
+        memory[65279:65281] = (64, 156) # Interrupt vector at 254*256+255
+        memory[40000] = 201 # RET
+        simulator = Simulator(memory, {'pc': 32768, 'im': 2, 'i': 254, 'sp': 50000})
+        executed = simulator.run(stop=32770)
+        self.assertEqual(simulator.get_register('iff'), 0)
+        self.assertEqual(simulator.get_register('sp'), 50000)
+        self.assertTrue(executed[40000])
+
+    def test_tstates_continue_across_runs(self):
+        simulator = Simulator([0] * 65536)
+        simulator.run(stop=10)
+        simulator.run(stop=20)
+        self.assertEqual(simulator.get_register('t'), 80)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+from unittest.mock import patch
+
+from skoolkittest import SkoolKitTestCase
+from skoolkit import SkoolKitError, VERSION, open_file, skoollexer
+
+SKOOL = """@start
+; Routine
+;
+; Used by the routine at #R32775.
+;
+; A Some value
+@label=START
+c32768 LD A,0      ; {Clear A
+ 32770 LD (HL),A   ; and store it}
+ 32771 JR 32768
+
+; Data
+b32773 DEFB 1,2
+
+; Message
+t32775 DEFM "Hi;"
+ 32778 RET         ; Done
+"""
+
+class Skool2AllTest(SkoolKitTestCase):
+    def _read_files(self, top):
+        files = {}
+        for root, dirs, fnames in os.walk(top):
+            for fname in fnames:
+                path = os.path.join(root, fname)
+                with open(path, 'rb') as f:
+                    files[os.path.relpath(path, top)] = f.read()
+        return files
+
+    def _write_individually(self, skoolfile, targets, target_options={}):
+        out_dir = self.make_directory()
+        prefix = os.path.join(out_dir, os.path.basename(skoolfile)[:-6])
+        for target in targets:
+            options = target_options.get(target, '')
+            if target == 'bin':
+                self.run_skool2bin('{} {} {}.bin'.format(options, skoolfile, prefix))
+            elif target == 'html':
+                self.run_skool2html('-d {} {} {}'.format(out_dir, options, skoolfile))
+            else:
+                run = getattr(self, 'run_skool2' + target)
+                output = run('{} {}'.format(options, skoolfile), out_lines=False)[0]
+                with open('{}.{}'.format(prefix, target), 'w') as f:
+                    f.write(output)
+        self.clear_streams()
+        return self._read_files(out_dir)
+
+    def test_no_arguments(self):
+        output, error = self.run_skool2all(catch_exit=2)
+        self.assertEqual(len(output), 0)
+        self.assertTrue(error.startswith('usage: skool2all.py'))
+
+    def test_invalid_option(self):
+        output, error = self.run_skool2all('-x test.skool', catch_exit=2)
+        self.assertEqual(len(output), 0)
+        self.assertTrue(error.startswith('usage: skool2all.py'))
+
+    def test_invalid_option_value(self):
+        skoolfile = self.write_text_file(suffix='.skool')
+        for option in ('-j X', '-t asm,foo'):
+            output, error = self.run_skool2all('{} {}'.format(option, skoolfile), catch_exit=2)
+            self.assertEqual(len(output), 0)
+            self.assertTrue(error.startswith('usage: skool2all.py'))
+
+    def test_invalid_option_specification(self):
+        skoolfile = self.write_text_file(suffix='.skool')
+        for spec in ('foo=-x', 'asm'):
+            with self.assertRaises(SkoolKitError) as cm:
+                self.run_skool2all('-o {} {}'.format(spec, skoolfile))
+            self.assertEqual(cm.exception.args[0], 'Invalid option specification: {}'.format(spec))
+
+    def test_default_option_values(self):
+        skoolfile = self.write_text_file(SKOOL, suffix='.skool')
+        out_dir = self.make_directory()
+        self.run_skool2all('-j 1 -d {} {}'.format(out_dir, skoolfile))
+        exp_files = self._write_individually(skoolfile, ('asm', 'bin', 'ctl', 'html', 'sft'))
+        self.assertEqual(exp_files, self._read_files(out_dir))
+
+    def test_skool_file_is_read_once(self):
+        skoolfile = self.write_text_file(SKOOL, suffix='.skool')
+        out_dir = self.make_directory()
+        with patch.object(skoollexer, 'open_file', wraps=open_file) as mock_open_file:
+            self.run_skool2all('-j 1 -d {} {}'.format(out_dir, skoolfile))
+        self.assertEqual(mock_open_file.call_count, 1)
+        self.assertEqual(len(skoollexer._preloaded), 0)
+
+    def test_skool_file_from_stdin(self):
+        self.write_stdin(SKOOL[:-1])
+        out_dir = self.make_directory()
+        self.run_skool2all('-j 1 -t asm,bin,ctl,sft -d {} -'.format(out_dir))
+        skoolfile = self.write_text_file(SKOOL, suffix='.skool')
+        exp_files = self._write_individually(skoolfile, ('asm', 'bin', 'ctl', 'sft'))
+        prefix = os.path.basename(skoolfile)[:-6]
+        exp_files = {'program' + k[len(prefix):]: v for k, v in exp_files.items()}
+        self.assertEqual(exp_files, self._read_files(out_dir))
+
+    def test_nonstandard_skool_name(self):
+        skoolfile = self.write_text_file(SKOOL, suffix='.sks')
+        out_dir = self.make_directory()
+        self.run_skool2all('-j 1 -t asm,bin -d {} {}'.format(out_dir, skoolfile))
+        fname = os.path.basename(skoolfile)
+        self.assertEqual({fname + '.asm', fname + '.bin'}, set(os.listdir(out_dir)))
+
+    def test_command_error(self):
+        skoolfile = self.write_text_file('c3276x RET', suffix='.skool')
+        out_dir = self.make_directory()
+        with self.assertRaises(SkoolKitError) as cm:
+            self.run_skool2all('-j 1 -t bin,ctl -d {} {}'.format(out_dir, skoolfile))
+        exp_error = '\n'.join((
+            'bin: Invalid address (3276x):\nc3276x RET',
+            'ctl: Invalid address (3276x):\nc3276x RET'
+        ))
+        self.assertEqual(cm.exception.args[0], exp_error)
+
+    def test_invalid_command_option(self):
+        skoolfile = self.write_text_file(SKOOL, suffix='.skool')
+        out_dir = self.make_directory()
+        with self.assertRaises(SkoolKitError) as cm:
+            self.run_skool2all('-j 1 -t sft -o sft=-x -d {} {}'.format(out_dir, skoolfile))
+        self.assertEqual(cm.exception.args[0], 'sft: invalid options: -x {}'.format(skoolfile))
+
+    def test_option_d(self):
+        skoolfile = self.write_text_file(SKOOL, suffix='.skool')
+        top_dir = self.make_directory()
+        out_dir = os.path.join(top_dir, 'new')
+        for option in ('-d', '--output-dir'):
+            self.run_skool2all('-j 1 -t ctl {} {} {}'.format(option, out_dir, skoolfile))
+            self.assertEqual([os.path.basename(skoolfile)[:-6] + '.ctl'], os.listdir(out_dir))
+
+    def test_option_j(self):
+        skoolfile = self.write_text_file(SKOOL, suffix='.skool')
+        exp_files = self._write_individually(skoolfile, ('asm', 'bin', 'ctl', 'html', 'sft'))
+        for option in ('-j', '--jobs'):
+            out_dir = self.make_directory()
+            self.run_skool2all('{} 3 -d {} {}'.format(option, out_dir, skoolfile))
+            self.assertEqual(exp_files, self._read_files(out_dir))
+
+    def test_option_o(self):
+        skoolfile = self.write_text_file(SKOOL, suffix='.skool')
+        target_options = {
+            'asm': '-H -c',
+            'bin': '-S 32770',
+            'ctl': '-h -w bt',
+            'html': '-H',
+            'sft': '-l'
+        }
+        exp_files = self._write_individually(skoolfile, sorted(target_options), target_options)
+        for option in ('-o', '--options'):
+            out_dir = self.make_directory()
+            opts = []
+            for target, target_opts in target_options.items():
+                for opt in target_opts.split():
+                    opts.append('{} {}={}'.format(option, target, opt))
+            self.run_skool2all('-j 1 {} -d {} {}'.format(' '.join(opts), out_dir, skoolfile))
+            self.assertEqual(exp_files, self._read_files(out_dir))
+
+    def test_option_t(self):
+        skoolfile = self.write_text_file(SKOOL, suffix='.skool')
+        for option in ('-t', '--targets'):
+            out_dir = self.make_directory()
+            self.run_skool2all('-j 1 {} sft,asm -d {} {}'.format(option, out_dir, skoolfile))
+            exp_files = self._write_individually(skoolfile, ('asm', 'sft'))
+            self.assertEqual(exp_files, self._read_files(out_dir))
+
+    def test_option_V(self):
+        for option in ('-V', '--version'):
+            output, error = self.run_skool2all(option, err_lines=True, catch_exit=0)
+            self.assertEqual(['SkoolKit {}'.format(VERSION)], output + error)
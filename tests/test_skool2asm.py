@@ -1,4 +1,5 @@
 import os
+import sys
 import unittest
 from unittest.mock import patch, Mock
 
@@ -17,7 +18,7 @@ def mock_config(name):
 
 class MockSkoolParser:
     def __init__(self, skoolfile, case, base, asm_mode, warnings, fix_mode, html,
-                 create_labels, asm_labels, min_address, max_address):
+                 create_labels, asm_labels, min_address, max_address, snapshot, lazy):
         global mock_skool_parser
         mock_skool_parser = self
         self.skoolfile = skoolfile
@@ -31,6 +32,8 @@ class MockSkoolParser:
         self.asm_labels = asm_labels
         self.min_address = min_address
         self.max_address = max_address
+        self.snapshot = snapshot
+        self.lazy = lazy
         self.properties = {}
         self.asm_writer_class = ''
 
@@ -71,6 +74,9 @@ class Skool2AsmTest(SkoolKitTestCase):
         self.assertEqual(options.end, 65536)
         self.assertEqual(options.properties, [])
         self.assertEqual(options.params, [])
+        self.assertEqual(options.cache_dir, '')
+        self.assertFalse(options.rebuild_cache)
+        self.assertFalse(options.lazy)
 
     @patch.object(skool2asm, 'SkoolParser', MockSkoolParser)
     @patch.object(skool2asm, 'AsmWriter', MockAsmWriter)
@@ -90,6 +96,8 @@ class Skool2AsmTest(SkoolKitTestCase):
         self.assertTrue(mock_skool_parser.asm_labels)
         self.assertEqual(mock_skool_parser.min_address, 0)
         self.assertEqual(mock_skool_parser.max_address, 65536)
+        self.assertIsNone(mock_skool_parser.snapshot)
+        self.assertFalse(mock_skool_parser.lazy)
 
         self.assertIs(mock_asm_writer.parser, mock_skool_parser)
         self.assertEqual({}, mock_asm_writer.properties)
@@ -261,6 +269,142 @@ class Skool2AsmTest(SkoolKitTestCase):
             mock_asm_writer.properties = None
             mock_asm_writer.wrote = False
 
+    def test_option_cache(self):
+        skool = '\n'.join((
+            '@start',
+            '; Routine',
+            '@label=START',
+            'c32768 JP 32771',
+            '',
+            '; Other routine',
+            'c32771 RET'
+        ))
+        skoolfile = self.write_text_file(skool, suffix='.skool')
+        cache_dir = self.make_directory()
+        exp_error = 'WARNING: Found no label for operand: 32768 JP 32771\n'
+        exp_output = ['; Routine', 'START:', '  JP 32771', '', '; Other routine', '  RET', '']
+
+        output, error = self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, exp_error)
+        self.assertEqual(exp_output, output)
+        cache_files = os.listdir(cache_dir)
+        self.assertEqual(len(cache_files), 1)
+
+        # Load the parsed skool file from the cache, and check that warnings
+        # are still shown
+        self.clear_streams()
+        with patch.object(skool2asm, 'SkoolParser', side_effect=AssertionError):
+            output, error = self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, exp_error)
+        self.assertEqual(exp_output, output)
+        self.assertEqual(cache_files, os.listdir(cache_dir))
+
+        # A different parser mode uses a different cache file
+        self.clear_streams()
+        output, error = self.run_skool2asm('-q -w --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, '')
+        self.assertEqual(exp_output, output)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_option_cache_with_modified_skool_file(self):
+        skoolfile = self.write_text_file('@start\n; Data\nb32768 DEFB 1', suffix='.skool')
+        cache_dir = self.make_directory()
+        output, error = self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(['; Data', '  DEFB 1', ''], output)
+
+        self.write_text_file('@start\n; Data\nb32768 DEFB 2', skoolfile)
+        self.clear_streams()
+        output, error = self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, '')
+        self.assertEqual(['; Data', '  DEFB 2', ''], output)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_option_cache_with_unreadable_cache_file(self):
+        skoolfile = self.write_text_file('@start\n; Data\nb32768 DEFB 1', suffix='.skool')
+        cache_dir = self.make_directory()
+        self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        cache_files = os.listdir(cache_dir)
+        cache_file = os.path.join(cache_dir, cache_files[0])
+        # A pickle written with a protocol this version of Python does not
+        # support
+        with open(cache_file, 'wb') as f:
+            f.write(b'\x80\xff.')
+
+        self.clear_streams()
+        output, error = self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, '')
+        self.assertEqual(['; Data', '  DEFB 1', ''], output)
+        self.assertEqual(cache_files, os.listdir(cache_dir))
+        with open(cache_file, 'rb') as f:
+            self.assertNotEqual(f.read(), b'\x80\xff.')
+
+    def test_option_cache_with_different_python_versions(self):
+        skoolfile = self.write_text_file('@start\n; Data\nb32768 DEFB 1', suffix='.skool')
+        cache_dir = self.make_directory()
+        self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        self.clear_streams()
+        with patch.object(sys, 'version_info', (sys.version_info[0], sys.version_info[1] + 1, 0)):
+            output, error = self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, '')
+        self.assertEqual(['; Data', '  DEFB 1', ''], output)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_option_rebuild_cache(self):
+        skoolfile = self.write_text_file('@start\n; Data\nb32768 DEFB 1', suffix='.skool')
+        cache_dir = self.make_directory()
+        self.run_skool2asm('-q --cache {} {}'.format(cache_dir, skoolfile))
+        cache_files = os.listdir(cache_dir)
+        self.assertEqual(len(cache_files), 1)
+        cache_file = os.path.join(cache_dir, cache_files[0])
+        with open(cache_file, 'wb') as f:
+            f.write(b'corrupted')
+
+        self.clear_streams()
+        with patch.object(skool2asm, 'SkoolParser', wraps=skool2asm.SkoolParser) as mock_parser:
+            output, error = self.run_skool2asm('-q --rebuild-cache --cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(mock_parser.call_count, 1)
+        self.assertEqual(error, '')
+        self.assertEqual(['; Data', '  DEFB 1', ''], output)
+        self.assertEqual(cache_files, os.listdir(cache_dir))
+        with open(cache_file, 'rb') as f:
+            self.assertNotEqual(f.read(), b'corrupted')
+
+    def test_option_lazy(self):
+        skool = '\n'.join((
+            '@start',
+            '; First routine',
+            'c32768 RET',
+            '',
+            '; Second routine',
+            'c32769 RET',
+            '',
+            '; Third routine',
+            'c32770 RET'
+        ))
+        skoolfile = self.write_text_file(skool, suffix='.skool')
+        self.tempfiles.append(skoolfile + '.idx')
+        output, error = self.run_skool2asm('-q --lazy -S 32769 -E 32770 {}'.format(skoolfile))
+        self.assertEqual(error, '')
+        self.assertEqual(['; Second routine', '  RET', ''], output)
+        self.assertTrue(os.path.isfile(skoolfile + '.idx'))
+
+    @patch.object(skool2asm, 'SkoolParser', MockSkoolParser)
+    @patch.object(skool2asm, 'AsmWriter', MockAsmWriter)
+    def test_option_lazy_is_passed(self):
+        self.run_skool2asm('-q --lazy -S 30000 test-lazy.skool')
+        self.assertTrue(mock_skool_parser.lazy)
+        self.assertEqual(mock_skool_parser.min_address, 30000)
+
+    def test_option_cache_with_stdin(self):
+        cache_dir = self.make_directory()
+        self.write_stdin('@start\n; Data\nb32768 DEFB 1')
+        output, error = self.run_skool2asm('-q --cache {} -'.format(cache_dir))
+        self.assertEqual(error, '')
+        self.assertEqual(['; Data', '  DEFB 1', ''], output)
+        self.assertEqual(os.listdir(cache_dir), [])
+
     @patch.object(skool2asm, 'SkoolParser', MockSkoolParser)
     @patch.object(skool2asm, 'AsmWriter', MockAsmWriter)
     @patch.object(skool2asm, 'get_config', mock_config)
@@ -522,6 +666,7 @@ class Skool2AsmTest(SkoolKitTestCase):
         self.assertEqual(error, '')
         exp_output = [
             'Base=0',
+            'CacheDir=',
             'Case=0',
             'CreateLabels=0',
             'Quiet=0',
@@ -541,6 +686,7 @@ class Skool2AsmTest(SkoolKitTestCase):
         self.assertEqual(error, '')
         exp_output = [
             'Base=10',
+            'CacheDir=',
             'Case=1',
             'CreateLabels=0',
             'Quiet=1',
@@ -7,7 +7,7 @@ from skoolkit import skool2ctl, VERSION
 ELEMENTS = 'abtdrmsc'
 
 class MockCtlWriter:
-    def __init__(self, skoolfile, elements, write_hex, preserve_base, min_address, max_address):
+    def __init__(self, skoolfile, elements, write_hex, preserve_base, min_address, max_address, cache_dir, rebuild_cache):
         global mock_ctl_writer
         self.skoolfile = skoolfile
         self.elements = elements
@@ -15,6 +15,8 @@ class MockCtlWriter:
         self.preserve_base = preserve_base
         self.min_address = min_address
         self.max_address = max_address
+        self.cache_dir = cache_dir
+        self.rebuild_cache = rebuild_cache
         self.write_called = False
         mock_ctl_writer = self
 
@@ -23,13 +25,15 @@ class MockCtlWriter:
 
 class Skool2CtlTest(SkoolKitTestCase):
     def _check_ctl_writer(self, skoolfile, elements=ELEMENTS, write_hex=0, preserve_base=False,
-                          min_address=0, max_address=65536):
+                          min_address=0, max_address=65536, cache_dir=None, rebuild_cache=False):
         self.assertEqual(mock_ctl_writer.skoolfile, skoolfile)
         self.assertEqual(mock_ctl_writer.elements, elements)
         self.assertEqual(mock_ctl_writer.write_hex, write_hex)
         self.assertIs(mock_ctl_writer.preserve_base, preserve_base)
         self.assertEqual(mock_ctl_writer.min_address, min_address)
         self.assertEqual(mock_ctl_writer.max_address, max_address)
+        self.assertEqual(mock_ctl_writer.cache_dir, cache_dir)
+        self.assertIs(mock_ctl_writer.rebuild_cache, rebuild_cache)
         self.assertTrue(mock_ctl_writer.write_called)
 
     def test_no_arguments(self):
@@ -83,6 +87,18 @@ class Skool2CtlTest(SkoolKitTestCase):
             skool2ctl.main((option, skoolfile))
             self._check_ctl_writer(skoolfile, preserve_base=True)
 
+    @patch.object(skool2ctl, 'CtlWriter', MockCtlWriter)
+    def test_option_cache(self):
+        skoolfile = 'test.skool'
+        skool2ctl.main(('--cache', 'cache', skoolfile))
+        self._check_ctl_writer(skoolfile, cache_dir='cache')
+
+    @patch.object(skool2ctl, 'CtlWriter', MockCtlWriter)
+    def test_option_rebuild_cache(self):
+        skoolfile = 'test.skool'
+        skool2ctl.main(('--cache', 'cache', '--rebuild-cache', skoolfile))
+        self._check_ctl_writer(skoolfile, cache_dir='cache', rebuild_cache=True)
+
     @patch.object(skool2ctl, 'CtlWriter', MockCtlWriter)
     def test_option_S(self):
         skoolfile = 'test.skool'
@@ -1,3 +1,4 @@
+import json
 import re
 import os.path
 import unittest
@@ -7,6 +8,7 @@ from skoolkittest import SkoolKitTestCase
 import skoolkit
 from skoolkit import normpath, skool2html, BASE_10, BASE_16, PACKAGE_DIR, VERSION, SkoolKitError
 from skoolkit.config import COMMANDS
+from skoolkit.image import ImageWriter
 from skoolkit.skoolhtml import HtmlWriter
 from skoolkit.skoolparser import CASE_UPPER, CASE_LOWER
 
@@ -180,6 +182,9 @@ class Skool2HtmlTest(SkoolKitTestCase):
         self.assertEqual(options.pages, [])
         self.assertEqual(options.output_dir, '.')
         self.assertEqual(options.params, [])
+        self.assertEqual(options.cache_dir, '')
+        self.assertFalse(options.rebuild_cache)
+        self.assertEqual(options.image_cache_size, 100)
 
     @patch.object(skool2html, 'run', mock_run)
     def test_config_read_from_file(self):
@@ -191,6 +196,7 @@ class Skool2HtmlTest(SkoolKitTestCase):
             'Base=16',
             'Case=-1',
             'CreateLabels=1',
+            'ImageCacheSize=5',
             'JoinCss=css.css',
             'OutputDir=' + output_dir,
             'Quiet=1',
@@ -207,6 +213,7 @@ class Skool2HtmlTest(SkoolKitTestCase):
         self.assertTrue(options.asm_labels)
         self.assertTrue(options.asm_one_page)
         self.assertTrue(options.create_labels)
+        self.assertEqual(options.image_cache_size, 5)
         self.assertEqual(options.single_css, 'css.css')
         self.assertEqual(options.search, ['this', 'that'])
         self.assertEqual(options.themes, ['dark', 'wide'])
@@ -820,6 +827,187 @@ class Skool2HtmlTest(SkoolKitTestCase):
             with self.assertRaisesRegex(SkoolKitError, error_msg):
                 self.run_skool2html('{} {} -d {} {}'.format(option, single_css, self.odir, skoolfile))
 
+    def _read_files(self, top):
+        files = {}
+        for root, dirs, fnames in os.walk(top):
+            for fname in fnames:
+                path = os.path.join(root, fname)
+                with open(path, 'rb') as f:
+                    files[os.path.relpath(path, top)] = f.read()
+        return files
+
+    def test_option_jobs(self):
+        skool = []
+        for i in range(24):
+            macros = '#PEEK32768 #UDG{}(shared)'.format(32768 + i % 3)
+            if i == 5:
+                macros += ' #POKES32768,99'
+            elif i == 9:
+                macros += ' #UDG32770(*f1)'
+            elif i == 15:
+                macros += ' #PUSHS #POKES32768,100 #UDGARRAY*f1(anim)'
+            skool.append('; Entry {}\n;\n; {}\nb{} DEFB 1,2,3,4\n'.format(i, macros, 32768 + i * 4))
+        skoolfile = self.write_text_file('\n'.join(skool), suffix='.skool')
+        ref = '[Page:P1]\nPageContent=#PEEK32768 #UDG32768(page) #UDGARRAY*f1(anim2)'
+        self.write_text_file(ref, '{}.ref'.format(skoolfile[:-6]))
+        for options in ('', '-o'):
+            exp_dir = self.make_directory()
+            self.run_skool2html('{} -d {} {}'.format(options, exp_dir, skoolfile))
+            exp_files = self._read_files(exp_dir)
+            out_dir = self.make_directory()
+            output, error = self.run_skool2html('{} --jobs 3 -d {} {}'.format(options, out_dir, skoolfile))
+            self.assertEqual(error, '')
+            self.assertIn('  Rendering 27 pages in 3 processes', output)
+            self.assertEqual(exp_files, self._read_files(out_dir))
+
+    def test_option_jobs_with_warnings(self):
+        for pokes in ('', ' #POKES32768,1'):
+            skool = []
+            for i in range(40):
+                macros = '#CALL:nosuch({})'.format(i)
+                if i == 10:
+                    macros += pokes
+                skool.append('; Entry {}\n;\n; {}\nb{} DEFB 1,2,3,4\n'.format(i, macros, 32768 + i * 4))
+            skoolfile = self.write_text_file('\n'.join(skool), suffix='.skool')
+            self.clear_streams()
+            self.run_skool2html('-d {} {}'.format(self.make_directory(), skoolfile))
+            exp_error = self.err.getvalue()
+            self.assertEqual(len(exp_error.splitlines()), 40)
+            self.clear_streams()
+            output, error = self.run_skool2html('--jobs 4 -d {} {}'.format(self.make_directory(), skoolfile))
+            self.assertIn('  Rendering 42 pages in 4 processes', output)
+            self.assertEqual(exp_error, error)
+
+    def test_option_jobs_with_error(self):
+        skoolfile = self.write_text_file('; Data\nb32768 DEFB 0', suffix='.skool')
+        ref = '[Page:P1]\nPageContent=#UDGARRAY*nope(anim)'
+        self.write_text_file(ref, '{}.ref'.format(skoolfile[:-6]))
+        with self.assertRaisesRegex(SkoolKitError, 'No such frame: "nope"'):
+            self.run_skool2html('--jobs 2 -d {} {}'.format(self.odir, skoolfile))
+
+    def test_option_image_jobs(self):
+        skool = []
+        for i in range(12):
+            macros = '#UDGARRAY2,{0};32768-32784-8(img{1}) #UDG{2}(udg{1}) #FONT32768,{1}(font{1})'.format(56 + i, i, 32768 + i)
+            if i == 6:
+                macros += ' #PUSHS #POKES32768,255 #UDG32768(poked) #POPS'
+            skool.append('; Entry {}\n;\n; {}\nb{} DEFB 1,2,3,4,5,6,7,8\n'.format(i, macros, 32768 + i * 8))
+        skoolfile = self.write_text_file('\n'.join(skool), suffix='.skool')
+        exp_dir = self.make_directory()
+        self.run_skool2html('-d {} {}'.format(exp_dir, skoolfile))
+        exp_files = self._read_files(exp_dir)
+        cache_dir = self.make_directory()
+        for options in ('', '--jobs 2', '--cache {}'.format(cache_dir)):
+            out_dir = self.make_directory()
+            output, error = self.run_skool2html('{} --image-jobs 2 -d {} {}'.format(options, out_dir, skoolfile))
+            self.assertEqual(error, '')
+            self.assertEqual(exp_files, self._read_files(out_dir))
+        images = {data for fname, data in exp_files.items() if fname.endswith('.png')}
+        self.assertEqual(len(os.listdir(os.path.join(cache_dir, 'images'))), len(images))
+
+    @patch.object(ImageWriter, 'write_image', Mock(side_effect=ValueError('Encoding failed')))
+    def test_option_image_jobs_with_error(self):
+        skoolfile = self.write_text_file('; Data\n;\n; #UDG32768\nb32768 DEFB 1,2,3,4,5,6,7,8', suffix='.skool')
+        with self.assertRaisesRegex(ValueError, 'Encoding failed'):
+            self.run_skool2html('--image-jobs 2 -d {} {}'.format(self.odir, skoolfile))
+
+    def _write_incrementally(self, options, skoolfile, out_dir):
+        # Return the HTML and image files rewritten by an incremental build,
+        # after checking that the result is the same as that of a full build
+        for root, dirs, fnames in os.walk(out_dir):
+            for fname in fnames:
+                os.utime(os.path.join(root, fname), (0, 0))
+        output, error = self.run_skool2html('{} --incremental -d {} {}'.format(options, out_dir, skoolfile))
+        self.assertEqual(error, '')
+        exp_dir = self.make_directory()
+        self.run_skool2html('{} -d {} {}'.format(options, exp_dir, skoolfile))
+        files = self._read_files(out_dir)
+        del files[normpath(os.path.basename(skoolfile)[:-6], '.skoolkit-manifest')]
+        self.assertEqual(self._read_files(exp_dir), files)
+        rewritten = set()
+        for root, dirs, fnames in os.walk(out_dir):
+            for fname in fnames:
+                path = os.path.join(root, fname)
+                if fname.endswith(('.html', '.png', '.gif')) and os.stat(path).st_mtime:
+                    rewritten.add(normpath(os.path.relpath(path, out_dir)).split('/', 1)[1])
+        return output, rewritten
+
+    def test_option_incremental(self):
+        skool = ['; Entry {0}\n;\n; #UDG{1}(udg{0})\nb{1} DEFB 1,2,3,4 ; Data\n'.format(i, 32768 + i * 4) for i in range(6)]
+        skoolfile = self.write_text_file('\n'.join(skool), suffix='.skool')
+        out_dir = self.make_directory()
+
+        output, rewritten = self._write_incrementally('', skoolfile, out_dir)
+        self.assertIn('  Skipped 0 unchanged pages', output)
+        self.assertIn('asm/32768.html', rewritten)
+
+        output, rewritten = self._write_incrementally('', skoolfile, out_dir)
+        self.assertIn('  Skipped 9 unchanged pages', output)
+        self.assertEqual(rewritten, set())
+
+        skool[2] = skool[2].replace('; Data', '; Edited')
+        self.write_text_file('\n'.join(skool), skoolfile)
+        output, rewritten = self._write_incrementally('', skoolfile, out_dir)
+        self.assertEqual(rewritten, {'asm/32776.html'})
+
+        skool[3] = skool[3].replace('DEFB 1,', 'DEFB 255,')
+        self.write_text_file('\n'.join(skool), skoolfile)
+        output, rewritten = self._write_incrementally('', skoolfile, out_dir)
+        exp_rewritten = {
+            'asm/32772.html', 'asm/32776.html', 'asm/32780.html', 'asm/32784.html',
+            'images/udgs/udg2.png', 'images/udgs/udg3.png'
+        }
+        self.assertEqual(exp_rewritten, rewritten)
+
+    def test_option_incremental_with_unreadable_manifest(self):
+        skool = ['; Entry {0}\n;\n; #UDG{1}(udg{0})\nb{1} DEFB 1,2,3,4 ; Data\n'.format(i, 32768 + i * 4) for i in range(3)]
+        skoolfile = self.write_text_file('\n'.join(skool), suffix='.skool')
+        out_dir = self.make_directory()
+        self._write_incrementally('', skoolfile, out_dir)
+        manifest = os.path.join(out_dir, os.path.basename(skoolfile)[:-6], '.skoolkit-manifest')
+        with open(manifest) as f:
+            self.assertEqual(sorted(json.load(f)), ['images', 'key', 'pages'])
+
+        # A manifest that is not JSON (such as a pickle) is ignored, and
+        # every page is written again
+        for contents in (b'\x80\x05N.', b'{"key": 1}', b'[]', b'\xff'):
+            with open(manifest, 'wb') as f:
+                f.write(contents)
+            output, rewritten = self._write_incrementally('', skoolfile, out_dir)
+            self.assertIn('  Skipped 0 unchanged pages', output)
+            self.assertIn('asm/32768.html', rewritten)
+
+        output, rewritten = self._write_incrementally('', skoolfile, out_dir)
+        self.assertIn('  Skipped 6 unchanged pages', output)
+        self.assertEqual(rewritten, set())
+
+    def test_option_incremental_with_side_effects(self):
+        for options in ('', '--jobs 3'):
+            skool = []
+            for i in range(12):
+                macros = '#PEEK32768 #UDG{}(shared)'.format(32768 + i % 3)
+                if i == 3:
+                    macros += ' #POKES32768,99'
+                elif i == 5:
+                    macros += ' #UDG32770(*f1)'
+                elif i == 8:
+                    macros += ' #PUSHS #POKES32768,100 #UDGARRAY*f1(anim)'
+                skool.append('; Entry {}\n;\n; {}\nb{} DEFB 1,2,3,4 ; Data\n'.format(i, macros, 32768 + i * 4))
+            skoolfile = self.write_text_file('\n'.join(skool), suffix='.skool')
+            out_dir = self.make_directory()
+            self._write_incrementally(options, skoolfile, out_dir)
+            # Pages that change the snapshot, define a frame or use a frame
+            # (as may the pages of adjacent entries) are always rewritten
+            volatile = {'asm/32776.html', 'asm/32784.html', 'asm/32796.html', 'asm/32800.html', 'asm/32804.html'}
+            output, rewritten = self._write_incrementally(options, skoolfile, out_dir)
+            self.assertEqual(volatile, rewritten)
+
+            skool[10] = skool[10].replace('; Data', '; Edited')
+            skool[11] = skool[11].replace('DEFB 1,', 'DEFB 255,')
+            self.write_text_file('\n'.join(skool), skoolfile)
+            output, rewritten = self._write_incrementally(options, skoolfile, out_dir)
+            self.assertEqual(volatile | {'asm/32808.html', 'asm/32812.html'}, rewritten)
+
     @patch.object(skool2html, 'get_class', Mock(return_value=TestHtmlWriter))
     @patch.object(skool2html, 'SkoolParser', MockSkoolParser)
     @patch.object(skool2html, 'write_disassembly', mock_write_disassembly)
@@ -842,6 +1030,54 @@ class Skool2HtmlTest(SkoolKitTestCase):
             self.assertEqual(error, '')
             self.assertTrue(mock_skool_parser.create_labels)
 
+    @patch.object(skool2html, 'get_class', Mock(return_value=TestHtmlWriter))
+    @patch.object(skool2html, 'write_disassembly', mock_write_disassembly)
+    def test_option_cache(self):
+        skoolfile = self.write_text_file('; Routine\nc32768 JP 32768', suffix='.skool')
+        cache_dir = self.make_directory()
+        output, error = self.run_skool2html('--cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, '')
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        with patch.object(skool2html, 'SkoolParser', side_effect=AssertionError):
+            output, error = self.run_skool2html('--cache {} {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, '')
+        parser = html_writer.parser
+        self.assertEqual([e.address for e in parser.memory_map], [32768])
+        self.assertIs(parser.get_instruction(32768).reference.entry, parser.get_entry(32768))
+
+        with patch.object(skool2html, 'SkoolParser', wraps=skool2html.SkoolParser) as mock_parser:
+            output, error = self.run_skool2html('--cache {} --rebuild-cache {}'.format(cache_dir, skoolfile))
+        self.assertEqual(error, '')
+        self.assertEqual(mock_parser.call_count, 1)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_option_cache_with_images(self):
+        skool = '; Data\n;\n; #UDG32768({}) #UDGARRAY2;32768-32776-8({})\nb32768 DEFB 1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16'
+        skoolfile1 = self.write_text_file(skool.format('a1', 'b1'), 'game1.skool')
+        skoolfile2 = self.write_text_file(skool.format('a2', 'b2'), 'game2.skool')
+        exp_dir = self.make_directory()
+        self.run_skool2html('-d {} {} {}'.format(exp_dir, skoolfile1, skoolfile2))
+        cache_dir = self.make_directory()
+        out_dir = self.make_directory()
+        for options in ('', '-o --jobs 2'):
+            output, error = self.run_skool2html('{} --cache {} -d {} {} {}'.format(options, cache_dir, out_dir, skoolfile1, skoolfile2))
+            self.assertEqual(error, '')
+            self.assertEqual(self._read_files(exp_dir), self._read_files(out_dir))
+            image_dir = os.path.join(cache_dir, 'images')
+            self.assertEqual(len(os.listdir(image_dir)), 2)
+            # The images in the second game are hard-linked from the cache
+            for name in ('a2', 'b2'):
+                image = os.path.join(out_dir, 'game2', 'images', 'udgs', name + '.png')
+                self.assertTrue(any(os.path.samefile(image, os.path.join(image_dir, f)) for f in os.listdir(image_dir)))
+
+    def test_config_ImageCacheSize_0(self):
+        skoolfile = self.write_text_file('; Data\n;\n; #UDG32768(udg)\nb32768 DEFB 1,2,3,4,5,6,7,8', suffix='.skool')
+        cache_dir = self.make_directory()
+        output, error = self.run_skool2html('--cache {} -I ImageCacheSize=0 -d {} {}'.format(cache_dir, self.odir, skoolfile))
+        self.assertEqual(error, '')
+        self.assertFalse(os.path.exists(os.path.join(cache_dir, 'images')))
+
     @patch.object(skool2html, 'get_class', Mock(return_value=TestHtmlWriter))
     @patch.object(skool2html, 'SkoolParser', MockSkoolParser)
     @patch.object(skool2html, 'write_disassembly', mock_write_disassembly)
@@ -1126,8 +1362,10 @@ class Skool2HtmlTest(SkoolKitTestCase):
             'AsmLabels=0',
             'AsmOnePage=0',
             'Base=0',
+            'CacheDir=',
             'Case=0',
             'CreateLabels=0',
+            'ImageCacheSize=100',
             'JoinCss=',
             'OutputDir=.',
             'Quiet=0',
@@ -1153,8 +1391,10 @@ class Skool2HtmlTest(SkoolKitTestCase):
             'AsmLabels=1',
             'AsmOnePage=0',
             'Base=0',
+            'CacheDir=',
             'Case=0',
             'CreateLabels=0',
+            'ImageCacheSize=100',
             'JoinCss=',
             'OutputDir=html',
             'Quiet=1',
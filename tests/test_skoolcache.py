@@ -0,0 +1,52 @@
+import os
+import unittest
+
+from skoolkittest import SkoolKitTestCase
+from skoolkit.skoolcache import ImageCache
+
+class ImageCacheTest(SkoolKitTestCase):
+    def _put(self, cache, key, size, mtime):
+        cache.put(key, self.write_bin_file([0] * size))
+        os.utime(os.path.join(cache.cache_dir, key), (mtime, mtime))
+
+    def test_get_and_put(self):
+        cache_dir = os.path.join(self.make_directory(), 'images')
+        cache = ImageCache(cache_dir, 1000)
+        self.assertIsNone(cache.get('abc.png'))
+
+        fname = self.write_bin_file([1, 2, 3])
+        cache.put('abc.png', fname)
+        path = cache.get('abc.png')
+        self.assertEqual(path, os.path.join(cache_dir, 'abc.png'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), bytes((1, 2, 3)))
+        self.assertEqual(os.listdir(cache_dir), ['abc.png'])
+
+    def test_get_marks_file_as_recently_used(self):
+        cache = ImageCache(self.make_directory(), 1000)
+        self._put(cache, 'a.png', 10, 100)
+        cache.get('a.png')
+        self.assertGreater(os.stat(os.path.join(cache.cache_dir, 'a.png')).st_mtime, 100)
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = ImageCache(self.make_directory(), 1000)
+        self._put(cache, 'a.png', 300, 300)
+        self._put(cache, 'b.png', 300, 100)
+        self._put(cache, 'c.png', 300, 200)
+        self.assertEqual(len(os.listdir(cache.cache_dir)), 3)
+
+        # Exceed the maximum size; files are removed, least recently used
+        # first, until the cache is no more than three quarters full
+        self._put(cache, 'd.png', 300, 400)
+        self.assertEqual(sorted(os.listdir(cache.cache_dir)), ['a.png', 'd.png'])
+        self.assertEqual(cache.size, 600)
+
+    def test_size_is_computed_from_existing_files(self):
+        cache_dir = self.make_directory()
+        self._put(ImageCache(cache_dir, 1000), 'a.png', 600, 100)
+        cache = ImageCache(cache_dir, 1000)
+        self._put(cache, 'b.png', 600, 200)
+        self.assertEqual(os.listdir(cache_dir), ['b.png'])
+
+if __name__ == '__main__':
+    unittest.main()
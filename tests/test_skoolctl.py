@@ -1,8 +1,10 @@
 from io import StringIO
+import os
 import unittest
+from unittest.mock import patch
 
 from skoolkittest import SkoolKitTestCase
-from skoolkit import SkoolParsingError
+from skoolkit import SkoolParsingError, skoolctl
 from skoolkit.skoolctl import CtlWriter
 
 DIRECTIVES = 'bcgistuw'
@@ -667,6 +669,25 @@ class CtlWriterTest(SkoolKitTestCase):
     def test_default_elements(self):
         self.assertEqual(TEST_CTL, self._get_ctl())
 
+    def test_cache(self):
+        skoolfile = self.write_text_file(TEST_SKOOL, suffix='.skool')
+        cache_dir = self.make_directory()
+        CtlWriter(skoolfile, cache_dir=cache_dir).write()
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(TEST_CTL, self.out.getvalue().split('\n')[:-1])
+
+        self.clear_streams()
+        with patch.object(skoolctl.SkoolParser, '__init__', side_effect=AssertionError):
+            CtlWriter(skoolfile, cache_dir=cache_dir).write()
+        self.assertEqual(TEST_CTL, self.out.getvalue().split('\n')[:-1])
+
+        self.clear_streams()
+        with patch.object(skoolctl.SkoolParser, '__init__', autospec=True, side_effect=skoolctl.SkoolParser.__init__) as mock_parser:
+            CtlWriter(skoolfile, cache_dir=cache_dir, rebuild_cache=True).write()
+        self.assertEqual(mock_parser.call_count, 1)
+        self.assertEqual(TEST_CTL, self.out.getvalue().split('\n')[:-1])
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
     def test_default_elements_hex(self):
         self.assertEqual(TEST_CTL_HEX, self._get_ctl(write_hex=1))
 
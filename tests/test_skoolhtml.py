@@ -1,6 +1,8 @@
 import html
 from os.path import basename, isfile
 from posixpath import join
+import sys
+import threading
 import unittest
 from unittest.mock import patch
 
@@ -670,6 +672,34 @@ class MethodTest(HtmlWriterTestCase):
         with self.assertRaisesRegex(SkoolKitError, "^'default' template does not exist$"):
             writer.format_template('non-existent', {}, 'default')
 
+    def test_format_template_with_field_attributes_indexes_and_conversions(self):
+        writer = self._get_writer(ref='[Game]\nGame=Foo\n[Template:foo]\n{Game[Game]} {bar[1]} {baz.real} {{qux}} {qux!r:>6}|{qux:^5}|')
+        output = writer.format_template('foo', {'bar': (1, 2), 'baz': 3, 'qux': 'xy'})
+        self.assertEqual(output, "Foo 2 3 {qux}   'xy'| xy  |")
+
+    def test_format_template_substitutions_take_precedence(self):
+        writer = self._get_writer(ref='[Game]\nGame=Foo\n[Template:foo]\n{Game[Game]}')
+        output = writer.format_template('foo', {'Game': {'Game': 'Bar'}})
+        self.assertEqual(output, 'Foo')
+
+    def test_format_template_page_specific_templates(self):
+        ref = '\n'.join((
+            '[Template:Page1-foo]',
+            '1:{bar}',
+            '[Template:foo]',
+            '{bar}',
+        ))
+        writer = self._get_writer(ref=ref)
+        for page_id, exp_output in (('Page1', '1:baz'), ('Page2', 'baz'), ('Page1', '1:baz')):
+            writer.skoolkit['page_id'] = page_id
+            self.assertEqual(writer.format_template('foo', {'bar': 'baz'}), exp_output)
+
+    def test_format_template_malformed(self):
+        writer = self._get_writer(ref='[Template:foo]\n{bar')
+        for i in range(2):
+            with self.assertRaisesRegex(SkoolKitError, "^Failed to format foo template: expected '}' before end of string$"):
+                writer.format_template('foo', {'bar': 'baz'})
+
 class SkoolMacroTest(HtmlWriterTestCase, CommonSkoolMacroTest):
     def setUp(self):
         HtmlWriterTestCase.setUp(self)
@@ -5867,6 +5897,39 @@ class HtmlOutputTest(HtmlWriterOutputTestCase):
         }
         self._assert_files_equal('{}.html'.format(page_id), subs)
 
+    def test_write_pages_in_parallel(self):
+        ref = '\n'.join((
+            '[Page:Test]',
+            'PageContent=#FOR(1,20)//n/#N(n*#PEEK32768) #IF(#PEEK32769)(odd,even) #MAP(#PEEK32768)(?,1:one,2:two) #R32768/, //'
+        ))
+        writers = []
+        exp_pages = []
+        for i in range(4):
+            writer = self._get_writer(ref=ref, skool='b32768 DEFB {},{}'.format(i + 1, i % 2))
+            pages = []
+            writer.write_file = lambda fname, contents, pages=pages: pages.append(contents)
+            writer.write_page('Test')
+            writers.append((writer, pages))
+            exp_pages.append(pages.pop())
+        self.assertEqual(len(set(exp_pages)), 4)
+
+        def write_pages(writer):
+            for i in range(10):
+                writer.write_page('Test')
+
+        threads = [threading.Thread(target=write_pages, args=(w,)) for w, p in writers]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        for (writer, pages), exp_page in zip(writers, exp_pages):
+            self.assertEqual([exp_page] * 10, pages)
+
     def test_write_page_with_no_page_section(self):
         page_id = 'page'
         content = '<b>This is the content of the custom page.</b>'
@@ -1,10 +1,12 @@
+import re
 import sys
 import os
 import unittest
 from importlib import invalidate_caches
 
 from skoolkittest import SkoolKitTestCase
-from skoolkit import error, get_class, open_file, read_bin_file
+from skoolkit import (SkoolKitError, compile_template, error, format_template,
+                      get_class, open_file, read_bin_file)
 
 ERRNO = 13 if sys.platform == 'win32' else 21
 
@@ -48,5 +50,28 @@ class SkoolKitTest(SkoolKitTestCase):
         writer_class = get_class(':{}.{}'.format(module_name, class_name), default_path)
         self.assertEqual(writer_class.__name__, class_name)
 
+    def test_compile_template(self):
+        fields = {'a': 'x', 'b': {'c': 'y'}, 'd': [1, 2], 'e': 255, 'f': 'q', 'g': 'z'}
+        for template in (
+                '',
+                'text with no fields',
+                '{a}',
+                '100% {a} {{a}} %s',
+                '{b[c]} {d[1]} {a.__class__.__name__}',
+                '{e:04X} {e:>5} {f!r} {f!s:>3} {f!a}',
+                '{g} {h[i]}'
+        ):
+            subs = {'g': 'sub', 'h': {'i': 'j'}}
+            expected = format_template(template, 'T', **dict(fields, **subs))
+            self.assertEqual(compile_template(template, 'T', subs)(fields), expected)
+
+    def test_compile_template_with_errors(self):
+        for template in ('{z}', '{a:d}', '{a!x}', '{a'):
+            with self.assertRaises(SkoolKitError) as cm:
+                format_template(template, 'T', a='x')
+            message = cm.exception.args[0]
+            with self.assertRaisesRegex(SkoolKitError, '^{}$'.format(re.escape(message))):
+                compile_template(template, 'T')({'a': 'x'})
+
 if __name__ == '__main__':
     unittest.main()
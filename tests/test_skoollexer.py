@@ -0,0 +1,79 @@
+import os
+
+from skoolkittest import SkoolKitTestCase
+from skoolkit.skoollexer import (BLANK, COMMENT, CONTINUATION, DIRECTIVE, INSTRUCTION, clear_preloaded,
+                                 find_comment, lex_skool, preload_skool, read_skool, split_instruction)
+
+TEST_LEX = (
+    # line, kind, index
+    ('; Routine\n', COMMENT, 0),
+    (';\n', COMMENT, 0),
+    ('@label=START\n', DIRECTIVE, 0),
+    ('\n', BLANK, 0),
+    ('  \t\n', BLANK, 0),
+    ('', BLANK, 0),
+    ('                ; and more\n', CONTINUATION, 16),
+    ('\t; more\n', CONTINUATION, 1),
+    ('c32768 XOR A\n', INSTRUCTION, 13),
+    ('c32768 XOR A  ; Clear A\n', INSTRUCTION, 14),
+    (' 32769 RET\n', INSTRUCTION, 11),
+    ('*32770 RET ; Return\n', INSTRUCTION, 11),
+    ('t32771 DEFM ";" ; Semicolon\n', INSTRUCTION, 16),
+    ('t32772 DEFM "\\";" ; Quote and semicolon\n', INSTRUCTION, 18),
+    ('b32773 DEFB 0;\n', INSTRUCTION, 13),
+    ('c327\n', INSTRUCTION, 5)
+)
+
+TEST_SPLIT = (
+    # line, result
+    ('c32768 XOR A\n', ('c', '32768', 'XOR A', '')),
+    ('c32768 XOR A  ; Clear A\n', ('c', '32768', 'XOR A', 'Clear A')),
+    (' $8001 RET ;\n', (' ', '$8001', 'RET', '')),
+    ('t32771 DEFM ";" ; Semicolon\n', ('t', '32771', 'DEFM ";"', 'Semicolon')),
+    ('i32772 ; Ignored\n', ('i', '32772', '', 'Ignored'))
+)
+
+class SkoolLexerTest(SkoolKitTestCase):
+    def test_lex_skool(self):
+        for line, kind, index in TEST_LEX:
+            self.assertEqual([(kind, line, index)], list(lex_skool([line])), "lex_skool([{!r}]) failed".format(line))
+
+    def test_lex_skool_multiple_lines(self):
+        lines = (
+            '; Routine\n',
+            '@label=START\n',
+            'c32768 XOR A ; Clear A\n',
+            '             ; and return\n',
+            ' 32769 RET\n',
+            '\n'
+        )
+        exp_kinds = [COMMENT, DIRECTIVE, INSTRUCTION, CONTINUATION, INSTRUCTION, BLANK]
+        records = list(lex_skool(lines))
+        self.assertEqual(exp_kinds, [r[0] for r in records])
+        self.assertEqual(list(lines), [r[1] for r in records])
+
+    def test_find_comment(self):
+        for line, kind, index in TEST_LEX:
+            if kind == INSTRUCTION:
+                self.assertEqual(index, find_comment(line), "find_comment({!r}) failed".format(line))
+
+    def test_split_instruction(self):
+        for line, exp_result in TEST_SPLIT:
+            self.assertEqual(exp_result, split_instruction(line, find_comment(line)), "split_instruction({!r}) failed".format(line))
+
+    def test_read_skool(self):
+        skoolfile = self.write_text_file('; Routine\nc32768 RET\n', suffix='.skool')
+        exp_records = [(COMMENT, '; Routine\n', 0), (INSTRUCTION, 'c32768 RET\n', 11)]
+        self.assertEqual(exp_records, list(read_skool(skoolfile)))
+
+    def test_read_skool_preloaded(self):
+        skoolfile = self.write_text_file('c32768 RET\n', suffix='.skool')
+        preload_skool(skoolfile)
+        with open(skoolfile, 'w') as f:
+            f.write('c32768 NOP\n')
+        try:
+            self.assertEqual([(INSTRUCTION, 'c32768 RET\n', 11)], list(read_skool(skoolfile)))
+            self.assertEqual([(INSTRUCTION, 'c32768 RET\n', 11)], list(read_skool(os.path.abspath(skoolfile))))
+        finally:
+            clear_preloaded()
+        self.assertEqual([(INSTRUCTION, 'c32768 NOP\n', 11)], list(read_skool(skoolfile)))
@@ -2,10 +2,40 @@ import re
 import unittest
 
 from skoolkittest import SkoolKitTestCase
-from skoolkit.skoolmacro import (parse_ints, parse_strings, parse_brackets, parse_image_macro,
+from skoolkit import SkoolParsingError, skoolmacro
+from skoolkit.skoolmacro import (evaluate, expand_macros, parse_ints, parse_strings, parse_brackets, parse_image_macro,
                                  parse_address_range, MacroParsingError, NoParametersError, MissingParameterError,
                                  TooManyParametersError)
 
+class MockWriter:
+    def __init__(self):
+        self.macros = {
+            '#A': self.expand_a,
+            '#B': self.expand_b,
+            '#C': self.expand_c,
+            '#D': self.expand_d
+        }
+
+    def expand(self, text):
+        return expand_macros(self, text)
+
+    def expand_a(self, text, index):
+        # #An -> 'x' * n
+        end, num = parse_ints(text, index, 1, (1,))
+        return end, 'x' * num
+
+    def expand_b(self, text, index):
+        # #B(text) -> text
+        return parse_brackets(text, index, '')
+
+    def expand_c(self, text, index):
+        # #C -> #
+        return index, '#'
+
+    def expand_d(self, text, index):
+        # #D -> A
+        return index, 'A'
+
 class SkoolMacroTest(SkoolKitTestCase):
     def test_parse_ints_without_kwargs(self):
         # No parameters expected
@@ -492,5 +522,119 @@ class SkoolMacroTest(SkoolKitTestCase):
             self.assertEqual(end, len(spec), spec)
             self.assertEqual(exp_addresses, addresses)
 
+    def test_evaluate(self):
+        expressions = (
+            ('0', 0),
+            ('00', 0),
+            ('32768', 32768),
+            ('$8000', 32768),
+            ('$ff', 255),
+            (' 1 + 2 ', 3),
+            ('7/2', 3),
+            ('-7/2', -4),
+            ('7%3', 1),
+            ('2**10', 1024),
+            ('-2**2', -4),
+            ('2**-1', 0),
+            ('2**3**2', 512),
+            ('1+2*3', 7),
+            ('(1+2)*3', 9),
+            ('--1', 1),
+            ('1-2-3', -4),
+            ('6&3', 2),
+            ('6|3', 7),
+            ('6^3', 5),
+            ('1<<4', 16),
+            ('256>>4', 16),
+            ('1+1<<2', 8),
+            ('1|2^3&4', 3),
+            ('1==1', 1),
+            ('1!=1', 0),
+            ('1<2<3', 1),
+            ('3>2>1', 1),
+            ('1<3>2', 1),
+            ('1<3<2', 0),
+            ('2>=2<=2', 1),
+            ('(1<2)+1', 2),
+            ('0||5', 5),
+            ('2&&3', 3),
+            ('0&&1/0', 0),
+            ('1||1/0', 1),
+            ('1 == 2 || (1 <= 2 && 2 < 3)', 1),
+            ('1 &lt; 2 &amp;&amp; 3 &gt; 2', 1)
+        )
+        for expr, exp_value in expressions:
+            self.assertEqual(exp_value, evaluate(expr), expr)
+
+    def test_evaluate_invalid_expressions(self):
+        for expr in ('', ' ', '()', '(1', '1)', '1 2', '010', '$', '$G', 'ff', '1+', '*1', '1//2', '1***2', '1=2',
+                     '1<>2', '!1', '1&&&2', '1|||2', '1/0', '1%0', '1<<-1', '2**0.5', '(1)(2)', 'len(1)', '1.5'):
+            with self.assertRaises(ValueError, msg=expr):
+                evaluate(expr)
+
+    def test_evaluate_with_trailing_newline(self):
+        for expr in ('12\n', '$1F\n', '0\n', '1+2\n'):
+            with self.assertRaises(ValueError, msg=repr(expr)):
+                evaluate(expr)
+
+    def test_evaluate_safe(self):
+        self.assertEqual(evaluate('0x10', True), 16)
+        with self.assertRaises(ValueError):
+            evaluate('0x10')
+
+    def test_evaluate_cache(self):
+        skoolmacro._evaluate.cache_clear()
+        for i in range(3):
+            self.assertEqual(evaluate('1+2*3'), 7)
+            with self.assertRaises(ValueError):
+                evaluate('1+')
+        cache_info = skoolmacro._evaluate.cache_info()
+        self.assertEqual(cache_info.misses, 2)
+        self.assertEqual(cache_info.hits, 4)
+        self.assertEqual(cache_info.maxsize, skoolmacro.EXPR_CACHE_SIZE)
+
+    def test_cached_maps_are_read_only(self):
+        default, m = skoolmacro._get_map('(a,1:b)', ('a', '1:b'))
+        self.assertEqual(('a', {1: 'b'}), (default, dict(m)))
+        with self.assertRaises(TypeError):
+            m[2] = 'c'
+        self.assertIs(m, skoolmacro._get_map('(a,1:b)', ('a', '1:b'))[1])
+
+    def test_expand_macros(self):
+        writer = MockWriter()
+        texts = (
+            ('', ''),
+            ('No macros', 'No macros'),
+            ('#A', 'x'),
+            ('#A3 and #A2', 'xxx and xx'),
+            ('#A(1+1)#A0#A', 'xxx'),
+            ('&#160;#A2', '&#160;xx'),
+            ('#B(#A2) then #B(#B(#A3))', 'xx then xxx'),
+            ('#B(#A)2', 'xx'),
+            ('#A#(#B(2))', 'xx'),
+            ('#C#D', 'x'),
+            ('#C#C#D', '#x'),
+            ('#C#C#C#D3', '##xxx'),
+            ('#B(#)A2', 'xx'),
+            ('#B(#)#D2', 'xx'),
+            ('##B(A)2', 'xx'),
+        )
+        for text, exp_output in texts:
+            self.assertEqual(exp_output, expand_macros(writer, text), text)
+
+    def test_expand_macros_caches_macro_positions(self):
+        skoolmacro._find_macros.cache_clear()
+        for i in range(3):
+            self.assertEqual('x and xx', expand_macros(MockWriter(), '#A and #A2'))
+        cache_info = skoolmacro._find_macros.cache_info()
+        self.assertEqual(cache_info.misses, 1)
+        self.assertEqual(cache_info.hits, 2)
+        self.assertEqual(cache_info.maxsize, skoolmacro.MACRO_CACHE_SIZE)
+
+    def test_expand_macros_unknown_macro(self):
+        for text, macro in (('#Z', '#Z'), ('#A #Y', '#Y'), ('#C#B(BC)', '#BC')):
+            with self.assertRaisesRegex(SkoolParsingError, '^Found unknown macro: {}$'.format(macro)):
+                expand_macros(MockWriter(), text)
+
 if __name__ == '__main__':
     unittest.main()
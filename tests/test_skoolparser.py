@@ -1,9 +1,13 @@
+import os
+import pickle
 import unittest
+from unittest.mock import patch
 import re
 
 from skoolkittest import SkoolKitTestCase
 from skoolkit import SkoolParsingError, BASE_10, BASE_16
-from skoolkit.skoolparser import SkoolParser, TableParser, set_bytes, CASE_LOWER, CASE_UPPER
+from skoolkit.skoolparser import (SkoolParser, TableParser, build_skool_index, get_skool_index, set_bytes,
+                                  CASE_LOWER, CASE_UPPER)
 
 TEST_BASE_CONVERSION_SKOOL = r"""
 c30000 LD A,%11101011
@@ -1211,6 +1215,57 @@ class SkoolParserTest(SkoolKitTestCase):
         with self.assertRaisesRegex(SkoolParsingError, error):
             self._get_parser(skool, *args, **kwargs)
 
+    def test_pickle(self):
+        skool = """
+            @start
+            ; Routine
+            c30000 CALL 30010 ; Call the other routine
+             30003 LD HL,30020
+             30006 JR 30000
+
+            ; Other routine
+            c30010 JP 30000
+
+            ; Data
+            b30020 DEFB 1
+            r32768 other
+             32768 DEFB 2
+        """.replace('\n            ', '\n')
+        parser = self._get_parser(skool, html=True)
+        loaded = pickle.loads(pickle.dumps(parser))
+        self.assertEqual([e.address for e in loaded.memory_map], [30000, 30010, 30020])
+        routine, other, data = loaded.memory_map
+        self.assertIs(loaded.get_entry(30010), other)
+        self.assertIs(loaded.get_instruction(30003).container, routine)
+        self.assertEqual([i.address for i in routine.instructions], [30000, 30003, 30006])
+        self.assertIs(routine.instructions[0].reference.entry, other)
+        self.assertIs(routine.instructions[1].reference.entry, data)
+        self.assertEqual(routine.instructions[0].comment.text, 'Call the other routine')
+        self.assertEqual(routine.referrers, [routine, other])
+        self.assertEqual(loaded.get_instruction(30000).referrers, [routine, other])
+        self.assertEqual(loaded.get_entry_point_refs(30010), [30000])
+        self.assertTrue(loaded.get_instruction(32768, 'other').container.is_remote())
+        self.assertEqual(loaded.snapshot[30020], 1)
+
+    def test_model_objects_have_no_instance_dict(self):
+        skool = """
+            @start
+            ; Routine
+            ;
+            ; .
+            ;
+            ; A Value
+            c30000 JP 30000 ; Loop
+            r32768 other
+             32768 DEFB 2
+        """.replace('\n            ', '\n')
+        parser = self._get_parser(skool)
+        entry = parser.get_entry(30000)
+        instruction = entry.instructions[0]
+        remote_entry = parser.get_instruction(32768, 'other').container
+        for obj in (entry, remote_entry, instruction, instruction.comment, instruction.reference, entry.registers[0]):
+            self.assertFalse(hasattr(obj, '__dict__'), obj.__class__.__name__)
+
     def test_invalid_entry_address(self):
         self.assert_error('c3000f RET', "Invalid address: '3000f'")
 
@@ -2176,6 +2231,26 @@ class SkoolParserTest(SkoolKitTestCase):
         for address, operation in exp_instructions:
             self.assertEqual(parser.get_instruction(address).operation, operation)
 
+    def test_case_and_base_conversions_are_not_shared_between_modes(self):
+        skool = '\n'.join((
+            'c32768 LD IXH,10',
+            ' 32771 LD IXH,10',
+            ' 32774 JP 32768',
+            ' 32777 JP 32768'
+        ))
+        exp_operations = (
+            ({}, ('LD IXH,10', 'LD IXH,10', 'JP 32768', 'JP 32768')),
+            ({'base': BASE_16}, ('LD IXH,$0A', 'LD IXH,$0A', 'JP $8000', 'JP $8000')),
+            ({'base': BASE_16, 'case': CASE_LOWER}, ('ld ixh,$0a', 'ld ixh,$0a', 'jp $8000', 'jp $8000')),
+            ({'base': BASE_16, 'case': CASE_UPPER}, ('LD IXh,$0A', 'LD IXh,$0A', 'JP $8000', 'JP $8000')),
+            ({'case': CASE_UPPER}, ('LD IXh,10', 'LD IXh,10', 'JP 32768', 'JP 32768')),
+            ({'base': BASE_10, 'case': CASE_LOWER}, ('ld ixh,10', 'ld ixh,10', 'jp 32768', 'jp 32768'))
+        )
+        for kwargs, exp_ops in exp_operations:
+            parser = self._get_parser(skool, **kwargs)
+            operations = tuple(i.operation for e in parser.memory_map for i in e.instructions)
+            self.assertEqual(exp_ops, operations, 'Mode: {}'.format(kwargs))
+
     def test_registers_upper(self):
         skool = '\n'.join((
             '; Test parsing of register blocks in upper case mode',
@@ -2320,6 +2395,24 @@ class SkoolParserTest(SkoolKitTestCase):
         ]
         self.assertEqual(exp_warnings, warnings)
 
+    def test_label_substitution_warnings_are_written_by_warn(self):
+        skool = '\n'.join((
+            '@start',
+            'c30000 JR 30001',
+            ' 30002 JP 30003',
+            ' 30005 CALL 30006'
+        ))
+        with patch('skoolkit.skoolparser.warn') as mock_warn:
+            parser = self._get_parser(skool, asm_mode=2, warnings=True)
+        exp_warnings = [
+            'Unreplaced operand: 30000 JR 30001',
+            'Unreplaced operand: 30002 JP 30003',
+            'Unreplaced operand: 30005 CALL 30006'
+        ]
+        self.assertEqual(exp_warnings, [c[0][0] for c in mock_warn.call_args_list])
+        self.assertEqual('', self.err.getvalue())
+        self.assertEqual(exp_warnings, parser._warnings)
+
     def test_suppress_warnings(self):
         skool = '\n'.join((
             '@start',
@@ -3401,6 +3494,136 @@ class SkoolParserTest(SkoolKitTestCase):
         self.assertIsNone(parser.get_instruction(40001))
         self.assertIsNone(parser.get_instruction(40002))
 
+    def _compare_lazy_parser(self, skool, min_address, max_address, **kwargs):
+        skoolfile = self.write_text_file(skool, suffix='.skool')
+        self.tempfiles.append(skoolfile + '.idx')
+        full = SkoolParser(skoolfile, min_address=min_address, max_address=max_address, **kwargs)
+        lazy = SkoolParser(skoolfile, min_address=min_address, max_address=max_address, lazy=True, **kwargs)
+        self.assertTrue(os.path.isfile(skoolfile + '.idx'))
+        for attr in ('header', 'properties', 'equs', 'asm_writer_class', 'base_address', 'end_address'):
+            self.assertEqual(getattr(full, attr), getattr(lazy, attr), attr)
+        self.assertEqual([e.address for e in full.memory_map], [e.address for e in lazy.memory_map])
+        for f_entry, l_entry in zip(full.memory_map, lazy.memory_map):
+            self.assertEqual(f_entry.description, l_entry.description)
+            self.assertEqual(f_entry.end_comment, l_entry.end_comment)
+            self.assertEqual(
+                [(i.address, i.operation, i.asm_label, i.comment and i.comment.text) for i in f_entry.instructions],
+                [(i.address, i.operation, i.asm_label, i.comment and i.comment.text) for i in l_entry.instructions]
+            )
+        self.assertEqual(sorted(full._instructions), sorted(lazy._instructions))
+        return lazy
+
+    def test_lazy_min_and_max_address(self):
+        skool = '\n'.join((
+            '@start',
+            '@set-bullet=+',
+            '; Header comment',
+            '',
+            '; Routine at 30000',
+            '@label=START',
+            'c30000 LD A,(30003) ; {Load A',
+            ' 30003 RET          ; and return}',
+            '',
+            'd30004 DEFB 4',
+            '',
+            '@isub+begin',
+            '; Data at 30005',
+            'b30005 DEFB 5 ; Five',
+            '; End comment.',
+            '@replace=/#five/5',
+            '',
+            '; Routine at 30006',
+            'c30006 JP 30000 ; Jump back #five',
+            '@isub+end',
+            '',
+            '; Remote entry',
+            'r30000 other',
+            ' 30010 LD B,1',
+            '',
+            '; Routines at 30010 and 30011',
+            '@label=THERE',
+            'c30010 RET ; Here',
+            '; Another one',
+            'c30011 RET ; There',
+            '@end',
+            '',
+            'c30012 RET',
+        ))
+        for min_address, max_address in ((1, 65536), (30003, 30006), (30005, 30006), (30006, 30010),
+                                          (30000, 30011), (30011, 65536), (30012, 65536)):
+            for asm_mode in (0, 1):
+                self._compare_lazy_parser(skool, min_address, max_address, asm_mode=asm_mode, html=True)
+        parser = self._compare_lazy_parser(skool, 30006, 65536, asm_mode=1)
+        self.assertEqual(parser.header, ['Header comment'])
+        self.assertEqual(parser.properties, {'bullet': '+'})
+        self.assertEqual(parser.get_instruction(30006).comment.text, 'Jump back 5')
+
+    def test_lazy_mode_parses_only_required_entries(self):
+        skool = '\n'.join((
+            'b30000 DEFB 1',
+            '',
+            'b30001 DEFB 2',
+            '',
+            'b30002 DEFB 3',
+        ))
+        parser = self._compare_lazy_parser(skool, 30001, 30002)
+        self.assertEqual([30001], [e.address for e in parser.memory_map])
+        self.assertEqual(parser.snapshot[30000:30003], [0, 2, 0])
+
+    def test_build_skool_index(self):
+        skool = '\n'.join((
+            '; Header',
+            '',
+            '',
+            '@label=START',
+            'c30000 RET',
+            '@set-bullet=*',
+            '',
+            'd30001 DEFB 1',
+            '',
+            '; Remote entry',
+            'r30000 other',
+            '',
+            '@ssub+begin',
+            'b30001 DEFB 1',
+            '; Data',
+            'b$7532 DEFB 2',
+            '@ssub+end',
+            '',
+            'bxxxxx DEFB 2',
+            '',
+        ))
+        skoolfile = self.write_text_file(skool, suffix='.skool')
+        index = build_skool_index(skoolfile)
+        exp_index = [
+            [0, 11, None, []],
+            [11, 50, [30000], ['@set-bullet=*']],
+            [50, 94, None, []],
+            [94, 152, [30001, 30002], ['@ssub+begin', '@ssub+end']],
+            [152, 166, None, []]
+        ]
+        self.assertEqual(exp_index, index)
+
+    def test_get_skool_index(self):
+        skoolfile = self.write_text_file('b30000 DEFB 0\n\nb30001 DEFB 1\n', suffix='.skool')
+        index_file = skoolfile + '.idx'
+        self.tempfiles.append(index_file)
+        self.assertEqual(get_skool_index(skoolfile), [[0, 15, [30000], []], [15, 29, [30001], []]])
+        self.assertTrue(os.path.isfile(index_file))
+        with open(index_file) as f:
+            index_json = f.read()
+
+        # The index is read from the index file if it is up to date
+        with patch('skoolkit.skoolparser.build_skool_index') as mock_build_skool_index:
+            self.assertEqual(get_skool_index(skoolfile), [[0, 15, [30000], []], [15, 29, [30001], []]])
+        mock_build_skool_index.assert_not_called()
+
+        # The index is rebuilt if the skool file changes
+        self.write_text_file('b30000 DEFB 0,0\n', skoolfile)
+        self.assertEqual(get_skool_index(skoolfile), [[0, 16, [30000], []]])
+        with open(index_file) as f:
+            self.assertNotEqual(index_json, f.read())
+
     def test_duplicate_instruction_addresses(self):
         skool = '\n'.join((
             'c32768 LD A,10',
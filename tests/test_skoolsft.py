@@ -1,5 +1,7 @@
 from io import StringIO
+import os
 import unittest
+from unittest.mock import patch
 
 from skoolkittest import SkoolKitTestCase
 from skoolkit import SkoolParsingError
@@ -440,6 +442,28 @@ class SftWriterTest(SkoolKitTestCase):
     def test_sftwriter(self):
         self._test_sft(TEST_SKOOL, TEST_SFT)
 
+    def test_cache(self):
+        skoolfile = self.write_text_file(TEST_SKOOL, suffix='.skool')
+        cache_dir = self.make_directory()
+        SftWriter(skoolfile, cache_dir=cache_dir).write()
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(TEST_SFT, self.out.getvalue().split('\n')[:-1])
+
+        self.clear_streams()
+        with patch.object(SftWriter, '_parse_skool', side_effect=AssertionError):
+            SftWriter(skoolfile, cache_dir=cache_dir).write()
+        self.assertEqual(TEST_SFT, self.out.getvalue().split('\n')[:-1])
+
+        self.clear_streams()
+        SftWriter(skoolfile, cache_dir=cache_dir).write(min_address=1)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        self.clear_streams()
+        with patch.object(SftWriter, '_parse_skool', wraps=SftWriter(skoolfile)._parse_skool) as mock_parse:
+            SftWriter(skoolfile, cache_dir=cache_dir, rebuild_cache=True).write()
+        self.assertEqual(mock_parse.call_count, 1)
+        self.assertEqual(TEST_SFT, self.out.getvalue().split('\n')[:-1])
+
     def test_write_hex(self):
         self._test_sft('c40177 RET', ['cC$9CF1,1'], write_hex=1)
 
@@ -3,7 +3,7 @@ import unittest
 from unittest.mock import patch, Mock
 
 from skoolkittest import SkoolKitTestCase
-from skoolkit import sna2skool, SkoolKitError, VERSION
+from skoolkit import sna2skool, snaskool, SkoolKitError, VERSION
 from skoolkit.config import COMMANDS
 
 # Binary data designed to test the default static code analysis algorithm:
@@ -392,6 +392,7 @@ class OptionsTest(SkoolKitTestCase):
         self.assertEqual(options.defb_mod, 1)
         self.assertEqual(options.line_width, 79)
         self.assertFalse(options.zfill)
+        self.assertEqual(options.tstates, 0)
         self.assertEqual(options.params, [])
 
     @patch.object(sna2skool, 'run', mock_run)
@@ -649,6 +650,27 @@ class OptionsTest(SkoolKitTestCase):
         self.assertEqual(['b 65532', 't 65533'], gen_ctl)
         self.assertTrue(mock_skool_writer.wrote_skool)
 
+    @patch.object(sna2skool, 'CtlParser', MockCtlParser)
+    @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
+    def test_option_g_with_text_and_data_blocks(self):
+        ctlfile = self.write_text_file()
+        data = [
+            72, 105, 32, 116, 104, 101, 114, 101, # 30000 DEFM "Hi there"
+            1, 2,                                 # 30008 DEFB 1,2
+            97, 103, 97, 105, 110,                # 30010 DEFM "again"
+            201,                                  # 30015 RET
+            5, 5, 5, 5, 9, 201,                   # 30016 DEFB 5,5,5,5,9,201
+            62, 1,                                # 30022 LD A,1
+            201                                   # 30024 RET
+        ]
+        binfile = self.write_bin_file(data)
+        output, error = self.run_sna2skool('-g {} -o 30000 {}'.format(ctlfile, binfile))
+        self.assertEqual(error, '')
+        with open(ctlfile, 'r') as f:
+            gen_ctl = [line.rstrip() for line in f]
+        self.assertEqual(['t 30000', 'c 30015', 'b 30016', 'c 30022', 'i 30025'], gen_ctl)
+        self.assertTrue(mock_skool_writer.wrote_skool)
+
     @patch.object(sna2skool, 'CtlParser', MockCtlParser)
     @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
     def test_option_g_with_end_address_after_ret(self):
@@ -742,14 +764,36 @@ class OptionsTest(SkoolKitTestCase):
 
     @patch.object(sna2skool, 'CtlParser', MockCtlParser)
     @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
-    def _test_option_M(self, code_map, option, map_file=False):
+    def test_options_g_and_M_with_unexecuted_entry_points(self):
+        ctlfile = self.write_text_file()
+        data = [
+            205, 52, 117,      # 30000 CALL 30004
+            201,               # 30003 RET
+            205, 56, 117,      # 30004 CALL 30008
+            201,               # 30007 RET
+            62, 1,             # 30008 LD A,1
+            201,               # 30010 RET
+            255, 254, 253, 252 # 30011 DEFB 255,254,253,252
+        ]
+        binfile = self.write_bin_file(data)
+        mapfile = self.write_bin_file(self._create_z80_map([30000, 30003]))
+        output, error = self.run_sna2skool('-g {} -M {} -o 30000 -e 30015 {}'.format(ctlfile, mapfile, binfile))
+        self.assertEqual(error, 'Reading {}\n'.format(mapfile))
+        with open(ctlfile, 'r') as f:
+            gen_ctl = [line.rstrip() for line in f]
+        self.assertEqual(['c 30000', 'c 30004', 'c 30008', 'b 30011', 'i 30015'], gen_ctl)
+        self.assertTrue(mock_skool_writer.wrote_skool)
+
+    @patch.object(sna2skool, 'CtlParser', MockCtlParser)
+    @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
+    def _test_option_M(self, code_map, option, map_file=False, line_sep='\n'):
         ctlfile = self.write_text_file()
         binfile = self.write_bin_file(TEST_MAP_BIN, suffix='.bin')
         if map_file:
             code_map_file = self.write_bin_file(code_map, suffix='.map')
             exp_error = 'Reading {}\n'.format(code_map_file)
         else:
-            code_map_file = self.write_text_file('\n'.join(code_map), suffix='.log')
+            code_map_file = self.write_text_file(line_sep.join(code_map), suffix='.log')
             exp_error = 'Reading {}: .*100%\x08\x08\x08\x08\n'.format(code_map_file)
         output, error = self.run_sna2skool('-g {} {} {} -o {} {}'.format(ctlfile, option, code_map_file, TEST_MAP_BIN_ORG, binfile), out_lines=False)
         match = re.match(exp_error, error)
@@ -781,6 +825,51 @@ class OptionsTest(SkoolKitTestCase):
     def test_option_M_zero_hexadecimal(self):
         self._test_option_M(self._create_zero_log(TEST_MAP, False), '--map')
 
+    @patch.object(snaskool, 'LOG_CHUNK_SIZE', 64)
+    def test_option_M_fuse_in_chunks(self):
+        self._test_option_M(self._create_fuse_profile(TEST_MAP), '-M')
+
+    @patch.object(snaskool, 'LOG_CHUNK_SIZE', 64)
+    @patch.object(snaskool, 'LOG_PARALLEL_MIN_CHUNKS', 2)
+    @patch.object(snaskool.os, 'cpu_count', Mock(return_value=2))
+    def test_option_M_spud_in_chunks_with_workers(self):
+        self._test_option_M(self._create_spud_log(TEST_MAP), '--map')
+
+    @patch.object(sna2skool, 'CtlParser', MockCtlParser)
+    @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
+    def test_option_M_progress(self):
+        ctlfile = self.write_text_file()
+        binfile = self.write_bin_file(TEST_MAP_BIN, suffix='.bin')
+        code_map_file = self.write_text_file('\n'.join(self._create_fuse_profile(TEST_MAP) * 100), suffix='.log')
+        output, error = self.run_sna2skool('-g {} -M {} -o {} {}'.format(ctlfile, code_map_file, TEST_MAP_BIN_ORG, binfile), out_lines=False)
+        percentages = re.findall('([0-9]+)%', error)
+        self.assertGreater(len(percentages), 90)
+        self.assertEqual(percentages, sorted(set(percentages), key=int))
+        self.assertEqual(percentages[-1], '100')
+
+    @patch.object(snaskool, 'LOG_CHUNK_SIZE', 64)
+    def test_option_M_zero_in_chunks_with_crlf(self):
+        self._test_option_M(self._create_zero_log(TEST_MAP, False), '-M', line_sep='\r\n')
+
+    @patch.object(sna2skool, 'CtlParser', MockCtlParser)
+    @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
+    def test_option_M_multiple_times(self):
+        ctlfile = self.write_text_file()
+        binfile = self.write_bin_file(TEST_MAP_BIN, suffix='.bin')
+        z80_map = self.write_bin_file(self._create_z80_map(TEST_MAP[::2]), suffix='.map')
+        specemu_map = self.write_bin_file(self._create_specemu_map(TEST_MAP[1::3]), suffix='.map')
+        fuse_profile = self.write_text_file('\n'.join(self._create_fuse_profile(TEST_MAP[1::2])), suffix='.log')
+        options = '-M {} --map {} -M {}'.format(z80_map, specemu_map, fuse_profile)
+        output, error = self.run_sna2skool('-g {} {} -o {} {}'.format(ctlfile, options, TEST_MAP_BIN_ORG, binfile), out_lines=False)
+        exp_error = 'Reading {}\nReading {}\nReading {}: .*100%\x08\x08\x08\x08\n'.format(z80_map, specemu_map, fuse_profile)
+        match = re.match(exp_error, error)
+        if match is None or match.group() != error:
+            self.fail('"{}" != "{}"'.format(error, exp_error))
+        with open(ctlfile, 'r') as f:
+            lines = [line.rstrip() for line in f]
+        self.assertEqual(TEST_MAP_CTL_G.split('\n'), lines)
+        self.assertTrue(mock_skool_writer.wrote_skool)
+
     @patch.object(sna2skool, 'read_bin_file', Mock(return_value=[]))
     def _test_option_M_invalid_map(self, code_map, line_no, invalid_line, error):
         ctlfile = self.write_text_file()
@@ -793,6 +882,12 @@ class OptionsTest(SkoolKitTestCase):
         code_map = ['0xABCF,8', invalid_line, '0xABD2,5']
         self._test_option_M_invalid_map(code_map, 2, invalid_line, 'Cannot parse address')
 
+    @patch.object(snaskool, 'LOG_CHUNK_SIZE', 16)
+    def test_option_M_unparseable_address_in_later_chunk(self):
+        invalid_line = 'PC = FG  HL = 0000'
+        code_map = ['PC = 8000  HL = 0000'] * 9 + [invalid_line, 'PC = 8002  HL = 0000']
+        self._test_option_M_invalid_map(code_map, 10, invalid_line, 'Cannot parse address')
+
     def test_option_M_address_out_of_range(self):
         invalid_line = '12345\t11113\tNOP'
         code_map = ['All numbers are in hexadecimal', '8000\t11111\tNOP', invalid_line, '8002\t11117\tNOP']
@@ -1129,6 +1224,48 @@ class OptionsTest(SkoolKitTestCase):
             self.assertEqual(mock_skool_writer.options.line_width, line_width)
             self.assertTrue(mock_skool_writer.wrote_skool)
 
+    @patch.object(sna2skool, 'CtlParser', MockCtlParser)
+    @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
+    def test_option_x(self):
+        data = (
+            243,           # 30000 DI
+            62, 1,         # 30001 LD A,1
+            24, 3,         # 30003 JR 30008
+            1, 2, 3,       # 30005 DEFB 1,2,3
+            205, 12, 117,  # 30008 CALL 30012
+            118,           # 30011 HALT
+            201,           # 30012 RET
+        )
+        binfile = self.write_bin_file(data, suffix='.bin')
+        exp_ctl = ['c 30000', 'b 30005', 'c 30008', 'i 30013']
+        for option in ('-x', '--run'):
+            ctlfile = self.write_text_file()
+            output, error = self.run_sna2skool('-g {} {} 1000 -o 30000 {}'.format(ctlfile, option, binfile), out_lines=False)
+            self.assertEqual(error, 'Simulating 1000 T-states from PC=30000\n')
+            with open(ctlfile) as f:
+                self.assertEqual(exp_ctl, [line.rstrip() for line in f])
+            self.assertTrue(mock_skool_writer.wrote_skool)
+
+    @patch.object(sna2skool, 'CtlParser', MockCtlParser)
+    @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
+    def test_option_x_with_snapshot(self):
+        ram = [0] * 49152
+        ram[16384:16390] = (
+            243,           # 32768 DI
+            195, 6, 128,   # 32769 JP 32774
+            1, 2,          # 32772 DEFB 1,2
+            118            # 32774 HALT
+        )
+        header = [0] * 86
+        header[30] = 54 # Version 3
+        header[32:34] = (0, 128) # PC=32768
+        z80file = self.write_z80_file(header, ram)
+        ctlfile = self.write_text_file()
+        output, error = self.run_sna2skool('-g {} -x 100 -s 32768 -e 32775 {}'.format(ctlfile, z80file), out_lines=False)
+        self.assertEqual(error, 'Simulating 100 T-states from PC=32768\n')
+        with open(ctlfile) as f:
+            self.assertEqual(['c 32768', 'b 32772', 'c 32774', 'i 32775'], [line.rstrip() for line in f])
+
     @patch.object(sna2skool, 'get_snapshot', mock_get_snapshot)
     @patch.object(sna2skool, 'CtlParser', MockCtlParser)
     @patch.object(sna2skool, 'SkoolWriter', MockSkoolWriter)
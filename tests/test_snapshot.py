@@ -1,7 +1,7 @@
 import unittest
 
 from skoolkittest import SkoolKitTestCase
-from skoolkit.snapshot import get_snapshot, make_z80_ram_block, SnapshotError
+from skoolkit.snapshot import get_registers, get_snapshot, make_z80_ram_block, SnapshotError
 
 class SnapshotTest(SkoolKitTestCase):
     def _check_ram(self, ram, exp_ram, model, out_7ffd, pages, page):
@@ -247,5 +247,74 @@ class SZXTest(SnapshotTest):
         pages = {1: [(n + 19) & 255 for n in range(16384)]}
         self._test_szx(exp_ram, False, machine_id=2, pages=pages, page=1)
 
+class RegistersTest(SkoolKitTestCase):
+    def test_unknown_file_type(self):
+        snapshot_file = self.write_bin_file(suffix='.bin')
+        with self.assertRaisesRegex(SnapshotError, "{}: Unknown file type 'bin'".format(snapshot_file)):
+            get_registers(snapshot_file)
+
+    def test_sna_48k(self):
+        header = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 4, 150, 21, 22, 0, 128, 2, 0]
+        ram = [0] * 49152
+        ram[16384:16386] = (48, 117) # PC=30000 on the stack at 32768
+        registers = get_registers(self.write_bin_file(header + ram, suffix='.sna'))
+        exp_registers = {
+            'i': 1, '^hl': 770, '^de': 1284, '^bc': 1798, '^f': 8, '^a': 9,
+            'hl': 2826, 'de': 3340, 'bc': 3854, 'iy': 4368, 'ix': 4882,
+            'iff': 1, 'r': 150, 'f': 21, 'a': 22, 'sp': 32770, 'pc': 30000, 'im': 2
+        }
+        self.assertEqual(exp_registers, registers)
+
+    def test_sna_48k_with_sp_at_top_of_memory(self):
+        header = [0] * 27
+        header[23:25] = (255, 255) # SP=65535
+        ram = [0] * 49152
+        ram[-1] = 201
+        registers = get_registers(self.write_bin_file(header + ram, suffix='.sna'))
+        self.assertEqual(registers['sp'], 1)
+        self.assertEqual(registers['pc'], 201)
+
+    def test_sna_128k(self):
+        header = [0] * 27
+        header[23:25] = (0, 128) # SP=32768
+        tail = [48, 117, 0, 0] + [0] * (5 * 16384)
+        registers = get_registers(self.write_bin_file(header + [0] * 49152 + tail, suffix='.sna'))
+        self.assertEqual(registers['sp'], 32768)
+        self.assertEqual(registers['pc'], 30000)
+
+    def test_z80v1(self):
+        header = [1, 2, 3, 4, 5, 6, 64, 156, 7, 8, 9, 10, 1, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 1, 0, 1]
+        registers = get_registers(self.write_z80_file(header, [0] * 49152, 1))
+        exp_registers = {
+            'a': 1, 'f': 2, 'bc': 1027, 'hl': 1541, 'pc': 40000, 'sp': 2055, 'i': 9, 'r': 138,
+            'de': 3083, '^bc': 3597, '^de': 4111, '^hl': 4625, '^a': 19, '^f': 20,
+            'iy': 5653, 'ix': 6167, 'iff': 1, 'im': 1
+        }
+        self.assertEqual(exp_registers, registers)
+
+    def test_z80v3(self):
+        header = [0] * 86
+        header[30] = 54 # Version 3
+        header[32:34] = (64, 156) # PC=40000
+        header[29] = 2 # IM 2
+        registers = get_registers(self.write_z80_file(header, [0] * 49152))
+        self.assertEqual(registers['pc'], 40000)
+        self.assertEqual(registers['im'], 2)
+
+    def test_szx(self):
+        z80r = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 64, 156, 25, 26, 1, 0, 2]
+        z80r += [0] * (37 - len(z80r))
+        registers = get_registers(self.write_szx([0] * 49152, registers=z80r))
+        exp_registers = {
+            'f': 1, 'a': 2, 'bc': 1027, 'de': 1541, 'hl': 2055, '^f': 9, '^a': 10,
+            '^bc': 3083, '^de': 3597, '^hl': 4111, 'ix': 4625, 'iy': 5139, 'sp': 5653,
+            'pc': 40000, 'i': 25, 'r': 26, 'iff': 1, 'im': 2
+        }
+        self.assertEqual(exp_registers, registers)
+
+    def test_szx_without_z80r_block(self):
+        with self.assertRaisesRegex(SnapshotError, r'Z80REGS \(Z80R\) block not found'):
+            get_registers(self.write_szx([0] * 49152))
+
 if __name__ == '__main__':
     unittest.main()
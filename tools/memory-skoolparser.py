@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import tracemalloc
+import argparse
+
+# Use the current development version of SkoolKit
+SKOOLKIT_HOME = os.environ.get('SKOOLKIT_HOME')
+if not SKOOLKIT_HOME:
+    sys.stderr.write('SKOOLKIT_HOME is not set; aborting\n')
+    sys.exit(1)
+if not os.path.isdir(SKOOLKIT_HOME):
+    sys.stderr.write('SKOOLKIT_HOME={}; directory not found\n'.format(SKOOLKIT_HOME))
+    sys.exit(1)
+sys.path.insert(0, SKOOLKIT_HOME)
+
+from skoolkit.skoolparser import SkoolParser
+
+def _parse(skoolfile, html):
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        return SkoolParser(skoolfile, html=html, asm_labels=True)
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+
+def run(skoolfile, html, top):
+    tracemalloc.start()
+    parser = _parse(skoolfile, html)
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot() if top else None
+    tracemalloc.stop()
+
+    size = os.path.getsize(skoolfile)
+    num_entries = len(parser.memory_map)
+    num_instructions = sum(len(e.instructions) for e in parser.memory_map)
+    print('Skool file size: {} bytes'.format(size))
+    print('Entries: {}'.format(num_entries))
+    print('Instructions: {}'.format(num_instructions))
+    print('Memory retained: {} bytes ({:.1f}x file size)'.format(current, current / size))
+    print('Memory peak: {} bytes ({:.1f}x file size)'.format(peak, peak / size))
+    if num_instructions:
+        print('Memory per instruction: {:.0f} bytes'.format(current / num_instructions))
+    if snapshot:
+        print('Top {} allocation sites:'.format(top))
+        for stat in snapshot.statistics('lineno')[:top]:
+            print('  {}'.format(stat))
+
+###############################################################################
+# Begin
+###############################################################################
+parser = argparse.ArgumentParser(
+    usage='memory-skoolparser.py [options] FILE',
+    description="Measure the memory used by the skool file parser in the current development version of SkoolKit "
+                "to parse FILE (as tracked by tracemalloc).",
+    add_help=False
+)
+parser.add_argument('skoolfile', help=argparse.SUPPRESS, nargs='?')
+group = parser.add_argument_group('Options')
+group.add_argument('-H', '--html', action='store_true',
+                   help='Parse the skool file in HTML mode')
+group.add_argument('-t', '--top', metavar='N', type=int, default=0,
+                   help='Show the top N allocation sites')
+namespace, unknown_args = parser.parse_known_args()
+if unknown_args or namespace.skoolfile is None:
+    parser.exit(2, parser.format_help())
+run(namespace.skoolfile, namespace.html, namespace.top)
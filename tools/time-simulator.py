@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import argparse
+
+# Use the current development version of SkoolKit
+SKOOLKIT_HOME = os.environ.get('SKOOLKIT_HOME')
+if not SKOOLKIT_HOME:
+    sys.stderr.write('SKOOLKIT_HOME is not set; aborting\n')
+    sys.exit(1)
+if not os.path.isdir(SKOOLKIT_HOME):
+    sys.stderr.write('SKOOLKIT_HOME={}; directory not found\n'.format(SKOOLKIT_HOME))
+    sys.exit(1)
+sys.path.insert(0, SKOOLKIT_HOME)
+
+from skoolkit.simulator import Simulator
+from skoolkit.snapshot import get_registers, get_snapshot
+
+# A loop that exercises a mix of loads, arithmetic, bit operations, index
+# register instructions, block transfers, and CALLs/RETs
+TEST_CODE = (
+    243,                # 32768 DI
+    49, 0, 0,           # 32769 LD SP,0
+    221, 33, 0, 192,    # 32772 LD IX,49152
+    6, 0,               # 32776 LD B,0
+    221, 126, 0,        # 32778 LD A,(IX+0)
+    198, 3,             # 32781 ADD A,3
+    203, 7,             # 32783 RLC A
+    221, 119, 1,        # 32785 LD (IX+1),A
+    221, 35,            # 32788 INC IX
+    205, 40, 128,       # 32790 CALL 32808
+    16, 239,            # 32793 DJNZ 32778
+    33, 0, 192,         # 32795 LD HL,49152
+    17, 0, 208,         # 32798 LD DE,53248
+    1, 0, 1,            # 32801 LD BC,256
+    237, 176,           # 32804 LDIR
+    24, 224,            # 32806 JR 32776
+    229,                # 32808 PUSH HL
+    237, 82,            # 32809 SBC HL,DE
+    225,                # 32811 POP HL
+    201,                # 32812 RET
+)
+
+def _get_simulator(infile):
+    if infile:
+        if infile[-4:].lower() in ('.sna', '.szx', '.z80'):
+            return Simulator(get_snapshot(infile), get_registers(infile))
+        with open(infile, 'rb') as f:
+            data = f.read()
+        org = 65536 - len(data)
+        memory = [0] * org + list(data)
+        return Simulator(memory, {'pc': org})
+    memory = [0] * 65536
+    memory[32768:32768 + len(TEST_CODE)] = TEST_CODE
+    return Simulator(memory, {'pc': 32768})
+
+def _count_instructions(infile, tstates):
+    count = [0]
+    def until(simulator):
+        count[0] += 1
+        return False
+    _get_simulator(infile).run(max_tstates=tstates, until=until)
+    return count[0]
+
+def _time_run(infile, tstates):
+    simulator = _get_simulator(infile)
+    start = time.time()
+    simulator.run(max_tstates=tstates)
+    return time.time() - start
+
+def run(infile, tstates, trials):
+    instructions = _count_instructions(infile, tstates)
+    elapsed = min(_time_run(infile, tstates) for n in range(trials))
+    print('Instructions: {}'.format(instructions))
+    print('T-states: {}'.format(tstates))
+    print('Time: {:.3f}s'.format(elapsed))
+    print('Instructions/s: {:.0f}'.format(instructions / elapsed))
+    print('T-states/s: {:.0f}'.format(tstates / elapsed))
+
+###############################################################################
+# Begin
+###############################################################################
+parser = argparse.ArgumentParser(
+    usage='time-simulator.py [options] [FILE]',
+    description="Measure the throughput of the Z80 simulator in the current development version of SkoolKit. "
+                "FILE may be a binary file (loaded at 65536 - length and run from there) or a SNA, SZX or Z80 snapshot. "
+                "If FILE is omitted, a built-in test loop is run.",
+    add_help=False
+)
+parser.add_argument('infile', help=argparse.SUPPRESS, nargs='?')
+group = parser.add_argument_group('Options')
+group.add_argument('-n', dest='trials', metavar='N', type=int, default=3,
+                   help='Take the best of N timed runs (default: 3)')
+group.add_argument('-t', dest='tstates', metavar='T', type=int, default=10000000,
+                   help='Run for T T-states (default: 10000000)')
+namespace, unknown_args = parser.parse_known_args()
+if unknown_args:
+    parser.exit(2, parser.format_help())
+run(namespace.infile, namespace.tstates, namespace.trials)
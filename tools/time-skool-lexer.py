@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import argparse
+
+# Use the current development version of SkoolKit
+SKOOLKIT_HOME = os.environ.get('SKOOLKIT_HOME')
+if not SKOOLKIT_HOME:
+    sys.stderr.write('SKOOLKIT_HOME is not set; aborting\n')
+    sys.exit(1)
+if not os.path.isdir(SKOOLKIT_HOME):
+    sys.stderr.write('SKOOLKIT_HOME={}; directory not found\n'.format(SKOOLKIT_HOME))
+    sys.exit(1)
+sys.path.insert(0, SKOOLKIT_HOME)
+
+from skoolkit import skoolparser, skoolctl, skoolsft, skool2bin
+from skoolkit.skoollexer import lex_skool
+
+def _lex(lines):
+    for record in lex_skool(lines):
+        pass
+
+def _skoolparser(skoolfile):
+    skoolparser.SkoolParser(skoolfile)
+
+def _skoolctl(skoolfile):
+    skoolctl.SkoolParser(skoolfile, False, 0, 65536)
+
+def _skoolsft(skoolfile):
+    skoolsft.SftWriter(skoolfile)._parse_skool(0, 65536)
+
+def _skool2bin(skoolfile):
+    skool2bin.BinWriter(skoolfile)
+
+CONSUMERS = (
+    ('skoolparser', _skoolparser),
+    ('skoolctl', _skoolctl),
+    ('skoolsft', _skoolsft),
+    ('skool2bin', _skool2bin)
+)
+
+def _time(method, arg, trials):
+    elapsed = []
+    for n in range(trials):
+        start = time.time()
+        method(arg)
+        elapsed.append(time.time() - start)
+    return min(elapsed)
+
+def _report(name, count, elapsed):
+    print('{:<12} {:>8.3f}s {:>12.0f} lines/s'.format(name, elapsed, count / elapsed))
+
+def run(skoolfile, trials, lex_only):
+    with open(skoolfile) as f:
+        lines = f.readlines()
+    count = len(lines)
+    print('Lines: {}'.format(count))
+    _report('lexer', count, _time(_lex, lines, trials))
+    if not lex_only:
+        sys.stderr = open(os.devnull, 'w')
+        for name, method in CONSUMERS:
+            _report(name, count, _time(method, skoolfile, trials))
+
+###############################################################################
+# Begin
+###############################################################################
+parser = argparse.ArgumentParser(
+    usage='time-skool-lexer.py [options] FILE',
+    description="Measure the throughput (in lines per second) of the skool file lexer in the current development "
+                "version of SkoolKit, and of each of the skool file parsers that use it.",
+    add_help=False
+)
+parser.add_argument('skoolfile', help=argparse.SUPPRESS, nargs='?')
+group = parser.add_argument_group('Options')
+group.add_argument('-l', dest='lex_only', action='store_true',
+                   help='Time the lexer only')
+group.add_argument('-n', dest='trials', metavar='N', type=int, default=3,
+                   help='Take the best of N timed runs (default: 3)')
+namespace, unknown_args = parser.parse_known_args()
+if unknown_args or namespace.skoolfile is None:
+    parser.exit(2, parser.format_help())
+run(namespace.skoolfile, namespace.trials, namespace.lex_only)
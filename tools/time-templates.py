@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import tempfile
+import argparse
+
+# Use the current development version of SkoolKit
+SKOOLKIT_HOME = os.environ.get('SKOOLKIT_HOME')
+if not SKOOLKIT_HOME:
+    sys.stderr.write('SKOOLKIT_HOME is not set; aborting\n')
+    sys.exit(1)
+if not os.path.isdir(SKOOLKIT_HOME):
+    sys.stderr.write('SKOOLKIT_HOME={}; directory not found\n'.format(SKOOLKIT_HOME))
+    sys.exit(1)
+sys.path.insert(0, SKOOLKIT_HOME)
+
+from skoolkit import format_template
+from skoolkit.refparser import RefParser
+from skoolkit.skoolhtml import HtmlWriter, FileInfo
+from skoolkit.skoolparser import SkoolParser
+
+def _capture(skoolfile):
+    # Write the disassembly and memory map pages for 'skoolfile', and return
+    # the arguments of every call to HtmlWriter.format_template()
+    calls = []
+    format_template_f = HtmlWriter.format_template
+    def capture(self, name, fields, default=None):
+        calls.append((self._get_page_id(), name, dict(fields), default))
+        return format_template_f(self, name, fields, default)
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        parser = SkoolParser(skoolfile, html=True)
+        with tempfile.TemporaryDirectory() as odir:
+            writer = HtmlWriter(parser, RefParser(), FileInfo(odir, 'game', False))
+            HtmlWriter.format_template = capture
+            try:
+                writer.write_asm_entries()
+                for map_name in writer.main_memory_maps:
+                    writer.write_map(map_name)
+            finally:
+                HtmlWriter.format_template = format_template_f
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+    return writer, calls
+
+def _format_uncompiled(writer, name, fields, default):
+    # The template lookup and formatting done by HtmlWriter.format_template()
+    # before templates were compiled
+    if default is None:
+        tname = '{}-{}'.format(writer._get_page_id(), name)
+        template = writer.templates.get(tname, writer.templates[name])
+    else:
+        template = writer.templates.get(name, writer.templates[default])
+    fields.update(writer.template_subs)
+    return format_template(template, name, **fields)
+
+def _format_compiled(writer, name, fields, default):
+    return writer.format_template(name, fields, default)
+
+def _replay(method, writer, calls):
+    skoolkit = writer.skoolkit
+    for page_id, name, fields, default in calls:
+        skoolkit['page_id'] = page_id
+        method(writer, name, fields, default)
+
+def _time(method, writer, calls, trials):
+    elapsed = []
+    for n in range(trials):
+        start = time.time()
+        _replay(method, writer, calls)
+        elapsed.append(time.time() - start)
+    return min(elapsed)
+
+def run(skoolfile, trials):
+    writer, calls = _capture(skoolfile)
+    count = len(calls)
+    for page_id, name, fields, default in calls:
+        writer.skoolkit['page_id'] = page_id
+        if _format_uncompiled(writer, name, dict(fields), default) != _format_compiled(writer, name, dict(fields), default):
+            sys.stderr.write('Output of {} template differs\n'.format(name))
+            sys.exit(1)
+    print('Templates formatted: {}'.format(count))
+    results = [(label, _time(method, writer, calls, trials)) for label, method in (
+        ('uncompiled', _format_uncompiled),
+        ('compiled', _format_compiled)
+    )]
+    for label, elapsed in results:
+        print('{:<12} {:>8.3f}s {:>12.0f} templates/s'.format(label, elapsed, count / elapsed))
+    print('Speedup: {:.2f}x'.format(results[0][1] / results[1][1]))
+
+###############################################################################
+# Begin
+###############################################################################
+parser = argparse.ArgumentParser(
+    usage='time-templates.py [options] FILE',
+    description="Measure the rate (in templates per second) at which the current development version of SkoolKit "
+                "formats the HTML templates used to write the disassembly and memory map pages for FILE, with "
+                "templates compiled into render functions and without.",
+    add_help=False
+)
+parser.add_argument('skoolfile', help=argparse.SUPPRESS, nargs='?')
+group = parser.add_argument_group('Options')
+group.add_argument('-n', dest='trials', metavar='N', type=int, default=3,
+                   help='Take the best of N timed runs (default: 3)')
+namespace, unknown_args = parser.parse_known_args()
+if unknown_args or namespace.skoolfile is None:
+    parser.exit(2, parser.format_help())
+run(namespace.skoolfile, namespace.trials)